@@ -0,0 +1,336 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityQueue:
+    """Bounded, thread-safe queue of tracker output records.
+
+    When full, overflow='block' makes put() wait for space (backpressure, up to
+    `timeout`) and overflow='drop_oldest' discards the oldest record instead.
+    """
+
+    def __init__(self, maxsize=10000, overflow='drop_oldest'):
+        if overflow not in ('block', 'drop_oldest'):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._not_empty = threading.Condition(self._lock)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def put(self, item, timeout=None):
+        """Add a record; returns False if it was rejected because the queue stayed full"""
+        with self._not_full:
+            if len(self._items) >= self.maxsize:
+                if self.overflow == 'drop_oldest':
+                    self._items.popleft()
+                    self.dropped += 1
+                elif not self._not_full.wait_for(lambda: len(self._items) < self.maxsize, timeout):
+                    self.dropped += 1
+                    return False
+            self._items.append(item)
+            self._not_empty.notify()
+            return True
+
+    def drain(self, max_items=None):
+        """Remove and return up to max_items records in FIFO order"""
+        with self._lock:
+            count = len(self._items) if max_items is None else min(max_items, len(self._items))
+            batch = [self._items.popleft() for _ in range(count)]
+            if batch:
+                self._not_full.notify_all()
+            return batch
+
+    def wait(self, min_items, timeout=None, cancel_event=None):
+        """Block until at least min_items are queued, cancel_event is set or the timeout expires"""
+        with self._not_empty:
+            return self._not_empty.wait_for(
+                lambda: len(self._items) >= min_items or (cancel_event is not None and cancel_event.is_set()),
+                timeout
+            )
+
+    def wake(self):
+        """Wake any thread blocked in wait() so it can re-check its cancel event"""
+        with self._not_empty:
+            self._not_empty.notify_all()
+
+
+# ==================== Sinks ====================
+
+class ActivitySink:
+    """Destination for batches of tracker output"""
+
+    name = 'base'
+
+    def write_batch(self, batch):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemorySink(ActivitySink):
+    """Keeps the most recent records in memory (for in-process consumers and tests)"""
+
+    name = 'memory'
+
+    def __init__(self, max_records=10000):
+        self.records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def write_batch(self, batch):
+        with self._lock:
+            self.records.extend(batch)
+
+    def recent(self, limit=None):
+        with self._lock:
+            records = list(self.records)
+        return records[-limit:] if limit else records
+
+
+class FileSink(ActivitySink):
+    """Appends records as JSON lines, one write per batch"""
+
+    name = 'file'
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write_batch(self, batch):
+        payload = ''.join(json.dumps(record, separators=(',', ':'), default=str) + '\n' for record in batch)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(payload)
+
+
+def _parse_datetime(value):
+    """ISO string -> naive UTC datetime (what db.DateTime columns hold), or None if unparseable"""
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+class DatabaseSink(ActivitySink):
+    """Bulk-inserts records through Flask-SQLAlchemy (one commit per batch).
+
+    Tracker records carry client-side UUIDs where the models use integer
+    foreign keys: a UUID in a foreign key column (device_id, session_id) is
+    resolved through the referenced table's uuid column, once per batch for
+    all distinct values, and dropped if no row has it. ISO timestamps are
+    parsed into datetimes for DateTime columns.
+    """
+
+    name = 'database'
+
+    def __init__(self, db, model, app=None, cache_size=1024):
+        self.db = db
+        self.model = model
+        self.app = app
+        self.cache_size = cache_size
+        columns = model.__table__.columns
+        self._columns = set(columns.keys())
+        self._datetime_columns = {name for name, column in columns.items() if isinstance(column.type, db.DateTime)}
+        # column -> (referenced table, referenced column) for integer foreign keys into tables with a uuid column
+        self._uuid_columns = {}
+        for name, column in columns.items():
+            for foreign_key in column.foreign_keys:
+                table = foreign_key.column.table
+                if isinstance(column.type, db.Integer) and 'uuid' in table.columns:
+                    self._uuid_columns[name] = (table, foreign_key.column)
+        self._ids = OrderedDict()  # (column, uuid) -> database id, least recently used first
+
+    def _resolve(self, batch):
+        """{(column, uuid): database id} for the UUIDs in a batch's foreign key columns"""
+        resolved = {}
+        for name, (table, target) in self._uuid_columns.items():
+            missing = set()
+            for record in batch:
+                value = record.get(name)
+                if isinstance(value, str) and not value.isdigit():
+                    key = (name, value)
+                    if key in self._ids:
+                        self._ids.move_to_end(key)
+                        resolved[key] = self._ids[key]
+                    else:
+                        missing.add(value)
+            if missing:
+                rows = self.db.session.execute(
+                    self.db.select(table.c.uuid, target).where(table.c.uuid.in_(missing))
+                )
+                for uuid, database_id in rows:
+                    resolved[(name, uuid)] = self._ids[(name, uuid)] = database_id
+                while len(self._ids) > self.cache_size:
+                    self._ids.popitem(last=False)
+        return resolved
+
+    def _to_model(self, record, resolved):
+        # Record ids are client-side UUIDs; let the database assign primary keys
+        values = {k: v for k, v in record.items() if k in self._columns and k != 'id'}
+        for name in self._uuid_columns:
+            value = values.get(name)
+            if isinstance(value, str):
+                if value.isdigit():
+                    values[name] = int(value)
+                else:
+                    # Unknown devices and sessions are left unlinked rather than failing the batch
+                    values[name] = resolved.get((name, value))
+        for name in self._datetime_columns:
+            if values.get(name) is not None:
+                parsed = _parse_datetime(values[name])
+                if parsed is None:
+                    del values[name]  # fall back to the column default
+                else:
+                    values[name] = parsed
+        return self.model(**values)
+
+    def write_batch(self, batch):
+        def _write():
+            try:
+                resolved = self._resolve(batch)
+                self.db.session.add_all([self._to_model(record, resolved) for record in batch])
+                self.db.session.commit()
+            except Exception:
+                self.db.session.rollback()
+                raise
+
+        if self.app is not None:
+            with self.app.app_context():
+                _write()
+        else:
+            _write()
+
+
+class HttpSink(ActivitySink):
+    """POSTs batches as JSON to the Flask app (see /api/activities/batch)"""
+
+    name = 'http'
+
+    def __init__(self, url, timeout=10, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+
+    def write_batch(self, batch):
+        import urllib.request
+
+        body = json.dumps({'activities': batch}, separators=(',', ':'), default=str).encode('utf-8')
+        req = urllib.request.Request(self.url, data=body, headers=self.headers, method='POST')
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            if response.status >= 300:
+                raise IOError(f"HTTP sink got status {response.status}")
+
+
+# ==================== Batching ====================
+
+class BatchWriter:
+    """Moves records from an ActivityQueue to sinks in batches.
+
+    flush() can be driven externally (e.g. by the tracker's scheduler) or
+    start() runs a background thread that flushes whenever batch_size records
+    are queued or flush_interval seconds have passed. A batch that a sink fails
+    to accept is kept and retried on the next flush; past max_pending_batches
+    per sink the oldest one is dropped, logged and counted in dropped_batches
+    and dropped_records.
+    """
+
+    def __init__(self, queue, sinks=None, batch_size=100, flush_interval=10, max_pending_batches=10):
+        self.queue = queue
+        self.sinks = list(sinks or [])
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending_batches = max_pending_batches
+        self.written = 0
+        self.dropped_batches = 0
+        self.dropped_records = 0
+        self._pending = {}
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def should_flush(self):
+        return len(self.queue) >= self.batch_size
+
+    def _write(self, sink, batch):
+        try:
+            sink.write_batch(batch)
+            return True
+        except Exception as e:
+            logger.error(f"Error writing batch to {sink.name} sink: {str(e)}")
+            return False
+
+    def _defer(self, sink, batch):
+        pending = self._pending.setdefault(id(sink), deque())
+        if len(pending) >= self.max_pending_batches:
+            lost = pending.popleft()
+            self.dropped_batches += 1
+            self.dropped_records += len(lost)
+            logger.error(f"Dropped a batch of {len(lost)} records for the {sink.name} sink: "
+                         f"{self.max_pending_batches} failed batches already pending")
+        pending.append(batch)
+
+    def flush(self):
+        """Drain the queue into every sink; returns the number of records drained"""
+        with self._flush_lock:
+            drained = 0
+            # Retry batches that failed earlier first so ordering is preserved per sink
+            for sink in self.sinks:
+                pending = self._pending.get(id(sink))
+                while pending and self._write(sink, pending[0]):
+                    pending.popleft()
+
+            while True:
+                batch = self.queue.drain(self.batch_size)
+                if not batch:
+                    break
+                drained += len(batch)
+                for sink in self.sinks:
+                    pending = self._pending.get(id(sink))
+                    if pending or not self._write(sink, batch):
+                        self._defer(sink, batch)
+            self.written += drained
+            return drained
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.queue.wait(self.batch_size, timeout=self.flush_interval, cancel_event=self._stop_event)
+            self.flush()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='batch-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            # Wake the writer so it notices the stop event
+            self.queue.wake()
+            self._thread.join(timeout=self.flush_interval + 1)
+            self._thread = None
+        self.flush()
@@ -6,22 +6,64 @@ import platform
 import json
 import uuid
 import socket
-from datetime import datetime
+from datetime import datetime, timedelta
 import threading
+from window_sources import create_window_source
+from scheduler import Scheduler, AdaptiveInterval
+from system_health import HealthSampler
+from activity_queue import ActivityQueue, BatchWriter, MemorySink
+from file_watcher import InotifyWatcher
+from idle_detection import create_idle_source
 
 logger = logging.getLogger(__name__)
 
 class ActivityTracker:
-    def __init__(self):
+    def __init__(self, window_source=None, idle_source=None):
         self.is_running = False
         self.stop_event = threading.Event()
         self.current_processes = {}
         self.tracked_applications = set()
-        self.sample_interval = 5  # seconds
+        self.sample_interval = 5  # seconds, base window sampling cadence
+        self.min_sample_interval = 1  # seconds, used during rapid app switching
+        # Seconds, used while the foreground app is stable; a switch is only seen at the next sample, so this
+        # bounds how long a new app can be missed (the span boundary is placed halfway, within max / 2)
+        self.max_sample_interval = 10
+        self.adaptive_sampling = True
+        self.health_interval = 60  # seconds
+        self.flush_interval = 30  # seconds
+        self.flush_callbacks = []
+        self.scheduler = None
+        self.window_interval = AdaptiveInterval(self.sample_interval)
+        self.health_sampler = HealthSampler()
+        
+        # Tracker output is buffered and written to sinks in batches
+        self.activity_queue = ActivityQueue(maxsize=10000, overflow='drop_oldest')
+        self.memory_sink = MemorySink()
+        # While tracking, the writer's own thread moves records to the sinks so slow sinks never stall sampling
+        self.batch_writer = BatchWriter(self.activity_queue, [self.memory_sink], batch_size=50)
+        
+        # File operation tracking (see TrackingSettings.track_files / excluded_directories); off by default,
+        # and only the listed directories are watched, since every watched subdirectory costs an inotify watch
+        self.track_files = False
+        self.watched_directories = []
+        self.excluded_directories = []
+        self.file_watcher = None
+        
+        # Idle detection (see TrackingSettings.track_idle_time)
+        self.track_idle_time = True
+        self.idle_threshold = 120  # seconds without input before the user counts as idle
+        self.idle_poll_interval = 2  # seconds
+        self.idle_source = idle_source  # Created lazily for the current platform
+        self.user_idle = False
+        self.idle_started_at = None
+        self.span_idle_time = 0.0
+        self.carried_idle_time = 0.0  # Idle time of spans too short to log, added to the next logged one
+        
         self.current_device = None
         self.current_session = None
         self.device_id = None
         self.session_id = None
+        self.window_source = window_source  # Created lazily for the current platform
         
     def get_device_info(self):
         """Get current device information"""
@@ -108,148 +150,61 @@ class ActivityTracker:
         
     def get_active_window_info(self):
         """Get information about the currently active window based on the platform"""
-        active_window_info = {
-            'application_name': '',
-            'window_title': '',
-            'pid': None
-        }
-        
         try:
-            if platform.system() == 'Windows':
-                # For Windows using pywin32 (which needs to be imported here)
-                try:
-                    import win32gui
-                    import win32process
-                    
-                    window = win32gui.GetForegroundWindow()
-                    if window:
-                        active_window_info['window_title'] = win32gui.GetWindowText(window)
-                        _, pid = win32process.GetWindowThreadProcessId(window)
-                        active_window_info['pid'] = pid
-                        
-                        process = psutil.Process(pid)
-                        active_window_info['application_name'] = process.name()
-                except Exception as e:
-                    logger.error(f"Error getting Windows active window: {str(e)}")
-                    
-            elif platform.system() == 'Linux':
-                # For Linux we'll use xdotool if available
-                try:
-                    import subprocess
-                    active_window_id = subprocess.check_output(['xdotool', 'getactivewindow']).decode().strip()
-                    window_name = subprocess.check_output(['xdotool', 'getwindowname', active_window_id]).decode().strip()
-                    pid = subprocess.check_output(['xdotool', 'getwindowpid', active_window_id]).decode().strip()
-                    
-                    active_window_info['window_title'] = window_name
-                    active_window_info['pid'] = int(pid)
-                    
-                    process = psutil.Process(int(pid))
-                    active_window_info['application_name'] = process.name()
-                except Exception as e:
-                    logger.error(f"Error getting Linux active window: {str(e)}")
-                    
-            elif platform.system() == 'Darwin':
-                # For MacOS
-                try:
-                    script = '''
-                    tell application "System Events"
-                        set frontApp to name of first application process whose frontmost is true
-                        set frontAppPath to path of first application process whose frontmost is true
-                        set windowTitle to ""
-                        tell process frontApp
-                            if exists (1st window whose value of attribute "AXMain" is true) then
-                                set windowTitle to name of 1st window whose value of attribute "AXMain" is true
-                            end if
-                        end tell
-                        return {frontApp, windowTitle, frontAppPath}
-                    end tell
-                    '''
-                    import subprocess
-                    result = subprocess.check_output(['osascript', '-e', script]).decode().strip()
-                    parts = result.split(', ')
-                    
-                    active_window_info['application_name'] = parts[0] if len(parts) > 0 else ''
-                    active_window_info['window_title'] = parts[1] if len(parts) > 1 else ''
-                    
-                    # Try to find the PID of the application
-                    for proc in psutil.process_iter(['pid', 'name']):
-                        if proc.info['name'] and active_window_info['application_name'] in proc.info['name']:
-                            active_window_info['pid'] = proc.info['pid']
-                            break
-                except Exception as e:
-                    logger.error(f"Error getting MacOS active window: {str(e)}")
-        
+            if self.window_source is None:
+                self.window_source = create_window_source()
+            return self.window_source.get_active_window_info()
         except Exception as e:
             logger.error(f"General error tracking active window: {str(e)}")
-            
-        return active_window_info
+            return {
+                'application_name': '',
+                'window_title': '',
+                'pid': None
+            }
+    
+    def track_file_operations(self, paths=None, excluded_directories=None):
+        """Start watching file operations (Linux inotify) and emit coalesced file_operation records"""
+        if not InotifyWatcher.is_supported():
+            logger.warning("File operation tracking is only supported on Linux")
+            return None
+        if not (paths or self.watched_directories):
+            logger.warning("File operation tracking is enabled but no directories are configured to watch")
+            return None
+        
+        if self.file_watcher is None:
+            self.file_watcher = InotifyWatcher(
+                paths or self.watched_directories,
+                emit=self._emit_file_activities,
+                excluded_directories=self.excluded_directories if excluded_directories is None else excluded_directories
+            )
+        self.file_watcher.device_id = self.device_id
+        self.file_watcher.session_id = self.session_id
+        self.file_watcher.start()
+        return self.file_watcher
     
-    def track_file_operations(self):
-        """Track file operations (simplified version)"""
-        # This is a placeholder. In a real implementation, you'd need to use
-        # platform-specific file system monitoring like watchdog for Python
-        pass
+    def _emit_file_activities(self, records):
+        for record in records:
+            record['id'] = str(uuid.uuid4())
+            self.emit(record)
         
     def monitor_system_health(self):
-        """Collect system health metrics"""
-        try:
-            # Get CPU usage (percent)
-            cpu_usage = psutil.cpu_percent(interval=0.5)
-            
-            # Get memory usage
-            memory = psutil.virtual_memory()
-            memory_usage = memory.percent
-            
-            # Get disk usage
-            disk = psutil.disk_usage('/')
-            disk_usage = disk.percent
-            
-            # Get network I/O
-            net_io = psutil.net_io_counters()
-            network_in = net_io.bytes_recv
-            network_out = net_io.bytes_sent
-            
-            # Get battery level if available
-            battery_level = None
-            try:
-                battery = psutil.sensors_battery()
-                if battery:
-                    battery_level = battery.percent
-            except (AttributeError, NotImplementedError):
-                pass
-                
-            # Get process count
-            processes_count = len(list(psutil.process_iter()))
-            
-            # In client-side storage, we'd send this data to the browser
-            # but in this server, we'll just log it
-            health_data = {
-                'device_id': self.device_id,
-                'cpu_usage': cpu_usage,
-                'memory_usage': memory_usage,
-                'disk_usage': disk_usage,
-                'network_in': network_in,
-                'network_out': network_out,
-                'battery_level': battery_level,
-                'processes_count': processes_count,
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            
-            logger.info(f"System health: CPU {cpu_usage}%, Memory {memory_usage}%, Disk {disk_usage}%")
-            return health_data
-                
-        except Exception as e:
-            logger.error(f"Error monitoring system health: {str(e)}")
-            return None
+        """Collect system health metrics (non-blocking; also recorded in the sampler history)"""
+        self.health_sampler.device_id = self.device_id
+        return self.health_sampler.sample()
     
     def start_tracking(self):
         """Start the activity tracking process"""
         logger.info("Starting activity tracking...")
         self.is_running = True
         self.stop_event.clear()
+        self.window_interval = AdaptiveInterval(
+            self.sample_interval,
+            min_interval=self.min_sample_interval,
+            max_interval=self.max_sample_interval
+        )
         
-        # Generate unique IDs for device and session
-        self.device_id = str(uuid.uuid4())
+        # Keep a configured (or earlier) device id, so uploads stay attributed to one device; new session id
+        self.device_id = self.device_id or str(uuid.uuid4())
         self.session_id = str(uuid.uuid4())
         
         # Get device info
@@ -282,62 +237,44 @@ class ActivityTracker:
         self.current_processes = {p.pid: p.info for p in 
                                   psutil.process_iter(['name', 'username', 'create_time'])}
         
-        start_time = time.time()
-        current_app = None
-        current_window = None
-        app_start_time = start_time
+        self.current_app = None
+        self.current_window = None
+        self.app_start_time = time.monotonic()
+        self.last_sample_at = self.app_start_time
         
-        try:
-            while not self.stop_event.is_set():
-                try:
-                    # Get current active window
-                    window_info = self.get_active_window_info()
-                    
-                    # If the active app has changed, log the previous one's duration
-                    if current_app and current_app != window_info['application_name']:
-                        duration = time.time() - app_start_time
-                        
-                        # Only log if it's a meaningful duration
-                        if duration >= 2:  # At least 2 seconds
-                            # Create activity with session and device info
-                            activity = {
-                                'id': str(uuid.uuid4()),
-                                'activity_type': 'app_usage',
-                                'application_name': current_app,
-                                'window_title': current_window,
-                                'duration': int(duration),
-                                'device_id': self.device_id,
-                                'session_id': self.session_id,
-                                'timestamp': datetime.utcnow().isoformat(),
-                                'productivity_score': 0.5,  # Default score
-                                'activity_data': {"foreground": True},
-                                'idle_time': 0
-                            }
-                            
-                            logger.debug(f"Logged activity: {current_app} for {int(duration)} seconds")
-                        
-                        # Reset for new app
-                        app_start_time = time.time()
-                    
-                    # Update current app info
-                    current_app = window_info['application_name']
-                    current_window = window_info['window_title']
-                    
-                    # Monitor system health every minute
-                    current_time = time.time()
-                    if int(current_time) % 60 < 2:  # Check every minute
-                        self.monitor_system_health()
-                    
-                    # Sleep for the sample interval
-                    time.sleep(self.sample_interval)
-                    
-                except Exception as e:
-                    logger.error(f"Error in tracking loop: {str(e)}")
-                    time.sleep(self.sample_interval)
+        self.scheduler = Scheduler(stop_event=self.stop_event)
+        self.scheduler.add_task('window', self._sample_window, self.window_interval)
+        self.scheduler.add_task('flush', self._run_flush_callbacks, self.flush_interval, run_immediately=False)
+        self.batch_writer.flush_interval = self.flush_interval
+        self.batch_writer.start()
+        
+        self.user_idle = False
+        self.idle_started_at = None
+        self.span_idle_time = 0.0
+        self.carried_idle_time = 0.0
+        if self.track_idle_time:
+            if self.idle_source is None:
+                self.idle_source = create_idle_source()
+            self.scheduler.add_task('idle', self._check_idle, self.idle_poll_interval)
         
+        # Health sampling runs on its own thread so it never delays window samples
+        self.health_sampler.device_id = self.device_id
+        self.health_sampler.start(self.health_interval)
+        
+        if self.track_files:
+            self.track_file_operations()
+        
+        try:
+            self.scheduler.run()
         except KeyboardInterrupt:
             logger.info("Tracking interrupted by user")
         finally:
+            self.health_sampler.stop()
+            if self.file_watcher:
+                self.file_watcher.stop()
+            self.batch_writer.stop()
+            self._run_flush_callbacks()
+            
             # End the session
             if self.current_session:
                 self.current_session['end_time'] = datetime.utcnow().isoformat()
@@ -345,6 +282,109 @@ class ActivityTracker:
                 
             self.is_running = False
     
+    def _check_idle(self):
+        """Poll the idle source and track idle stretches within the current app span"""
+        idle_seconds = self.idle_source.get_idle_seconds()
+        if idle_seconds is None:
+            return
+        now = time.monotonic()
+        last_input = now - idle_seconds
+        
+        if idle_seconds >= self.idle_threshold:
+            if not self.user_idle:
+                self.user_idle = True
+                self.idle_started_at = max(last_input, self.app_start_time)
+                # Pause fine-grained window sampling while nobody is at the keyboard
+                self.window_interval.idle()
+                logger.debug(f"User idle for {int(idle_seconds)} seconds")
+        elif self.user_idle:
+            self.user_idle = False
+            self.span_idle_time += max(0.0, last_input - self.idle_started_at)
+            self.idle_started_at = None
+            self.window_interval.reset()
+            self.scheduler.reschedule('window')
+    
+    def _close_span(self, now):
+        """Return (active, idle) seconds for the current app span and start a new one"""
+        total = now - self.app_start_time
+        idle = self.span_idle_time
+        if self.user_idle and self.idle_started_at is not None:
+            idle += max(0.0, now - self.idle_started_at)
+            self.idle_started_at = max(now, self.idle_started_at)  # The next span starts idle
+        idle = min(idle, total)
+        
+        self.app_start_time = now
+        self.span_idle_time = 0.0
+        return total - idle, idle
+    
+    def _sample_window(self):
+        """Sample the foreground window and close out the previous app span when it changes"""
+        window_info = self.get_active_window_info()
+        sampled_at = time.monotonic()
+        previous_sample, self.last_sample_at = self.last_sample_at, sampled_at
+        
+        # If the active app has changed, log the previous one's duration
+        if self.current_app and self.current_app != window_info['application_name']:
+            # The switch happened some time since the previous sample: split the difference
+            switched_at = (previous_sample + sampled_at) / 2
+            active_time, idle_time = self._close_span(switched_at)
+            
+            # Only log if it's a meaningful duration
+            if active_time < 2:  # Less than 2 seconds of actual use
+                self.carried_idle_time += idle_time
+            else:
+                idle_time += self.carried_idle_time
+                self.carried_idle_time = 0.0
+                # Create activity with session and device info
+                activity = {
+                    'id': str(uuid.uuid4()),
+                    'activity_type': 'app_usage',
+                    'application_name': self.current_app,
+                    'window_title': self.current_window,
+                    'duration': int(active_time),
+                    'device_id': self.device_id,
+                    'session_id': self.session_id,
+                    'timestamp': (datetime.utcnow() - timedelta(seconds=sampled_at - switched_at)).isoformat(),
+                    'productivity_score': 0.5,  # Default score
+                    'activity_data': {"foreground": True},
+                    'idle_time': int(idle_time)
+                }
+                
+                self.emit(activity)
+                logger.debug(f"Logged activity: {self.current_app} for {int(active_time)} seconds "
+                             f"({int(idle_time)} seconds idle)")
+            
+            # Rapid switching: sample more often
+            if self.adaptive_sampling and not self.user_idle:
+                self.window_interval.changed()
+        elif self.adaptive_sampling and not self.user_idle:
+            # Foreground app is stable: back off
+            self.window_interval.stable()
+        
+        # Update current app info
+        self.current_app = window_info['application_name']
+        self.current_window = window_info['window_title']
+    
+    def add_sink(self, sink):
+        """Register an additional output sink (file, database, HTTP...)"""
+        self.batch_writer.add_sink(sink)
+    
+    def emit(self, record):
+        """Queue a tracker output record; a full batch wakes the batch writer thread"""
+        self.activity_queue.put(record, timeout=1)
+    
+    def flush(self):
+        """Write queued records to the sinks now, then run registered flush callbacks"""
+        self.batch_writer.flush()
+        self._run_flush_callbacks()
+    
+    def _run_flush_callbacks(self):
+        for callback in self.flush_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error flushing tracker output: {str(e)}")
+    
     def stop_tracking(self):
         """Stop the activity tracking process"""
         logger.info("Stopping activity tracking...")
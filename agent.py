@@ -0,0 +1,241 @@
+"""workflowai-agent: standalone collector that streams tracker output to the server.
+
+Run with `python agent.py --server http://host:5000`. Only psutil and the
+standard library are imported, so the agent starts quickly on end-user
+machines without the Flask/pandas stack.
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import threading
+
+from activity_tracker import ActivityTracker
+from activity_queue import ActivitySink
+import wire_format
+
+logger = logging.getLogger('workflowai.agent')
+
+
+class DiskSpool:
+    """Directory of encoded request bodies kept while the server is unreachable"""
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence = int(time.time() * 1000)
+
+    def _files(self):
+        return sorted(f for f in os.listdir(self.directory) if f.endswith('.wf'))
+
+    def __len__(self):
+        return len(self._files())
+
+    def push(self, body):
+        self._sequence += 1
+        path = os.path.join(self.directory, f"{self._sequence:020d}.wf")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        self._trim()
+
+    def _trim(self):
+        files = self._files()
+        sizes = [os.path.getsize(os.path.join(self.directory, f)) for f in files]
+        total = sum(sizes)
+        for name, size in zip(files, sizes):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+            logger.warning(f"Spool over {self.max_bytes} bytes, dropped {name}")
+
+    def peek(self):
+        """Return (name, body) of the oldest spooled body, or None"""
+        files = self._files()
+        if not files:
+            return None
+        with open(os.path.join(self.directory, files[0]), 'rb') as f:
+            return files[0], f.read()
+
+    def remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+
+class Backoff:
+    """Exponential backoff with full jitter"""
+
+    def __init__(self, base=1.0, maximum=300.0):
+        self.base = base
+        self.maximum = maximum
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def ready(self):
+        return time.monotonic() >= self.retry_at
+
+    def failed(self):
+        self.failures += 1
+        delay = random.uniform(0, min(self.maximum, self.base * (2 ** self.failures)))
+        self.retry_at = time.monotonic() + delay
+        return delay
+
+    def succeeded(self):
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class IngestSink(ActivitySink):
+    """Sends batches to /api/ingest as framed bodies, spooling to disk while offline"""
+
+    name = 'ingest'
+
+    def __init__(self, url, spool, device_info=None, timeout=10, device_id=None, token=None):
+        self.url = url
+        self.device_id = device_id
+        self.token = token
+        self.spool = spool
+        self.device_info = device_info  # callable returning the device record
+        self.timeout = timeout
+        self.backoff = Backoff()
+        self._announced = False
+        self._announcing = False
+        self._lock = threading.Lock()
+
+    def _encode(self, batch):
+        activities = [r for r in batch if r.get('activity_type') != 'system_health']
+        health = [r for r in batch if r.get('activity_type') == 'system_health']
+        body = b''
+        self._announcing = False
+        if not self._announced and self.device_info:
+            device = self.device_info()
+            if device:
+                body += wire_format.encode_frame(wire_format.FRAME_DEVICE, [device])
+                self._announcing = True
+        if activities:
+            body += wire_format.encode_frame(wire_format.FRAME_ACTIVITIES, activities)
+        if health:
+            body += wire_format.encode_frame(wire_format.FRAME_HEALTH, health)
+        return body
+
+    def _post(self, body):
+        # Imported on first upload: urllib.request dominates the agent's import time
+        import urllib.request
+
+        headers = {'Content-Type': wire_format.CONTENT_TYPE}
+        if self.device_id and self.token:
+            headers.update({'X-Device-Id': self.device_id, 'Authorization': f"Bearer {self.token}"})
+        req = urllib.request.Request(self.url, data=body, method='POST', headers=headers)
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            if response.status >= 300:
+                raise IOError(f"Ingest returned status {response.status}")
+
+    def _drain_spool(self):
+        while self.backoff.ready():
+            item = self.spool.peek()
+            if item is None:
+                return True
+            name, body = item
+            try:
+                self._post(body)
+            except Exception as e:
+                delay = self.backoff.failed()
+                logger.warning(f"Ingest unavailable ({str(e)}), retrying in {delay:.1f}s")
+                return False
+            self.spool.remove(name)
+            self.backoff.succeeded()
+        return False
+
+    def write_batch(self, batch):
+        with self._lock:
+            body = self._encode(batch)
+            if not body:
+                return
+            # Keep ordering: anything already spooled goes out first
+            if self._drain_spool():
+                try:
+                    self._post(body)
+                    self._announced = self._announced or self._announcing
+                    self.backoff.succeeded()
+                    return
+                except Exception as e:
+                    delay = self.backoff.failed()
+                    logger.warning(f"Ingest unavailable ({str(e)}), retrying in {delay:.1f}s")
+            self.spool.push(body)
+
+    def flush_spool(self):
+        with self._lock:
+            self._drain_spool()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='workflowai-agent', description='WorkFlowAI activity collector')
+    parser.add_argument('--server', default=os.environ.get('WORKFLOWAI_SERVER', 'http://localhost:5000'),
+                        help='Base URL of the WorkFlowAI server')
+    parser.add_argument('--device-id', default=os.environ.get('WORKFLOWAI_DEVICE_ID'),
+                        help='Device id the server issued a token for')
+    parser.add_argument('--token', default=os.environ.get('WORKFLOWAI_TOKEN'),
+                        help="Device token (on the server: flask --app main device-token DEVICE_ID)")
+    parser.add_argument('--spool-dir', default='~/.workflowai/spool',
+                        help='Directory for batches waiting to be sent')
+    parser.add_argument('--sample-interval', type=float, default=5, help='Window sampling interval (seconds)')
+    parser.add_argument('--health-interval', type=float, default=60, help='Health sampling interval (seconds)')
+    parser.add_argument('--flush-interval', type=float, default=30, help='Upload interval (seconds)')
+    parser.add_argument('--batch-size', type=int, default=200, help='Records per upload batch')
+    parser.add_argument('--watch', action='append', default=[], metavar='DIR',
+                        help='Track file operations under DIR (repeatable; off unless given)')
+    parser.add_argument('--no-files', action='store_true', help='Disable file operation tracking')
+    parser.add_argument('--log-level', default='INFO')
+    return parser.parse_args(argv)
+
+
+def build_tracker(args):
+    tracker = ActivityTracker()
+    tracker.device_id = args.device_id
+    tracker.sample_interval = args.sample_interval
+    tracker.health_interval = args.health_interval
+    tracker.flush_interval = args.flush_interval
+    tracker.batch_writer.batch_size = args.batch_size
+    tracker.watched_directories = [os.path.expanduser(path) for path in args.watch]
+    tracker.track_files = bool(tracker.watched_directories) and not args.no_files
+
+    # The agent ships everything upstream; no need to keep a local copy in memory
+    tracker.batch_writer.sinks.remove(tracker.memory_sink)
+    sink = IngestSink(
+        args.server.rstrip('/') + '/api/ingest',
+        DiskSpool(args.spool_dir),
+        device_info=lambda: tracker.current_device,
+        device_id=args.device_id,
+        token=args.token
+    )
+    tracker.add_sink(sink)
+    tracker.health_sampler.listeners.append(
+        lambda sample: tracker.emit({**sample, 'activity_type': 'system_health'})
+    )
+    return tracker
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.INFO),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if not (args.device_id and args.token):
+        logger.warning("No --device-id/--token given: the server will reject uploads, which stay spooled")
+    tracker = build_tracker(args)
+    logger.info(f"workflowai-agent streaming to {args.server}")
+    try:
+        tracker.start_tracking()
+    except KeyboardInterrupt:
+        tracker.stop_tracking()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
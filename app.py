@@ -1,8 +1,10 @@
 import os
+import hmac
+import atexit
 import logging
 import json
 import io
-import pandas as pd
+import click
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file, Response
 from datetime import datetime
 import threading
@@ -92,7 +94,10 @@ def inject_datetime_info():
 
 # Import activity tracking module
 from activity_tracker import ActivityTracker
+from activity_queue import FileSink
 from data_processor import DataProcessor
+from feature_store import FeatureStore
+import wire_format
 
 # Safe importing of the RL model with fallback to a stub implementation if needed
 try:
@@ -142,6 +147,11 @@ except Exception as e:
             # Choose 3-5 suggestions from our pre-shuffled list
             num_suggestions = random.randint(3, 5)
             return self.suggestions[:num_suggestions]
+        
+        def generate_suggestion_items(self, features, user_id=None):
+            # No policy to attribute feedback to, so the items carry no ids
+            return [{'id': None, 'content': content, 'category': None}
+                    for content in self.generate_suggestions(features)]
             
         def update_from_feedback(self, suggestion, feedback):
             # Provide realistic feedback acknowledgment
@@ -154,12 +164,70 @@ except Exception as e:
 
 # Initialize our components
 activity_tracker = ActivityTracker()
-data_processor = DataProcessor()
+
+# Encoded feature snapshots live next to the app in the Flask instance folder
+try:
+    feature_store = FeatureStore(os.environ.get("FEATURE_STORE_DIR", os.path.join(app.instance_path, 'feature_store')))
+    atexit.register(feature_store.close)
+except Exception as e:
+    logger.error(f"Error opening feature store: {str(e)}")
+    feature_store = None
+data_processor = DataProcessor(feature_store=feature_store)
+# App categories and process aliases come from the Application tables, loaded on the first classification
+data_processor.app_classifier.bind(app)
+
+# Records received from remote collectors (workflowai-agent, HttpSink) are folded into the DataProcessor and
+# appended to JSON lines files shared by all workers, so they survive restarts
+ingest_dir = os.environ.get("INGEST_DIR", os.path.join(app.instance_path, 'ingest'))
+ingested_activities = FileSink(os.path.join(ingest_dir, 'activities.jsonl'))
+ingested_health = FileSink(os.path.join(ingest_dir, 'health.jsonl'))
+ingested_devices = FileSink(os.path.join(ingest_dir, 'devices.jsonl'))
+
+
+@app.cli.command('device-token')
+@click.argument('device_id')
+def print_device_token(device_id):
+    """Print the upload token for a collector: flask --app main device-token DEVICE_ID"""
+    click.echo(wire_format.device_token(app.secret_key, device_id))
+
+
+def authenticated_device():
+    """Device id of an upload whose X-Device-Id and bearer token match, else None"""
+    device_id = request.headers.get('X-Device-Id', '')
+    authorization = request.headers.get('Authorization', '')
+    token = authorization[len('Bearer '):] if authorization.startswith('Bearer ') else ''
+    if not device_id or not hmac.compare_digest(token.encode('utf-8'),
+                                                wire_format.device_token(app.secret_key, device_id).encode('utf-8')):
+        return None
+    return device_id
+
+
+def claim_records(records, device_id):
+    """Stamp records with the uploading device; False if any belongs to another device"""
+    for record in records:
+        if record.setdefault('device_id', device_id) != device_id:
+            return False
+    return True
+
+
+def ingest_activities(records, device_id):
+    ingested_activities.write_batch(records)
+    # Collectors have no user login; their activity stream is keyed by the uploading device
+    data_processor.record_activities(records, device_id, device_id)
 
 # Initialize real or stub RLModel based on availability
 if rl_model_available:
     try:
-        rl_model = RLModel()
+        # Learned policy survives restarts; gunicorn workers sharing the path pool their feedback
+        rl_state_dir = os.path.join(app.instance_path, 'rl_state')
+        rl_model = RLModel(state_path=os.environ.get("RL_STATE_PATH", os.path.join(rl_state_dir, 'q_table.bin')),
+                           policy_dir=os.environ.get("RL_POLICY_DIR", os.path.join(rl_state_dir, 'users')),
+                           policy_memory_budget=int(os.environ.get("RL_POLICY_MEMORY_MB", 64)) * 1024 * 1024,
+                           templates_path=os.environ.get("SUGGESTION_TEMPLATES_PATH"),
+                           policy=os.environ.get("RL_POLICY", "q_table"),
+                           bandit_path=os.path.join(rl_state_dir, 'bandit.npz'),
+                           id_secret=app.secret_key)
+        atexit.register(rl_model.close)
         logger.info("Successfully initialized RLModel")
     except Exception as e:
         logger.error(f"Error initializing RLModel: {str(e)}")
@@ -236,6 +304,78 @@ def stop_tracking():
         flash('Activity tracking is not running.', 'info')
     return redirect(url_for('dashboard'))
 
+@app.route('/api/activities/batch', methods=['POST'])
+def ingest_activity_batch():
+    # Batched tracker output (see activity_queue.HttpSink)
+    device_id = authenticated_device()
+    if device_id is None:
+        return jsonify({'status': 'error', 'message': 'Unknown device or bad token'}), 401
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('activities'), list) or \
+            not all(isinstance(record, dict) for record in data['activities']):
+        return jsonify({'status': 'error', 'message': 'Invalid or missing activities'}), 400
+    if not claim_records(data['activities'], device_id):
+        return jsonify({'status': 'error', 'message': 'Activities for another device'}), 403
+    
+    if data['activities']:
+        ingest_activities(data['activities'], device_id)
+    return jsonify({'status': 'success', 'received': len(data['activities'])})
+
+@app.route('/api/ingest', methods=['POST'])
+def ingest_frames():
+    # Framed batches from workflowai-agent (see wire_format.py)
+    device_id = authenticated_device()
+    if device_id is None:
+        return jsonify({'status': 'error', 'message': 'Unknown device or bad token'}), 401
+    counts = {'activities': 0, 'health': 0, 'devices': 0}
+    try:
+        # Decode every frame before applying any, so a bad frame rejects the whole request
+        frames = list(wire_format.iter_frames(request.get_data()))
+    except wire_format.FrameError as e:
+        logger.warning(f"Rejected ingest request: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    for frame_type, records in frames:
+        if frame_type == wire_format.FRAME_DEVICE:
+            if any(device.get('id') != device_id for device in records):
+                return jsonify({'status': 'error', 'message': 'Device record for another device'}), 403
+        elif not claim_records(records, device_id):
+            return jsonify({'status': 'error', 'message': 'Records for another device'}), 403
+    
+    for frame_type, records in frames:
+        if not records:
+            continue
+        if frame_type == wire_format.FRAME_ACTIVITIES:
+            ingest_activities(records, device_id)
+            counts['activities'] += len(records)
+        elif frame_type == wire_format.FRAME_HEALTH:
+            ingested_health.write_batch(records)
+            data_processor.record_system_health(device_id, records)
+            counts['health'] += len(records)
+        elif frame_type == wire_format.FRAME_DEVICE:
+            ingested_devices.write_batch(records)
+            counts['devices'] += len(records)
+        else:
+            logger.warning(f"Ignoring unknown ingest frame type {frame_type}")
+    
+    return jsonify({'status': 'success', 'received': counts})
+
+@app.route('/api/activities/recent')
+def recent_activities():
+    # Most recent tracker output held in memory
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify({'status': 'success', 'activities': activity_tracker.memory_sink.recent(limit)})
+
+@app.route('/api/system_health/history')
+def system_health_history():
+    # Recent samples from the tracker's background health sampler
+    limit = request.args.get('limit', type=int)
+    history = activity_tracker.health_sampler.history
+    return jsonify({
+        'status': 'success',
+        'count': len(history),
+        'samples': history.to_dict(limit=limit)
+    })
+
 @app.route('/api/suggestion/feedback', methods=['POST'])
 def suggestion_feedback():
     suggestion_id = request.form.get('suggestion_id')
@@ -306,7 +446,8 @@ def export_data(format_type):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"{filename_prefix}_{timestamp}"
         
-        # Convert to DataFrame for easier handling
+        # Convert to DataFrame for easier handling (pandas is only needed for exports)
+        import pandas as pd
         df = pd.DataFrame(export_data)
         
         # Export in requested format
@@ -370,6 +511,10 @@ def generate_suggestions():
         # Log data received
         logger.info(f"Generating suggestions based on {len(activities)} activities for user {user_id}")
         
+        # Fold the client's health snapshot into the device's rolling statistics first
+        if system_health and device_id:
+            data_processor.record_system_health(device_id, system_health)
+        
         # Process the activities to create features for the RL model
         features = data_processor.process_activities(
             activities, 
@@ -387,7 +532,8 @@ def generate_suggestions():
         features['day_of_week'] = datetime.now().weekday()
         
         # Use the RL model to generate personalized suggestions
-        suggestions = rl_model.generate_suggestions(features)
+        suggestion_items = rl_model.generate_suggestion_items(features, user_id=user_id)
+        suggestions = [item['content'] for item in suggestion_items]
         
         # Log success
         logger.info(f"Generated {len(suggestions)} personalized suggestions")
@@ -396,6 +542,7 @@ def generate_suggestions():
         return jsonify({
             'status': 'success', 
             'suggestions': suggestions,
+            'suggestion_items': suggestion_items,
             'based_on_data': True,
             'generated_at': datetime.now().isoformat()
         })
@@ -0,0 +1,211 @@
+import logging
+import threading
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Productivity tiers in priority order: an app matching keywords of several tiers gets the first
+TIERS = ('high', 'medium', 'low')
+
+
+def tier_for_score(score):
+    """Map a 0..1 productivity score to a productivity tier"""
+    if score is None:
+        return None
+    if score >= 0.7:
+        return 'high'
+    if score >= 0.4:
+        return 'medium'
+    return 'low'
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher: one pass over the text finds every keyword"""
+
+    def __init__(self, patterns):
+        # patterns: {keyword: value}
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for keyword, value in patterns.items():
+            self._add(keyword, value)
+        self._build()
+
+    def _add(self, keyword, value):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append(value)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def search(self, text):
+        """Return the values of every keyword occurring in text"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        found = []
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.extend(out[state])
+        return found
+
+
+class AppClassifier:
+    """Classifies application names into productivity tiers.
+
+    Exact process aliases (models.Application.common_processes and names)
+    win; otherwise every category keyword is matched in a single
+    Aho-Corasick pass. Results are memoized per app name in a bounded LRU
+    that is dropped whenever the tables are reloaded.
+
+    bind(app) marks the tables stale, so the first lookup loads them inside
+    the app context; later table changes invalidate them again.
+    """
+
+    def __init__(self, keywords=None, cache_size=4096):
+        self.cache_size = cache_size
+        self.version = 0
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._stale = False
+        self._app = None
+        self._listening = False
+        self._default_keywords = {tier: list(words) for tier, words in (keywords or {}).items()}
+        self.compile(self._default_keywords)
+
+    @staticmethod
+    def _normalize(name):
+        name = (name or '').strip().lower()
+        return name[:-4] if name.endswith('.exe') else name
+
+    def compile(self, keywords, aliases=None):
+        """Compile tier keywords ({tier: [keyword]}) and exact aliases ({process: tier})"""
+        patterns = {}
+        for tier in TIERS:
+            for keyword in keywords.get(tier, ()):
+                patterns.setdefault(keyword.lower(), TIERS.index(tier))
+        matcher = AhoCorasick(patterns)
+        aliases = {self._normalize(name): tier for name, tier in (aliases or {}).items() if tier}
+
+        with self._lock:
+            self._matcher = matcher
+            self._aliases = aliases
+            self._cache.clear()
+            self.version += 1
+
+    def classify(self, app_name):
+        """Return 'high', 'medium', 'low' or None for an application name"""
+        if self._stale:
+            self.reload()
+        with self._lock:
+            if app_name in self._cache:
+                self._cache.move_to_end(app_name)
+                return self._cache[app_name]
+
+        normalized = self._normalize(app_name)
+        tier = self._aliases.get(normalized)
+        if tier is None:
+            matches = self._matcher.search(normalized)
+            tier = TIERS[min(matches)] if matches else None
+
+        with self._lock:
+            self._cache[app_name] = tier
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tier
+
+    def invalidate(self):
+        """Mark the compiled tables stale; they are reloaded on the next lookup"""
+        self._stale = True
+        with self._lock:
+            self._cache.clear()
+
+    def bind(self, app=None):
+        """Load the Application tables (inside `app`'s context) on the next lookup"""
+        self._app = app
+        self.invalidate()
+
+    def reload(self):
+        self._stale = False
+        if self._app is None:
+            return self.load_from_models()
+        with self._app.app_context():
+            return self.load_from_models()
+
+    def _query_tables(self):
+        """(categories, applications) rows from models.ApplicationCategory / models.Application"""
+        from models import Application, ApplicationCategory
+        self._listen_for_changes(Application, ApplicationCategory)
+        return ApplicationCategory.query.all(), Application.query.all()
+
+    def load_tables(self, categories, applications):
+        """Compile category rows into keywords and application rows into exact aliases, on top of the defaults"""
+        keywords = {tier: list(words) for tier, words in self._default_keywords.items()}
+        aliases = {}
+        categories = {category.id: category for category in categories}
+        for category in categories.values():
+            tier = tier_for_score(category.productivity_score)
+            if tier:
+                keywords.setdefault(tier, []).append(category.name)
+
+        for application in applications:
+            category = categories.get(application.category_id)
+            score = application.productivity_score
+            if score is None and category is not None:
+                score = category.productivity_score
+            tier = tier_for_score(score)
+            if not tier:
+                continue
+            aliases[application.name] = tier
+            for process in application.common_processes or []:
+                aliases[process] = tier
+
+        self.compile(keywords, aliases)
+        logger.info(f"Loaded {len(categories)} app categories and {len(aliases)} process aliases")
+
+    def load_from_models(self):
+        """Compile keywords and aliases from the Application tables; keeps the current tables if they are unavailable"""
+        try:
+            categories, applications = self._query_tables()
+        except Exception as e:
+            logger.warning(f"Application tables unavailable, using default app categories: {str(e)}")
+            return False
+        try:
+            self.load_tables(categories, applications)
+            return True
+        except Exception as e:
+            logger.error(f"Error loading application tables: {str(e)}")
+            return False
+
+    def _listen_for_changes(self, *model_classes):
+        if self._listening:
+            return
+        from sqlalchemy import event
+
+        def _changed(mapper, connection, target):
+            self.invalidate()
+
+        for model_class in model_classes:
+            for event_name in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(model_class, event_name, _changed)
+        self._listening = True
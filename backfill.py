@@ -0,0 +1,340 @@
+"""Parallel, resumable feature backfill.
+
+Recomputes feature snapshots for historical activity after feature
+definitions change. Input is streamed once and partitioned into shards by
+(period, user bucket); shards are encoded on a process pool with
+DataProcessor.process_activities_batch and appended to a FeatureStore.
+Progress is checkpointed per shard, so rerunning the same command after a
+crash picks up where it stopped; a shard whose worker fails is not
+checkpointed and is retried by the next run.
+
+Each snapshot is encoded from the activities of its own period only (as of
+the period's end), not from the user's whole history up to that point, so
+a weekly backfill yields one feature row per user per week of activity.
+
+    python backfill.py --input activities.jsonl --work-dir backfill --store features
+    python backfill.py --synthetic-users 200 --synthetic-events 20000 --work-dir backfill --store features
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import zlib
+import shutil
+import logging
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from feature_aggregates import parse_timestamp
+
+logger = logging.getLogger('workflowai.backfill')
+
+MANIFEST = 'manifest.json'
+DONE_LOG = 'done.log'
+PERIODS = ('day', 'week', 'month')
+
+
+def period_bounds(timestamp, period):
+    """(key, end) of the period containing a timestamp; end is the snapshot's as_of"""
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    if period == 'day':
+        return day.strftime('%Y-%m-%d'), day + timedelta(days=1)
+    if period == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start.strftime('%Y-%m-%d'), start + timedelta(days=7)
+    start = day.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start.strftime('%Y-%m'), end
+
+
+def user_bucket(user_id, buckets):
+    return zlib.crc32(str(user_id).encode('utf-8')) % buckets
+
+
+def iter_input(paths):
+    """Stream activity dicts from JSON-lines files ('-' for stdin, .gz supported)"""
+    for path in paths:
+        if path == '-':
+            stream = sys.stdin
+        elif path.endswith('.gz'):
+            stream = gzip.open(path, 'rt', encoding='utf-8')
+        else:
+            stream = open(path, encoding='utf-8')
+        try:
+            for line in stream:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+
+def iter_synthetic(users, events, seed):
+    from workload import WorkloadGenerator
+
+    generator = WorkloadGenerator(seed=seed)
+    for index in range(users):
+        yield from generator.iter_activities(index, events)
+
+
+class ShardWriter:
+    """Buffers activities per shard and appends them to shard files in chunks"""
+
+    def __init__(self, directory, flush_lines=50000):
+        self.directory = directory
+        self.flush_lines = flush_lines
+        self.buffers = {}
+        self.buffered = 0
+        self.ends = {}
+
+    def add(self, shard, period_end, activity):
+        self.buffers.setdefault(shard, []).append(json.dumps(activity, separators=(',', ':')))
+        self.ends[shard] = period_end
+        self.buffered += 1
+        if self.buffered >= self.flush_lines:
+            self.flush()
+
+    def flush(self):
+        for shard, lines in self.buffers.items():
+            with open(os.path.join(self.directory, shard + '.jsonl'), 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+        self.buffers = {}
+        self.buffered = 0
+
+
+def partition(activities, work_dir, period, buckets):
+    """Stream activities into (period, user bucket) shard files and write the manifest"""
+    shard_dir = os.path.join(work_dir, 'shards')
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.makedirs(shard_dir)
+    writer = ShardWriter(shard_dir)
+    events = 0
+    skipped = 0
+    for activity in activities:
+        timestamp = parse_timestamp(activity.get('timestamp'))
+        if timestamp is None or not activity.get('user_id'):
+            skipped += 1
+            continue
+        key, end = period_bounds(timestamp, period)
+        writer.add(f"{key}_{user_bucket(activity['user_id'], buckets):04d}", end, activity)
+        events += 1
+    writer.flush()
+
+    manifest = {
+        'period': period,
+        'buckets': buckets,
+        'events': events,
+        'skipped': skipped,
+        'shards': {shard: end.isoformat() for shard, end in sorted(writer.ends.items())}
+    }
+    tmp_path = os.path.join(work_dir, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(work_dir, MANIFEST))
+    logger.info(f"Partitioned {events} activities into {len(manifest['shards'])} shards ({skipped} skipped)")
+    return manifest
+
+
+def read_done(work_dir):
+    path = os.path.join(work_dir, DONE_LOG)
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def mark_done(work_dir, shard):
+    with open(os.path.join(work_dir, DONE_LOG), 'a') as f:
+        f.write(shard + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+_processor = None
+
+
+def _worker_processor():
+    # One DataProcessor per worker process, built on first use
+    global _processor
+    if _processor is None:
+        from data_processor import DataProcessor
+        logging.getLogger('data_processor').setLevel(logging.WARNING)
+        _processor = DataProcessor(incremental=False)
+    return _processor
+
+
+def process_shard(work_dir, shard, period_end):
+    """Encode one shard; runs in a worker process and writes <shard>.npz next to the shards"""
+    import numpy as np
+
+    start = time.perf_counter()
+    activities_by_user = {}
+    events = 0
+    with open(os.path.join(work_dir, 'shards', shard + '.jsonl'), encoding='utf-8') as f:
+        for line in f:
+            activity = json.loads(line)
+            activities_by_user.setdefault(activity['user_id'], []).append(activity)
+            events += 1
+
+    matrix, user_ids = _worker_processor().process_activities_batch(
+        activities_by_user, as_of=datetime.fromisoformat(period_end))
+    if events and not user_ids:
+        # process_activities_batch logs and returns no rows on errors; don't checkpoint that as done
+        raise RuntimeError(f"encoding {events} events produced no feature rows")
+    output = os.path.join(work_dir, 'shards', shard + '.npz')
+    tmp_output = output + '.tmp.npz'
+    np.savez(tmp_output, matrix=matrix, user_ids=np.array(user_ids, dtype=str))
+    os.replace(tmp_output, output)
+    return shard, events, len(user_ids), time.perf_counter() - start
+
+
+class Progress:
+    """Throughput and ETA reporting"""
+
+    def __init__(self, total_shards, done_shards, interval=5.0):
+        self.total_shards = total_shards
+        self.done_shards = done_shards
+        self.resumed_shards = done_shards
+        self.events = 0
+        self.users = 0
+        self.started = time.monotonic()
+        self.interval = interval
+        self._last_report = 0.0
+
+    def update(self, events, users):
+        self.done_shards += 1
+        self.events += events
+        self.users += users
+        now = time.monotonic()
+        if now - self._last_report >= self.interval or self.done_shards == self.total_shards:
+            self._last_report = now
+            logger.info(self.line())
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.events / elapsed if elapsed > 0 else 0.0
+
+    def line(self):
+        rate = self.rate()
+        processed = self.done_shards - self.resumed_shards
+        elapsed = time.monotonic() - self.started
+        eta = f"{elapsed / processed * (self.total_shards - self.done_shards):.0f}s" if processed else '?'
+        return (f"{self.done_shards}/{self.total_shards} shards, {self.events} events "
+                f"({rate:,.0f} events/s), ETA {eta}")
+
+    def summary(self):
+        return {
+            'shards': self.done_shards,
+            'events': self.events,
+            'snapshots': self.users,
+            'seconds': time.monotonic() - self.started,
+            'events_per_sec': self.rate()
+        }
+
+
+def run(args):
+    os.makedirs(args.work_dir, exist_ok=True)
+    manifest_path = os.path.join(args.work_dir, MANIFEST)
+    if args.restart:
+        for name in (MANIFEST, DONE_LOG):
+            if os.path.exists(os.path.join(args.work_dir, name)):
+                os.remove(os.path.join(args.work_dir, name))
+
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        logger.info(f"Resuming backfill in {args.work_dir}")
+    else:
+        if args.synthetic_users:
+            activities = iter_synthetic(args.synthetic_users, args.synthetic_events, args.seed)
+        elif args.input:
+            activities = iter_input(args.input)
+        else:
+            raise SystemExit("Nothing to backfill: pass --input or --synthetic-users")
+        manifest = partition(activities, args.work_dir, args.period, args.buckets)
+
+    failed = []
+    done = read_done(args.work_dir)
+    pending = [(shard, end) for shard, end in manifest['shards'].items() if shard not in done]
+    progress = Progress(len(manifest['shards']), len(done))
+    logger.info(f"{len(pending)} of {len(manifest['shards'])} shards to process on {args.workers} workers")
+
+    store = None
+    if args.store:
+        from feature_store import FeatureStore
+        store = FeatureStore(args.store)
+
+    # Only the parent writes to the store; workers hand back .npz files
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(process_shard, args.work_dir, shard, end): (shard, end) for shard, end in pending}
+        for future in as_completed(futures):
+            shard, end = futures[future]
+            try:
+                _, events, users, _ = future.result()
+            except Exception as e:
+                logger.error(f"Shard {shard} failed: {str(e)}")
+                failed.append(shard)
+                continue
+            if store is not None:
+                _append_shard(store, args.work_dir, shard, end)
+            mark_done(args.work_dir, shard)
+            progress.update(events, users)
+
+    if store is not None:
+        store.close()
+    if failed:
+        logger.warning(f"{len(failed)} shards failed and stay pending; rerun the same command to retry them")
+    summary = progress.summary()
+    logger.info(f"Backfill finished: {summary['events']} events, {summary['snapshots']} snapshots "
+                f"in {summary['seconds']:.1f}s ({summary['events_per_sec']:,.0f} events/s)")
+    return summary
+
+
+def _append_shard(store, work_dir, shard, end):
+    import numpy as np
+
+    with np.load(os.path.join(work_dir, 'shards', shard + '.npz')) as data:
+        matrix = data['matrix']
+        user_ids = [str(user_id) for user_id in data['user_ids']]
+    if not user_ids:
+        return
+    timestamp = (datetime.fromisoformat(end) - datetime(1970, 1, 1)).total_seconds()
+    # A crash between the append and the checkpoint would otherwise duplicate the shard on resume
+    if store.find(user_ids[0], timestamp) is not None:
+        return
+    store.append_batch(user_ids, matrix, [timestamp] * len(user_ids))
+    store.commit()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='WorkFlowAI feature backfill')
+    parser.add_argument('--input', nargs='+', help="JSON-lines activity files ('-' for stdin, .gz ok)")
+    parser.add_argument('--synthetic-users', type=int, default=0, help='Backfill a seeded synthetic workload instead')
+    parser.add_argument('--synthetic-events', type=int, default=10000, help='Synthetic events per user')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--work-dir', required=True, help='Shards, manifest and checkpoint log')
+    parser.add_argument('--store', help='FeatureStore directory to append snapshots to')
+    parser.add_argument('--period', choices=PERIODS, default='week', help='One snapshot per user per period')
+    parser.add_argument('--buckets', type=int, default=64, help='User buckets per period (shards per period)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--restart', action='store_true', help='Ignore existing progress and start over')
+    parser.add_argument('--json', action='store_true', help='Print the throughput summary as JSON')
+    parser.add_argument('--log-level', default='INFO')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.INFO),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    summary = run(args)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
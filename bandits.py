@@ -0,0 +1,196 @@
+import os
+import logging
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+STRATEGIES = ('linucb', 'thompson')
+
+
+class LinearBandit:
+    """Disjoint linear contextual bandit: one ridge regression per arm, chosen by LinUCB or Thompson sampling.
+
+    Each arm keeps A^-1 (d x d) and b (d); A^-1 is updated in place with the
+    Sherman-Morrison formula, so feedback costs O(d^2) and never inverts a
+    matrix. Scoring takes a batch of contexts (n x d) and scores every arm
+    for every context with one batched matrix multiply.
+
+    Updates since the last save are also kept as sufficient statistics
+    (sum of x x^T, sum of reward * x, counts). save() adds them to the
+    A and b already in the file under an flock and adopts the merged result,
+    so processes sharing a path pool their feedback instead of the last
+    writer winning.
+    """
+
+    def __init__(self, arms, dim, strategy='linucb', alpha=1.0, ridge=1.0, noise=0.5, seed=None, max_context=100.0):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown bandit strategy: {strategy}")
+        self.arms = list(arms)
+        self.dim = dim
+        self.strategy = strategy
+        self.alpha = alpha
+        self.ridge = ridge
+        self.noise = noise
+        self.max_context = max_context  # largest absolute context value update() accepts
+        self.rng = np.random.default_rng(seed)
+        self.A_inv = np.repeat(np.eye(dim)[None] / ridge, len(self.arms), axis=0)
+        self.b = np.zeros((len(self.arms), dim))
+        self.theta = np.zeros((len(self.arms), dim))
+        self.counts = np.zeros(len(self.arms), dtype=np.int64)
+        self._pending = self._empty_stats()  # (A, b, counts) added since the last save
+        self._cholesky = None  # per-arm factors of A^-1 for Thompson sampling, rebuilt after updates
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def _empty_stats(self):
+        arms = len(self.arms)
+        return (np.zeros((arms, self.dim, self.dim)), np.zeros((arms, self.dim)), np.zeros(arms, dtype=np.int64))
+
+    def _contexts(self, contexts):
+        contexts = np.asarray(contexts, dtype=np.float64)
+        return contexts[None] if contexts.ndim == 1 else contexts
+
+    def scores(self, contexts):
+        """(n, arms) scores for n contexts"""
+        X = self._contexts(contexts)
+        with self._lock:
+            means = X @ self.theta.T
+            if self.strategy == 'linucb':
+                # x^T A_k^-1 x for every (context, arm): one (arms, n, d) batched matmul
+                variance = np.einsum('knd,nd->nk', X[None] @ self.A_inv, X)
+                return means + self.alpha * np.sqrt(np.maximum(variance, 0.0))
+            if self._cholesky is None:
+                # Symmetrize: repeated rank-1 updates leave tiny asymmetries
+                self._cholesky = np.linalg.cholesky((self.A_inv + self.A_inv.transpose(0, 2, 1)) / 2)
+            # theta_k ~ N(theta_k, noise^2 A_k^-1), one draw per context and arm
+            draws = self.rng.standard_normal((len(self.arms), X.shape[0], self.dim))
+            noise = np.einsum('knd,ked->kne', draws, self._cholesky)
+            return means + self.noise * np.einsum('kne,ne->nk', noise, X)
+
+    def select(self, contexts):
+        """Index of the best arm for each context"""
+        return np.argmax(self.scores(contexts), axis=1)
+
+    def rank(self, context):
+        """Arm indexes for one context, best first"""
+        return np.argsort(-self.scores(context)[0], kind='stable')
+
+    def valid_context(self, context):
+        """True for a finite context of the right size within +-max_context"""
+        x = np.asarray(context, dtype=np.float64).reshape(-1)
+        return x.shape == (self.dim,) and bool(np.all(np.isfinite(x))) and float(np.abs(x).max()) <= self.max_context
+
+    def update(self, arm, context, reward):
+        """Fold in one observed reward for `arm` in `context` (Sherman-Morrison rank-1 update)"""
+        x = np.asarray(context, dtype=np.float64).reshape(-1)
+        # One non-finite update would poison A^-1 and theta for good, and spread through the shared file
+        if not self.valid_context(x) or not np.isfinite(reward):
+            raise ValueError("Bandit context or reward is not finite, of the wrong size or out of range")
+        with self._lock:
+            A_inv = self.A_inv[arm]
+            Ax = A_inv @ x
+            A_inv -= np.outer(Ax, Ax) / (1.0 + x @ Ax)
+            self.b[arm] += reward * x
+            self.theta[arm] = A_inv @ self.b[arm]
+            self.counts[arm] += 1
+            pending_A, pending_b, pending_counts = self._pending
+            pending_A[arm] += np.outer(x, x)
+            pending_b[arm] += reward * x
+            pending_counts[arm] += 1
+            self._cholesky = None
+
+    def state(self):
+        """Copies of the learned parameters"""
+        with self._lock:
+            return {'arms': np.array(self.arms), 'A_inv': self.A_inv.copy(), 'b': self.b.copy(),
+                    'counts': self.counts.copy()}
+
+    @contextmanager
+    def _locked(self, path):
+        """Exclusive access to the file at `path` across threads and processes"""
+        with self._save_lock, open(path + '.lock', 'a') as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _read(self, path, expect=None):
+        """(A, b, counts) saved at `path`, or None if missing or saved for other arms, context size or metadata"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            arms = [str(arm) for arm in data['arms']]
+            if arms != self.arms or data['b'].shape != self.b.shape:
+                logger.warning(f"Ignoring bandit state at {path}: arms or context size changed")
+                return None
+            for key, value in (expect or {}).items():
+                if key not in data.files or data[key].item() != value:
+                    logger.warning(f"Ignoring bandit state at {path}: {key} changed")
+                    return None
+            # Files from before A was saved only hold its inverse
+            A = data['A'] if 'A' in data.files else np.linalg.inv(data['A_inv'])
+            return A.astype(np.float64), data['b'].astype(np.float64), data['counts'].astype(np.int64)
+
+    def _adopt(self, A, b, counts):
+        """Replace the parameters with saved statistics plus the updates not yet saved; call under self._lock"""
+        pending_A, pending_b, pending_counts = self._pending
+        self.A_inv = np.linalg.inv(A + pending_A)
+        self.b = b + pending_b
+        self.counts = counts + pending_counts
+        self.theta = np.einsum('kde,ke->kd', self.A_inv, self.b)
+        self._cholesky = None
+
+    def save(self, path, expect=None, **meta):
+        """Merge the updates since the last save into the .npz at `path` and adopt the merged parameters.
+
+        The file holds A and b rather than A^-1, so statistics from several
+        writers add up. It is rewritten under the lock (temp file, fsync,
+        atomic rename); `expect` is checked like in load(), and a file saved
+        for another layout is replaced.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._locked(path):
+            with self._lock:
+                pending, self._pending = self._pending, self._empty_stats()
+            try:
+                saved = self._read(path, expect)
+                if saved is None:
+                    arms = len(self.arms)
+                    saved = (np.repeat(np.eye(self.dim)[None] * self.ridge, arms, axis=0), np.zeros((arms, self.dim)),
+                             np.zeros(arms, dtype=np.int64))
+                A, b, counts = (total + delta for total, delta in zip(saved, pending))
+                tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, arms=np.array(self.arms), A=A, b=b, counts=counts,
+                             **{key: np.asarray(value) for key, value in {**(expect or {}), **meta}.items()})
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            except Exception:
+                with self._lock:
+                    # Keep the updates for the next attempt
+                    self._pending = tuple(current + delta for current, delta in zip(self._pending, pending))
+                raise
+            with self._lock:
+                self._adopt(A, b, counts)
+
+    def load(self, path, expect=None):
+        """Restore parameters saved by save(); metadata in `expect` must match what was saved with them"""
+        saved = self._read(path, expect)
+        if saved is None:
+            return False
+        with self._lock:
+            self._adopt(*saved)
+        return True
@@ -0,0 +1,134 @@
+import logging
+from datetime import datetime
+import numpy as np
+
+from feature_aggregates import parse_duration
+from feature_encoder import app_slot
+from sessionizer import to_epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_INDEX = {'high': 0, 'medium': 1, 'low': 2}
+BATCH_COLUMNS = ('user_id', 'application_name', 'duration', 'timestamp')
+
+
+def columns_from_users(activities_by_user):
+    """{user_id: [activity dicts]} -> dict of parallel columns"""
+    user_ids = list(activities_by_user)
+    groups = [activities_by_user[user_id] for user_id in user_ids]
+    rows = [activity for activities in groups for activity in activities]
+    return {
+        'user_id': np.repeat(np.array([str(user_id) for user_id in user_ids], dtype=object),
+                             [len(activities) for activities in groups]),
+        'application_name': [activity.get('application_name') for activity in rows],
+        'duration': [parse_duration(activity.get('duration')) for activity in rows],
+        'timestamp': [activity.get('timestamp') for activity in rows]
+    }
+
+
+def columns_from_table(table):
+    """A DataFrame or a dict of columns with a user_id column -> dict of parallel column lists/arrays"""
+    missing = [name for name in BATCH_COLUMNS if name not in table]
+    if missing:
+        raise ValueError(f"Activity table is missing columns: {', '.join(missing)}")
+    columns = {}
+    for name in BATCH_COLUMNS:
+        column = table[name]
+        columns[name] = column.to_numpy() if hasattr(column, 'to_numpy') else column
+    return columns
+
+
+def encode_activity_columns(columns, encoder, classify, now=None):
+    """Encode a multi-user activity table into one feature row per user.
+
+    Every block of the encoder schema is computed for all users at once with
+    grouped NumPy reductions (bincount over user x app / hour / day keys),
+    matching FeatureEncoder.encode(DataProcessor.process_activities(...)) for
+    each user. Like the per-user paths, hour and weekday histograms use each
+    timestamp's own wall clock, while activity density spans are measured in
+    absolute time.
+
+    Returns:
+        tuple: (float32 matrix of shape (n_users, encoder.size), list of user ids)
+    """
+    schema = encoder.schema
+    now = now or datetime.now()
+
+    users, user_codes = np.unique(np.asarray(columns['user_id'], dtype=object).astype(str), return_inverse=True)
+    n_users = len(users)
+    matrix = np.zeros((n_users, encoder.size), dtype=np.float32)
+    if not n_users:
+        return matrix, []
+
+    # Same rules as the per-user paths: rows without an app name are left out of app usage, rows without a
+    # usable timestamp count towards app usage only, and non-numeric durations count as 0
+    app_names = np.asarray(columns['application_name'], dtype=object)
+    has_app = np.fromiter((app is not None and app == app for app in app_names), dtype=bool, count=len(app_names))
+    apps, app_codes = np.unique(app_names[has_app].astype(str), return_inverse=True)
+    try:
+        durations = np.asarray(columns['duration'], dtype=np.float64)
+    except (TypeError, ValueError):
+        durations = np.array([parse_duration(value) for value in columns['duration']], dtype=np.float64)
+    durations = np.where(np.isnan(durations), 0.0, durations)[has_app]
+    app_users = user_codes[has_app]
+    timestamps, offsets = to_epoch_seconds(list(columns['timestamp']), with_offsets=True)
+    valid = ~np.isnan(timestamps)
+    user_codes, timestamps, offsets = user_codes[valid], timestamps[valid], offsets[valid]
+    counts = np.bincount(user_codes, minlength=n_users).astype(np.float64)
+
+    # App usage: seconds per distinct (user, app) pair, folded into hashed slots and productivity categories
+    n_apps = len(apps)
+    pairs, pair_codes = np.unique(app_users * n_apps + app_codes, return_inverse=True)
+    pair_time = np.bincount(pair_codes, weights=durations, minlength=len(pairs))
+    pair_users = pairs // n_apps
+    pair_apps = pairs % n_apps
+    total_time = np.bincount(pair_users, weights=pair_time, minlength=n_users)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pair_share = np.where(total_time[pair_users] > 0, pair_time / total_time[pair_users], 0.0)
+
+    slots = schema.width('app_usage')
+    slot_of_app = np.array([app_slot(app, slots) for app in apps], dtype=np.int64)
+    app_slots = np.bincount(pair_users * slots + slot_of_app[pair_apps], weights=pair_share,
+                            minlength=n_users * slots).reshape(n_users, slots)
+    matrix[:, schema.slice('app_usage')] = app_slots
+
+    # -1 marks apps outside the three productivity categories
+    category_of_app = np.array([CATEGORY_INDEX.get(classify(app), -1) for app in apps], dtype=np.int64)
+    categorized = category_of_app[pair_apps] >= 0
+    categories = len(CATEGORY_INDEX)
+    productivity = np.bincount(pair_users[categorized] * categories + category_of_app[pair_apps][categorized],
+                               weights=pair_share[categorized], minlength=n_users * categories)
+    matrix[:, schema.slice('productivity')] = productivity.reshape(n_users, categories)
+
+    # Hour and weekday histograms (1970-01-01 was a Thursday, weekday 3)
+    seconds = np.floor(timestamps + offsets).astype(np.int64)
+    hours = (seconds // 3600) % 24
+    days = (seconds // 86400 + 3) % 7
+    hour_counts = np.bincount(user_codes * 24 + hours, minlength=n_users * 24).reshape(n_users, 24)
+    day_counts = np.bincount(user_codes * 7 + days, minlength=n_users * 7).reshape(n_users, 7)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        matrix[:, schema.slice('activity_hours')] = np.where(counts[:, None] > 0, hour_counts / counts[:, None], 0.0)
+        matrix[:, schema.slice('activity_days')] = np.where(counts[:, None] > 0, day_counts / counts[:, None], 0.0)
+        day_parts = np.stack([
+            hour_counts[:, 5:12].sum(axis=1),
+            hour_counts[:, 12:18].sum(axis=1),
+            hour_counts[:, 18:24].sum(axis=1),
+            hour_counts[:, 0:5].sum(axis=1)
+        ], axis=1)
+        matrix[:, schema.slice('day_parts')] = np.where(counts[:, None] > 0, day_parts / counts[:, None], 0.0)
+
+    # Density: activities per hour over each user's time span
+    first = np.full(n_users, np.inf)
+    last = np.full(n_users, -np.inf)
+    np.minimum.at(first, user_codes, timestamps)
+    np.maximum.at(last, user_codes, timestamps)
+    span = np.where(counts > 0, last - first, 0.0)
+    density = np.where(span > 0, counts / np.maximum(1.0, span / 3600.0), 0.0)
+    matrix[:, schema.slice('activity_density')] = np.log1p(density)[:, None]
+    matrix[:, schema.slice('total_tracked_time')] = np.log1p(np.maximum(total_time, 0.0) / 3600.0)[:, None]
+
+    matrix[:, schema.slice('time_of_day')] = now.hour / 23.0
+    matrix[:, schema.slice('day_of_week')] = now.weekday() / 6.0
+    matrix[:, schema.slice('is_weekend')] = 1.0 if now.weekday() >= 5 else 0.0
+    matrix[:, schema.slice('features_available')] = 1.0
+    return matrix, [str(user) for user in users]
@@ -0,0 +1,229 @@
+"""End-to-end throughput benchmark for the tracking pipeline.
+
+Stages: tracker output (queue + batched sinks), the /generate_suggestions
+endpoint, DataProcessor.process_activities and RLModel.generate_suggestions.
+Workloads come from workload.WorkloadGenerator, so runs are reproducible.
+
+    python benchmark.py --users 10 --events 10000 --payload-size 1000
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+from itertools import islice
+
+from workload import WorkloadGenerator
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('tracker', 'endpoint', 'data_processor', 'rl_model')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+class StageStats:
+    """Collects per-call latencies and event counts for one pipeline stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.events = 0
+        self.elapsed = 0.0
+
+    def record(self, seconds, events):
+        self.latencies.append(seconds)
+        self.events += events
+        self.elapsed += seconds
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return {
+            'stage': self.name,
+            'calls': len(latencies),
+            'events': self.events,
+            'events_per_sec': self.events / self.elapsed if self.elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000
+        }
+
+
+def _payloads(activities, payload_size):
+    iterator = iter(activities)
+    while True:
+        chunk = list(islice(iterator, payload_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bench_tracker(generator, args, stats):
+    from activity_tracker import ActivityTracker
+    from activity_queue import MemorySink
+
+    tracker = ActivityTracker()
+    tracker.batch_writer.sinks = [MemorySink(max_records=args.payload_size)]
+    for user_index in range(args.users):
+        for chunk in _payloads(generator.iter_activities(user_index, args.events), args.payload_size):
+            start = time.perf_counter()
+            for activity in chunk:
+                tracker.emit(activity)
+            tracker.flush()
+            stats.record(time.perf_counter() - start, len(chunk))
+
+
+def bench_endpoint(generator, args, stats):
+    logging.getLogger('app').setLevel(logging.WARNING)
+    from app import app
+
+    client = app.test_client()
+    for user_index in range(args.users):
+        user_id = generator.user_id(user_index)
+        payloads = _payloads(generator.iter_activities(user_index, args.events), args.payload_size)
+        for chunk in islice(payloads, args.max_requests):
+            body = {'activities': chunk, 'user_id': user_id, 'device_id': chunk[0]['device_id']}
+            start = time.perf_counter()
+            response = client.post('/generate_suggestions', json=body)
+            stats.record(time.perf_counter() - start, len(chunk))
+            if response.status_code != 200:
+                logger.error(f"/generate_suggestions returned {response.status_code}")
+
+
+def bench_processor_and_model(generator, args, processor_stats, model_stats):
+    from data_processor import DataProcessor
+    from rl_model import RLModel
+
+    processor = DataProcessor()
+    model = RLModel()
+    for user_index in range(args.users):
+        user_id = generator.user_id(user_index)
+        payloads = _payloads(generator.iter_activities(user_index, args.events), args.payload_size)
+        for chunk in islice(payloads, args.max_requests):
+            start = time.perf_counter()
+            features = processor.process_activities(chunk, user_id=user_id)
+            processor_stats.record(time.perf_counter() - start, len(chunk))
+
+            start = time.perf_counter()
+            model.generate_suggestions(features)
+            model_stats.record(time.perf_counter() - start, 1)
+
+
+def _same(a, b, tolerance=1e-9):
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same(a[k], b[k], tolerance) for k in a)
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return abs(a - b) <= tolerance * max(1.0, abs(a), abs(b))
+    return a == b
+
+
+def check_parity(generator, args):
+    """Compare the pure-Python and pandas feature paths on generated payloads"""
+    from data_processor import DataProcessor
+
+    fast = DataProcessor(incremental=False)
+    slow = DataProcessor(incremental=False, fast_path_max_activities=0)
+    mismatches = 0
+    checked = 0
+    for user_index in range(args.users):
+        payloads = _payloads(generator.iter_activities(user_index, args.events), args.payload_size)
+        for chunk in islice(payloads, args.max_requests):
+            for size in sorted({1, 2, 3, len(chunk) // 2, len(chunk)}):
+                if size < 1:
+                    continue
+                expected = slow.process_activities(chunk[:size])
+                actual = fast.process_activities(chunk[:size])
+                checked += 1
+                if not _same(expected, actual):
+                    mismatches += 1
+                    differing = sorted(k for k in set(expected) | set(actual)
+                                       if not _same(expected.get(k), actual.get(k)))
+                    print(f"parity mismatch: user {user_index} size {size}: {differing}")
+    print(f"parity: {checked - mismatches}/{checked} payloads match")
+    return mismatches == 0
+
+
+def run(args):
+    generator = WorkloadGenerator(seed=args.seed)
+    results = []
+
+    if 'tracker' in args.stages:
+        stats = StageStats('tracker')
+        bench_tracker(generator, args, stats)
+        results.append(stats.summary())
+    if 'endpoint' in args.stages:
+        stats = StageStats('endpoint')
+        bench_endpoint(generator, args, stats)
+        results.append(stats.summary())
+    if 'data_processor' in args.stages or 'rl_model' in args.stages:
+        processor_stats = StageStats('data_processor')
+        model_stats = StageStats('rl_model')
+        bench_processor_and_model(generator, args, processor_stats, model_stats)
+        if 'data_processor' in args.stages:
+            results.append(processor_stats.summary())
+        if 'rl_model' in args.stages:
+            results.append(model_stats.summary())
+
+    return {
+        'config': {
+            'seed': args.seed,
+            'users': args.users,
+            'events_per_user': args.events,
+            'payload_size': args.payload_size,
+            'max_requests': args.max_requests
+        },
+        'stages': results,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def print_report(report):
+    print(f"{'stage':<16}{'calls':>8}{'events':>12}{'events/s':>14}{'p50 ms':>10}{'p99 ms':>10}")
+    for stage in report['stages']:
+        print(f"{stage['stage']:<16}{stage['calls']:>8}{stage['events']:>12}"
+              f"{stage['events_per_sec']:>14.0f}{stage['p50_ms']:>10.2f}{stage['p99_ms']:>10.2f}")
+    print(f"peak RSS: {report['peak_rss_mb']:.1f} MB")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='WorkFlowAI pipeline benchmark')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--events', type=int, default=1000, help='Events per user')
+    parser.add_argument('--payload-size', type=int, default=1000,
+                        help='Activities per request (localStorage keeps at most 1000)')
+    parser.add_argument('--max-requests', type=int, default=None,
+                        help='Cap requests per user for the endpoint/processor/model stages')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    parser.add_argument('--parity', action='store_true',
+                        help='Check the pure-Python feature path against the pandas path instead of benchmarking')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args(argv)
+    if args.parity:
+        return 0 if check_parity(WorkloadGenerator(seed=args.seed), args) else 1
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,120 @@
 import logging
 import numpy as np
-import pandas as pd
 from datetime import datetime, timedelta
 import uuid
+from feature_aggregates import FeatureAggregateStore, SketchedUserAggregates, UserAggregates
+from app_classifier import AppClassifier
+from feature_encoder import FeatureEncoder
+from sessionizer import SessionState, SessionStore
+from health_stats import HealthStatsStore
+from batch_features import columns_from_table, columns_from_users, encode_activity_columns
+from time_buckets import Bucket, SketchBucket, TimeBuckets, wall_seconds
 
 logger = logging.getLogger(__name__)
 
+
+def top_ngrams(codes, labels, n, k):
+    """
+    Count n-grams over a sequence of integer codes and return the k most common
+    
+    Each n-gram is packed into a single int64 (base len(labels)) so counting is
+    one np.unique call; sequences whose packed keys could overflow fall back to
+    np.unique over rows. Ties keep first-occurrence order.
+    
+    Returns:
+        dict: {"app1 -> app2 -> ...": count} for the top k n-grams
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    if n < 1 or k < 1 or len(codes) < n:
+        return {}
+    
+    base = max(1, len(labels))
+    windows = len(codes) - n + 1
+    if n * np.log2(base) < 62:
+        keys = np.zeros(windows, dtype=np.int64)
+        for offset in range(n):
+            keys = keys * base + codes[offset:offset + windows]
+        unique_keys, first_index, counts = np.unique(keys, return_index=True, return_counts=True)
+        grams = np.empty((len(unique_keys), n), dtype=np.int64)
+        remaining = unique_keys.copy()
+        for position in range(n - 1, -1, -1):
+            grams[:, position] = remaining % base
+            remaining //= base
+    else:
+        rows = np.lib.stride_tricks.sliding_window_view(codes, n)
+        grams, first_index, counts = np.unique(rows, axis=0, return_index=True, return_counts=True)
+    
+    # Only n-grams at least as frequent as the k-th largest count can make the cut
+    if len(counts) > k:
+        threshold = np.partition(counts, len(counts) - k)[len(counts) - k]
+        candidates = np.flatnonzero(counts >= threshold)
+    else:
+        candidates = np.arange(len(counts))
+    order = candidates[np.lexsort((first_index[candidates], -counts[candidates]))][:k]
+    
+    return {' -> '.join(labels[code] for code in grams[i]): int(counts[i]) for i in order}
+
+
 class DataProcessor:
-    def __init__(self):
-        self.feature_vector_size = 64  # Size of the feature vector for the RL model
+    # Categorize apps into productivity groups (simplified)
+    productivity_categories = {
+        'high': ['code', 'editor', 'terminal', 'office', 'excel', 'word', 'powerpoint'],
+        'medium': ['browser', 'mail', 'outlook', 'teams', 'slack', 'discord'],
+        'low': ['games', 'youtube', 'netflix', 'spotify', 'music']
+    }
+    
+    def __init__(self, incremental=True, max_aggregate_entries=10000, workflow_length=3,
+                 fast_path_max_activities=5000, feature_store=None, sketch_mode=False,
+                 sketch_epsilon=0.01, sketch_delta=0.01, hll_precision=10, time_windows=False,
+                 time_window_buckets=64, health_memory_budget=64 * 1024 * 1024):
+        # Fixed float32 layout for the RL model; the size comes from the encoder's column registry
+        self.encoder = FeatureEncoder()
+        self.feature_vector_size = self.encoder.size
+        
+        # Optional feature_store.FeatureStore that keeps an encoded snapshot per processed request
+        self.feature_store = feature_store
+        
+        # Workflow mining: top transitions (bigrams) and top workflows (n-grams of workflow_length apps)
+        self.workflow_length = workflow_length
+        self.top_transitions = 5
+        self.top_workflows = 3
+        
+        # Compiled keyword/alias matcher; app_classifier.bind(app) loads the Application tables on first use
+        self.app_classifier = AppClassifier(self.productivity_categories)
+        
+        # Payloads up to this size skip pandas entirely (localStorage caps history at 1000)
+        self.fast_path_max_activities = fast_path_max_activities
+        
+        # Sketch mode bounds per-user memory for heavy users: Count-Min/HyperLogLog estimates
+        # (error <= epsilon * total with probability 1 - delta) instead of exact n-gram dicts
+        self.sketch_mode = sketch_mode
+        self.sketch_epsilon = sketch_epsilon
+        self.sketch_delta = sketch_delta
+        self.hll_precision = hll_precision
+        
+        # Opt-in minute/hour/day pre-aggregates behind window_features (last hour, today, rolling week, ...);
+        # each level keeps at most time_window_buckets buckets, sketched in sketch_mode
+        self.time_windows = time_windows
+        self.time_window_buckets = time_window_buckets
+        
+        # Running per-(user, device) aggregates so repeat requests only fold in new activities
+        self.incremental = incremental
+        self.aggregates = FeatureAggregateStore(
+            self._classify_app,
+            max_entries=max_aggregate_entries,
+            workflow_length=workflow_length,
+            factory=self._new_aggregates
+        )
+        
+        # Gap-based sessions per (user, device); only the open session's activities are retained
+        self.session_gap = 1800
+        self.sessions = SessionStore(max_entries=max_aggregate_entries, gap=self.session_gap)
+        
+        # Streaming per-device health statistics, fed by record_system_health; least recently seen devices are
+        # dropped once they exceed health_memory_budget bytes
+        self.health_stats = HealthStatsStore(max_devices=max_aggregate_entries, memory_budget=health_memory_budget)
     
-    def process_activities(self, activities, device_id=None, session_id=None, user_id=None):
+    def process_activities(self, activities, device_id=None, session_id=None, user_id=None, as_of=None):
         """
         Process a list of activities to generate features for the RL model
         
@@ -19,6 +123,7 @@ class DataProcessor:
             device_id: Optional device ID to include device-specific features
             session_id: Optional session ID to include session context
             user_id: Optional user ID to associate with the feature vector
+            as_of: Reference time for the time-of-day features (defaults to now)
             
         Returns:
             dict: Feature dictionary for use by the RL model
@@ -27,30 +132,32 @@ class DataProcessor:
             # Convert to dataframe for easier processing
             if not activities:
                 logger.warning("No activities to process")
-                return self._create_empty_feature_vector()
+                return self._create_empty_feature_vector(as_of)
+            
+            if self.incremental and user_id and isinstance(activities[0], dict):
+                # Known user: fold only the new tail into the running aggregates
+                features = self.aggregates.fold(user_id, device_id, activities, features=True, as_of=as_of)
+                return self._add_context_features(features, device_id, session_id, user_id, activities)
             
             # Handle activities as dictionaries (for localStorage)
-            if isinstance(activities[0], dict):
-                df = pd.DataFrame(activities)
-            else:
+            if not isinstance(activities[0], dict):
                 # Convert objects to dictionaries (legacy support)
-                activities_dicts = []
-                for activity in activities:
-                    act_dict = {
-                        'id': getattr(activity, 'id', str(uuid.uuid4())),
-                        'activity_type': getattr(activity, 'activity_type', 'unknown'),
-                        'application_name': getattr(activity, 'application_name', ''),
-                        'window_title': getattr(activity, 'window_title', ''),
-                        'duration': getattr(activity, 'duration', 0),
-                        'timestamp': getattr(activity, 'timestamp', datetime.utcnow().isoformat()),
-                        'productivity_score': getattr(activity, 'productivity_score', 0.5)
-                    }
-                    activities_dicts.append(act_dict)
-                df = pd.DataFrame(activities_dicts)
+                activities = [self._activity_to_dict(activity) for activity in activities]
             
-            # Convert timestamp strings to datetime objects if needed
-            if isinstance(df['timestamp'].iloc[0], str):
-                df['timestamp'] = pd.to_datetime(df['timestamp'])
+            if len(activities) <= self.fast_path_max_activities:
+                # Small payloads: the fixed cost of building a DataFrame dominates, use the pure-Python engine
+                features = self._extract_features_fast(activities, as_of)
+                return self._add_context_features(features, device_id, session_id, user_id, activities)
+            
+            # Large payloads and batch jobs: pandas is only imported when actually needed
+            import pandas as pd
+            df = pd.DataFrame(activities)
+            
+            # Missing or unparseable timestamps become NaT and non-numeric durations count as 0
+            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+            df['duration'] = pd.to_numeric(df['duration'], errors='coerce').fillna(0) if 'duration' in df else 0
+            # Untimestamped activities count towards app usage only
+            timed = df[df['timestamp'].notna()]
             
             # Extract features
             features = {}
@@ -60,43 +167,224 @@ class DataProcessor:
             features.update(app_features)
             
             # Add time-based features
-            time_features = self._extract_time_patterns(df)
+            time_features = self._extract_time_patterns(timed, as_of)
             features.update(time_features)
             
             # Add workflow sequence features
-            workflow_features = self._extract_workflow_sequences(df)
+            workflow_features = self._extract_workflow_sequences(timed)
             features.update(workflow_features)
             
-            # Add device-specific features if available
-            if device_id:
-                device_features = self._extract_device_features(device_id)
-                features.update(device_features)
-                
-                # Also add system health features if device ID is available
-                health_features = self._extract_system_health_features(device_id)
-                features.update(health_features)
+            return self._add_context_features(features, device_id, session_id, user_id, activities)
+            
+        except Exception as e:
+            logger.error(f"Error processing activities: {str(e)}")
+            return self._create_empty_feature_vector(as_of)
+    
+    def process_activities_batch(self, activities, as_of=None, save=False):
+        """
+        Encode features for many users in grouped, vectorized passes
+        
+        Args:
+            activities: {user_id: [activity dicts]}, or a columnar table (DataFrame or dict of
+                columns) with user_id, application_name, duration and timestamp columns
+            as_of: Reference time for the time-of-day columns (defaults to now)
+            save: Also append every row to the feature store
+            
+        Returns:
+            tuple: (float32 array of shape (n_users, feature_vector_size), list of user ids by row)
+        """
+        try:
+            if isinstance(activities, dict) and 'user_id' not in activities:
+                columns = columns_from_users(activities)
+            else:
+                columns = columns_from_table(activities)
+            matrix, user_ids = encode_activity_columns(columns, self.encoder, self._classify_app, now=as_of)
+            
+            if save and self.feature_store is not None and user_ids:
+                self.feature_store.append_batch(user_ids, matrix)
+            logger.info(f"Encoded features for {len(user_ids)} users from {len(columns['user_id'])} activities")
+            return matrix, user_ids
+            
+        except Exception as e:
+            logger.error(f"Error processing activity batch: {str(e)}")
+            return np.zeros((0, self.feature_vector_size), dtype=np.float32), []
+    
+    def record_activities(self, activities, user_id, device_id=None):
+        """Fold activities uploaded by a collector into the running aggregates and sessions without building features"""
+        try:
+            activities = [activity for activity in activities if isinstance(activity, dict)]
+            if user_id and activities:
+                self.aggregates.fold(user_id, device_id, activities)
+                self.sessions.update(user_id, device_id, activities, self._activity_score)
+                return True
+        except Exception as e:
+            logger.error(f"Error recording activities: {str(e)}")
+        return False
+    
+    def record_system_health(self, device_id, samples):
+        """Fold one health sample (or a list of them) into the device's rolling statistics"""
+        try:
+            if device_id and samples:
+                self.health_stats.add(device_id, samples)
+                return True
+        except Exception as e:
+            logger.error(f"Error recording system health: {str(e)}")
+        return False
+    
+    def encode_features(self, features):
+        """Encode a feature dict as a float32 vector of feature_vector_size columns"""
+        return self.encoder.encode(features)
+    
+    def encode_features_batch(self, feature_dicts):
+        """Encode many feature dicts (e.g. one per user) into a (n, feature_vector_size) float32 array"""
+        return self.encoder.encode_batch(feature_dicts)
+    
+    def _activity_to_dict(self, activity):
+        """Convert an Activity object to the dictionary format used by the client"""
+        return {
+            'id': getattr(activity, 'id', str(uuid.uuid4())),
+            'activity_type': getattr(activity, 'activity_type', 'unknown'),
+            'application_name': getattr(activity, 'application_name', ''),
+            'window_title': getattr(activity, 'window_title', ''),
+            'duration': getattr(activity, 'duration', 0),
+            'timestamp': getattr(activity, 'timestamp', datetime.utcnow().isoformat()),
+            'productivity_score': getattr(activity, 'productivity_score', 0.5)
+        }
+    
+    def _new_aggregates(self):
+        """Empty running aggregates, sketched when sketch_mode is on"""
+        buckets = None
+        if self.time_windows:
+            buckets = TimeBuckets(max_buckets=self.time_window_buckets, bucket_factory=self._new_bucket)
+        if self.sketch_mode:
+            return SketchedUserAggregates(
+                self._classify_app,
+                top_transitions=self.top_transitions,
+                top_workflows=self.top_workflows,
+                workflow_length=self.workflow_length,
+                epsilon=self.sketch_epsilon,
+                delta=self.sketch_delta,
+                hll_precision=self.hll_precision,
+                buckets=buckets
+            )
+        return UserAggregates(
+            self._classify_app,
+            top_transitions=self.top_transitions,
+            top_workflows=self.top_workflows,
+            workflow_length=self.workflow_length,
+            buckets=buckets
+        )
+    
+    def _new_bucket(self):
+        if self.sketch_mode:
+            return SketchBucket(self.top_transitions, self.top_workflows)
+        return Bucket()
+    
+    def user_features(self, user_id, as_of=None):
+        """Features for a user across all of their devices, from the running aggregates"""
+        aggregates = self.aggregates.merged(user_id)
+        if aggregates is None:
+            return self._create_empty_feature_vector(as_of)
+        return aggregates.to_features(as_of)
+    
+    def window_features(self, user_id, window, device_id=None, as_of=None):
+        """
+        Features over a time window of a user's folded activity history
+        
+        Args:
+            user_id: User whose running aggregates to query
+            window: A timedelta ending at as_of, 'today', 'week' (rolling 7 days),
+                or a string like '15m', '4h', '7d'
+            device_id: Restrict to one device (default: all of the user's devices)
+            as_of: End of the window, on the same clock as activity timestamps (defaults to now in UTC)
             
-            # Add session context features if available
-            if session_id:
-                session_features = self._extract_session_features(session_id)
-                features.update(session_features)
+        Returns:
+            dict: Feature dictionary covering only activities inside the window
+        """
+        as_of = as_of or datetime.utcnow()
+        try:
+            if window == 'today':
+                start = as_of.replace(hour=0, minute=0, second=0, microsecond=0)
+            elif window == 'week':
+                start = as_of - timedelta(days=7)
+            elif isinstance(window, timedelta):
+                start = as_of - window
+            else:
+                units = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+                start = as_of - timedelta(**{units[window[-1]]: float(window[:-1])})
             
-            # Save the feature vector if a user ID is provided
-            if user_id:
-                self._save_feature_vector(features, user_id)
+            if device_id is not None:
+                stream = self.aggregates.get(user_id, device_id, create=False)
+                streams = [stream] if stream is not None else []
+            else:
+                streams = self.aggregates.streams(user_id)
+            streams = [stream for stream in streams if stream.buckets is not None]
+            if not streams:
+                return self._create_empty_feature_vector(as_of)
             
+            bucket = streams[0].buckets.query(wall_seconds(start), wall_seconds(as_of))
+            for stream in streams[1:]:
+                bucket.merge(stream.buckets.query(wall_seconds(start), wall_seconds(as_of)))
+            aggregates = UserAggregates.from_bucket(
+                bucket,
+                self._classify_app,
+                top_transitions=self.top_transitions,
+                top_workflows=self.top_workflows,
+                workflow_length=self.workflow_length
+            )
+            features = aggregates.to_features(as_of)
+            features['window_start'] = start.isoformat()
+            features['window_end'] = as_of.isoformat()
             return features
             
         except Exception as e:
-            logger.error(f"Error processing activities: {str(e)}")
-            return self._create_empty_feature_vector()
+            logger.error(f"Error computing window features: {str(e)}")
+            return self._create_empty_feature_vector(as_of)
+    
+    def _extract_features_fast(self, activities, as_of=None):
+        """Pure-Python feature extraction giving the same results as the pandas path"""
+        aggregates = UserAggregates(
+            self._classify_app,
+            top_transitions=self.top_transitions,
+            top_workflows=self.top_workflows,
+            workflow_length=self.workflow_length
+        )
+        aggregates.fold(activities)
+        return aggregates.to_features(as_of)
+    
+    def _add_context_features(self, features, device_id=None, session_id=None, user_id=None, activities=None):
+        """Add device, health and session context to a feature dict and save it"""
+        # Add device-specific features if available
+        if device_id:
+            device_features = self._extract_device_features(device_id)
+            features.update(device_features)
+            
+            # Also add system health features if device ID is available
+            health_features = self._extract_system_health_features(device_id)
+            features.update(health_features)
+        
+        # Add session context features if available
+        if session_id or user_id:
+            session_features = self._extract_session_features(session_id, activities, user_id, device_id)
+            features.update(session_features)
+        
+        # Save the feature vector if a user ID is provided
+        if user_id:
+            self._save_feature_vector(features, user_id)
+        
+        return features
+    
+    def _classify_app(self, app):
+        """Return the productivity category ('high', 'medium', 'low') for an app name, or None"""
+        return self.app_classifier.classify(app)
     
-    def _create_empty_feature_vector(self):
+    def _create_empty_feature_vector(self, as_of=None):
         """Create an empty feature vector with zeros"""
+        now = as_of or datetime.now()
         return {
             'app_usage': {},
-            'time_of_day': datetime.now().hour,
-            'day_of_week': datetime.now().weekday(),
+            'time_of_day': now.hour,
+            'day_of_week': now.weekday(),
             'features_available': False
         }
     
@@ -118,22 +406,13 @@ class DataProcessor:
             else:
                 app_usage_normalized = app_usage_dict
             
-            # Categorize apps into productivity groups (simplified)
-            productivity_categories = {
-                'high': ['code', 'editor', 'terminal', 'office', 'excel', 'word', 'powerpoint'],
-                'medium': ['browser', 'mail', 'outlook', 'teams', 'slack', 'discord'],
-                'low': ['games', 'youtube', 'netflix', 'spotify', 'music']
-            }
-            
             # Calculate time spent per category
-            category_time = {cat: 0 for cat in productivity_categories.keys()}
+            category_time = {cat: 0 for cat in self.productivity_categories.keys()}
             
             for app, time in app_usage_dict.items():
-                app_lower = app.lower()
-                for category, keywords in productivity_categories.items():
-                    if any(keyword in app_lower for keyword in keywords):
-                        category_time[category] += time
-                        break
+                category = self._classify_app(app)
+                if category:
+                    category_time[category] += time
             
             # Add productivity category percentages
             productivity_percentages = {}
@@ -151,7 +430,7 @@ class DataProcessor:
             logger.error(f"Error extracting app usage features: {str(e)}")
             return {'app_usage': {}}
     
-    def _extract_time_patterns(self, df):
+    def _extract_time_patterns(self, df, as_of=None):
         """Extract features related to timing patterns"""
         try:
             # Get the time range of activities
@@ -188,7 +467,7 @@ class DataProcessor:
                     }
                 
                 # Get current time features
-                now = datetime.now()
+                now = as_of or datetime.now()
                 
                 return {
                     'time_of_day': now.hour,
@@ -200,7 +479,7 @@ class DataProcessor:
                     **time_distribution
                 }
             else:
-                now = datetime.now()
+                now = as_of or datetime.now()
                 return {
                     'time_of_day': now.hour,
                     'day_of_week': now.weekday(),
@@ -209,7 +488,7 @@ class DataProcessor:
                 
         except Exception as e:
             logger.error(f"Error extracting time patterns: {str(e)}")
-            now = datetime.now()
+            now = as_of or datetime.now()
             return {
                 'time_of_day': now.hour,
                 'day_of_week': now.weekday(),
@@ -223,41 +502,16 @@ class DataProcessor:
             if len(df) < 2:
                 return {'workflows': {}, 'common_transitions': {}}
             
-            # Sort by timestamp
-            df = df.sort_values('timestamp')
-            
-            # Extract app transitions
-            app_sequence = df['application_name'].tolist()
-            transitions = {}
-            
-            # Count transitions between apps
-            for i in range(len(app_sequence) - 1):
-                from_app = app_sequence[i]
-                to_app = app_sequence[i + 1]
-                transition_key = f"{from_app} -> {to_app}"
-                
-                if transition_key not in transitions:
-                    transitions[transition_key] = 0
-                transitions[transition_key] += 1
-            
-            # Extract most common transitions (up to 5)
-            sorted_transitions = dict(sorted(transitions.items(), key=lambda item: item[1], reverse=True)[:5])
-            
-            # Try to identify workflows (simplified)
-            # A workflow is a sequence of 3+ apps that occur together multiple times
-            workflows = {}
-            if len(app_sequence) >= 3:
-                for i in range(len(app_sequence) - 2):
-                    workflow = f"{app_sequence[i]} -> {app_sequence[i+1]} -> {app_sequence[i+2]}"
-                    if workflow not in workflows:
-                        workflows[workflow] = 0
-                    workflows[workflow] += 1
-            
-            sorted_workflows = dict(sorted(workflows.items(), key=lambda item: item[1], reverse=True)[:3])
+            # Sort by timestamp and integer-encode app names (codes follow first appearance);
+            # activities without an app name are not part of any sequence
+            df = df[df['application_name'].notna()].sort_values('timestamp', kind='stable')
+            codes, labels = df['application_name'].factorize()
+            labels = [str(label) for label in labels]
             
+            # A workflow is a sequence of workflow_length apps that occur together multiple times
             return {
-                'common_transitions': sorted_transitions,
-                'workflows': sorted_workflows
+                'common_transitions': top_ngrams(codes, labels, 2, self.top_transitions),
+                'workflows': top_ngrams(codes, labels, self.workflow_length, self.top_workflows)
             }
             
         except Exception as e:
@@ -274,9 +528,10 @@ class DataProcessor:
         }
     
     def _extract_system_health_features(self, device_id):
-        """Extract system health metrics for the device"""
-        # In client-side implementation, this would get data from localStorage
-        # Here we just provide a placeholder structure
+        """Extract rolling system health statistics for the device"""
+        stats = self.health_stats.get(device_id)
+        if stats is not None and stats.samples:
+            return stats.to_features()
         return {
             'system_health_metrics': {
                 'cpu_usage': 0,
@@ -286,18 +541,43 @@ class DataProcessor:
             'system_health_available': False
         }
     
-    def _extract_session_features(self, session_id):
-        """Extract features related to the current session"""
-        # In client-side implementation, this would get data from localStorage
-        # Here we just provide a placeholder structure
-        return {
-            'session_id': session_id,
-            'session_features_available': True
-        }
+    def _extract_session_features(self, session_id=None, activities=None, user_id=None, device_id=None):
+        """Extract duration, switch rate, focus and productivity of the current and past sessions"""
+        features = {'session_id': session_id} if session_id else {}
+        try:
+            if not activities or not isinstance(activities[0], dict):
+                features['session_features_available'] = False
+                return features
+            
+            if self.incremental and user_id:
+                state = self.sessions.update(user_id, device_id, activities, self._activity_score)
+            else:
+                state = SessionState(gap=self.session_gap)
+                state.update(activities, self._activity_score)
+            features.update(state.to_features())
+            return features
+            
+        except Exception as e:
+            logger.error(f"Error extracting session features: {str(e)}")
+            features['session_features_available'] = False
+            return features
+    
+    def _activity_score(self, activity):
+        """Productivity score of one activity, falling back to its app's category"""
+        score = activity.get('productivity_score')
+        if score is not None:
+            return score
+        return {'high': 1.0, 'medium': 0.5, 'low': 0.0}.get(self._classify_app(activity.get('application_name') or ''), 0.5)
     
     def _save_feature_vector(self, features, user_id=None):
-        """Save the generated feature vector (client-side implementation would save to localStorage)"""
-        # In client-side implementation, this would save to localStorage
-        # Here we just log that it would be saved
-        logger.info(f"Feature vector generated (would be saved to localStorage for user {user_id})")
-        return True
\ No newline at end of file
+        """Save the generated feature vector as an encoded snapshot in the feature store"""
+        if self.feature_store is None:
+            # Without a store the client keeps the features in localStorage
+            logger.debug(f"Feature vector generated (no feature store configured for user {user_id})")
+            return False
+        try:
+            self.feature_store.append(user_id, self.encode_features(features))
+            return True
+        except Exception as e:
+            logger.error(f"Error saving feature vector: {str(e)}")
+            return False
\ No newline at end of file
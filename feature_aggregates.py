@@ -0,0 +1,390 @@
+import heapq
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from sketches import CountMinSketch, HeavyHitters, HyperLogLog
+from time_buckets import from_wall_seconds, wall_seconds
+
+logger = logging.getLogger(__name__)
+
+
+def parse_timestamp(value):
+    """Parse an ISO timestamp (or pass through datetime objects); None if missing or unparseable"""
+    if isinstance(value, datetime):
+        return value
+    if not value or not isinstance(value, str):
+        return None
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def parse_duration(value):
+    """Seconds as a number, like pandas.to_numeric(errors='coerce').fillna(0): numeric strings convert, anything else is 0"""
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return 0
+    elif not isinstance(value, (int, float)):
+        return 0
+    return 0 if value != value else value  # NaN
+
+
+def activity_key(activity):
+    """Identity of an activity for deduplicating resent history: its id, else app, duration and title"""
+    activity_id = activity.get('id')
+    if activity_id is not None:
+        return ('id', str(activity_id))
+    return (activity.get('application_name'), str(activity.get('duration')), activity.get('window_title'))
+
+
+class UserAggregates:
+    """Running feature aggregates for one (user, device) stream.
+
+    Activities are folded in timestamp order; anything before the watermark
+    is skipped, so clients can keep sending their whole history and only the
+    new tail costs work. Activities at the watermark are matched by
+    activity_key(); a key counts as many times as it appears in the
+    largest payload seen, so activities without ids deduplicate too.
+
+    Same rules as the pandas path: activities without an app name count
+    towards the time patterns but not app usage or sequences, and
+    activities without a usable timestamp count only towards app usage.
+    Those can't be placed against the watermark, so they are matched by
+    key in the same way over the whole stream (up to max_untimed keys).
+    """
+
+    def __init__(self, classify, top_transitions=5, top_workflows=3, workflow_length=3, buckets=None,
+                 max_untimed=10000):
+        self.classify = classify  # app name -> 'high' | 'medium' | 'low' | None
+        self.top_transitions = top_transitions
+        self.top_workflows = top_workflows
+        self.workflow_length = workflow_length
+        self.buckets = buckets  # Optional time_buckets.TimeBuckets for windowed queries
+
+        self.count = 0
+        self.app_durations = {}
+        self.hour_counts = [0] * 24
+        self.day_counts = [0] * 7
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.transitions = {}
+        self.workflows = {}
+        self._previous_apps = ()
+        self._at_watermark = {}  # activity key -> times counted at last_timestamp
+        self.max_untimed = max_untimed
+        self._untimed = OrderedDict()  # untimed activity key -> times counted
+
+    def _is_new(self, timestamp, activity, in_payload):
+        if self.last_timestamp is None or timestamp > self.last_timestamp:
+            return True
+        if timestamp == self.last_timestamp:
+            key = activity_key(activity)
+            in_payload[key] = in_payload.get(key, 0) + 1
+            return in_payload[key] > self._at_watermark.get(key, 0)
+        return False
+
+    def fold(self, activities):
+        """Fold new activities in; returns how many were added"""
+        parsed = []
+        untimed = 0
+        at_watermark = {}
+        in_payload = {}
+        for activity in activities:
+            timestamp = parse_timestamp(activity.get('timestamp'))
+            if timestamp is None:
+                key = activity_key(activity)
+                in_payload[key] = in_payload.get(key, 0) + 1
+                if in_payload[key] > self._untimed.get(key, 0):
+                    self._untimed[key] = in_payload[key]
+                    self._untimed.move_to_end(key)
+                    if len(self._untimed) > self.max_untimed:
+                        self._untimed.popitem(last=False)
+                    self._add_duration(activity.get('application_name'), parse_duration(activity.get('duration')))
+                    untimed += 1
+            elif self._is_new(timestamp, activity, at_watermark):
+                parsed.append((timestamp, activity))
+        parsed.sort(key=lambda item: item[0])
+
+        for timestamp, activity in parsed:
+            self._add(timestamp, activity)
+        return len(parsed) + untimed
+
+    def _add_duration(self, app, duration):
+        if app is not None:
+            self.app_durations[app] = self.app_durations.get(app, 0) + duration
+
+    def _add(self, timestamp, activity):
+        app = activity.get('application_name')
+        duration = parse_duration(activity.get('duration'))
+
+        self.count += 1
+        self._add_duration(app, duration)
+
+        self.hour_counts[timestamp.hour] += 1
+        self.day_counts[timestamp.weekday()] += 1
+
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        if timestamp != self.last_timestamp:
+            self._at_watermark = {}
+        self.last_timestamp = timestamp
+        key = activity_key(activity)
+        self._at_watermark[key] = self._at_watermark.get(key, 0) + 1
+
+        self._observe(activity)
+        if app is None:
+            if self.buckets is not None:
+                self.buckets.add(wall_seconds(timestamp), None, duration)
+            return
+
+        previous = self._previous_apps
+        transition = workflow = None
+        if previous:
+            transition = (previous[-1], app)
+            self._count_transition(transition)
+        if len(previous) == self.workflow_length - 1:
+            workflow = previous + (app,)
+            self._count_workflow(workflow)
+        if self.buckets is not None:
+            self.buckets.add(wall_seconds(timestamp), app, duration, transition, workflow)
+        # Keep just enough history to complete the next workflow n-gram
+        self._previous_apps = (previous + (app,))[-max(1, self.workflow_length - 1):]
+
+    def category_durations(self):
+        """Seconds per productivity category, classified per distinct app so table changes apply at once"""
+        durations = {'high': 0, 'medium': 0, 'low': 0}
+        for app, t in self.app_durations.items():
+            category = self.classify(app)
+            if category:
+                durations[category] += t
+        return durations
+
+    def _count_transition(self, key):
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+
+    def _count_workflow(self, key):
+        self.workflows[key] = self.workflows.get(key, 0) + 1
+
+    def _observe(self, activity):
+        pass
+
+    def _top_transitions(self):
+        return self._top(self.transitions, self.top_transitions)
+
+    def _top_workflows(self):
+        return self._top(self.workflows, self.top_workflows)
+
+    @classmethod
+    def from_bucket(cls, bucket, classify, top_transitions=5, top_workflows=3, workflow_length=3):
+        """Aggregates equivalent to folding just the activities summarized in a time_buckets.Bucket"""
+        aggregates = cls(classify, top_transitions, top_workflows, workflow_length)
+        aggregates.count = bucket.count
+        aggregates.app_durations = dict(bucket.app_durations)
+        for (day, hour), count in bucket.hour_counts.items():
+            aggregates.hour_counts[hour] += count
+            aggregates.day_counts[(day + 3) % 7] += count  # 1970-01-01 was a Thursday
+        aggregates.transitions = bucket.transition_counts()
+        aggregates.workflows = bucket.workflow_counts()
+        if bucket.first is not None:
+            aggregates.first_timestamp = from_wall_seconds(bucket.first)
+            aggregates.last_timestamp = from_wall_seconds(bucket.last)
+        return aggregates
+
+    def merge(self, other):
+        """Add another stream's aggregates (e.g. another device of the same user) into this one"""
+        self.count += other.count
+        for app, t in other.app_durations.items():
+            self.app_durations[app] = self.app_durations.get(app, 0) + t
+        self.hour_counts = [a + b for a, b in zip(self.hour_counts, other.hour_counts)]
+        self.day_counts = [a + b for a, b in zip(self.day_counts, other.day_counts)]
+        for mine, theirs in ((self.transitions, other.transitions), (self.workflows, other.workflows)):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+        if other.first_timestamp is not None:
+            if self.first_timestamp is None or other.first_timestamp < self.first_timestamp:
+                self.first_timestamp = other.first_timestamp
+            if self.last_timestamp is None or other.last_timestamp > self.last_timestamp:
+                self.last_timestamp = other.last_timestamp
+        return self
+
+    @staticmethod
+    def _top(counts, k):
+        # nlargest is equivalent to sorted(..., reverse=True)[:k], ties keep first-seen order
+        return {' -> '.join(key): count
+                for key, count in heapq.nlargest(k, counts.items(), key=lambda item: item[1])}
+
+    def _sorted_histogram(self, counts):
+        # Same shape as pandas value_counts().to_dict(): non-zero buckets, most frequent first
+        items = [(index, count) for index, count in enumerate(counts) if count]
+        items.sort(key=lambda item: item[1], reverse=True)
+        return dict(items)
+
+    def to_features(self, now=None):
+        """Build the same feature dict DataProcessor produces from a full rebuild"""
+        now = now or datetime.now()
+        total_time = sum(self.app_durations.values())
+        features = {}
+
+        if total_time > 0:
+            features['app_usage'] = {app: t / total_time * 100 for app, t in self.app_durations.items()}
+            for category, t in self.category_durations().items():
+                features[f'{category}_productivity'] = t / total_time * 100
+        else:
+            features['app_usage'] = dict(self.app_durations)
+        features['total_tracked_time'] = total_time
+
+        features['time_of_day'] = now.hour
+        features['day_of_week'] = now.weekday()
+        features['is_weekend'] = 1 if now.weekday() >= 5 else 0
+        if self.count:
+            features['activity_hours'] = self._sorted_histogram(self.hour_counts)
+            features['activity_days'] = self._sorted_histogram(self.day_counts)
+
+            span = (self.last_timestamp - self.first_timestamp).total_seconds()
+            features['activity_density'] = self.count / max(1, span / 3600) if span > 0 else 0
+
+            hours = self.hour_counts
+            features['morning_pct'] = sum(hours[5:12]) / self.count * 100
+            features['afternoon_pct'] = sum(hours[12:18]) / self.count * 100
+            features['evening_pct'] = sum(hours[18:24]) / self.count * 100
+            features['night_pct'] = sum(hours[0:5]) / self.count * 100
+
+        if self.count < 2:
+            features['common_transitions'] = {}
+            features['workflows'] = {}
+        else:
+            features['common_transitions'] = self._top_transitions()
+            features['workflows'] = self._top_workflows()
+
+        return features
+
+
+class SketchedUserAggregates(UserAggregates):
+    """UserAggregates with fixed memory for transitions, workflows and distinct counts.
+
+    Transition and workflow n-grams go into Count-Min sketches with a
+    heavy-hitters candidate set instead of exact dicts, and distinct apps,
+    window titles and URLs are counted with HyperLogLog. N-gram counts are
+    estimates that never undercount; everything merges in time independent
+    of history length.
+    """
+
+    def __init__(self, classify, top_transitions=5, top_workflows=3, workflow_length=3,
+                 epsilon=0.01, delta=0.01, hll_precision=10, buckets=None):
+        super().__init__(classify, top_transitions, top_workflows, workflow_length, buckets)
+        self.epsilon = epsilon
+        self.delta = delta
+        self.hll_precision = hll_precision
+        self.transition_hitters = HeavyHitters(top_transitions, CountMinSketch.from_error(epsilon, delta))
+        self.workflow_hitters = HeavyHitters(top_workflows, CountMinSketch.from_error(epsilon, delta))
+        self.distinct_apps = HyperLogLog(hll_precision)
+        self.distinct_titles = HyperLogLog(hll_precision)
+        self.distinct_urls = HyperLogLog(hll_precision)
+
+    def _count_transition(self, key):
+        self.transition_hitters.add(' -> '.join(key))
+
+    def _count_workflow(self, key):
+        self.workflow_hitters.add(' -> '.join(key))
+
+    def _observe(self, activity):
+        self.distinct_apps.add(activity.get('application_name') or '')
+        if activity.get('window_title'):
+            self.distinct_titles.add(activity['window_title'])
+        url = activity.get('url') or (activity.get('activity_data') or {}).get('url')
+        if url:
+            self.distinct_urls.add(url)
+
+    def _top_transitions(self):
+        return dict(self.transition_hitters.top())
+
+    def _top_workflows(self):
+        return dict(self.workflow_hitters.top())
+
+    def merge(self, other):
+        super().merge(other)
+        self.transition_hitters.merge(other.transition_hitters)
+        self.workflow_hitters.merge(other.workflow_hitters)
+        self.distinct_apps.merge(other.distinct_apps)
+        self.distinct_titles.merge(other.distinct_titles)
+        self.distinct_urls.merge(other.distinct_urls)
+        return self
+
+    def to_features(self, now=None):
+        features = super().to_features(now)
+        features['distinct_apps'] = self.distinct_apps.count()
+        features['distinct_window_titles'] = self.distinct_titles.count()
+        features['distinct_urls'] = self.distinct_urls.count()
+        return features
+
+    @property
+    def sketch_bytes(self):
+        return sum(sketch.nbytes for sketch in (
+            self.transition_hitters.sketch, self.workflow_hitters.sketch,
+            self.distinct_apps, self.distinct_titles, self.distinct_urls
+        ))
+
+
+class FeatureAggregateStore:
+    """LRU-bounded map of (user_id, device_id) -> UserAggregates"""
+
+    def __init__(self, classify, max_entries=10000, workflow_length=3, factory=None):
+        self.classify = classify
+        self.max_entries = max_entries
+        self.workflow_length = workflow_length
+        # Builds a fresh aggregates object; lets DataProcessor switch to SketchedUserAggregates
+        self.factory = factory or (lambda: UserAggregates(self.classify, workflow_length=self.workflow_length))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id, device_id=None, create=True):
+        key = (user_id, device_id)
+        with self._lock:
+            aggregates = self._entries.get(key)
+            if aggregates is not None:
+                self._entries.move_to_end(key)
+            elif create:
+                aggregates = self._entries[key] = self.factory()
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return aggregates
+
+    def fold(self, user_id, device_id, activities, features=False, as_of=None):
+        """Fold activities into the (user, device) aggregates; returns their features when asked for"""
+        aggregates = self.get(user_id, device_id)
+        with self._lock:
+            added = aggregates.fold(activities)
+            # Read under the lock too: another request may be folding into the same stream
+            result = aggregates.to_features(as_of) if features else None
+        logger.debug(f"Folded {added} new activities for user {user_id} device {device_id}")
+        return result
+
+    def streams(self, user_id):
+        """Aggregates of every device stream of a user"""
+        with self._lock:
+            return [aggregates for (entry_user, _), aggregates in self._entries.items() if entry_user == user_id]
+
+    def merged(self, user_id):
+        """Aggregates of all of a user's devices combined, or None if the user is unknown"""
+        streams = self.streams(user_id)
+        with self._lock:
+            if not streams:
+                return None
+            combined = self.factory()
+            for aggregates in streams:
+                combined.merge(aggregates)
+            return combined
+
+    def reset(self, user_id, device_id=None):
+        with self._lock:
+            self._entries.pop((user_id, device_id), None)
@@ -0,0 +1,150 @@
+import zlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+
+
+class SchemaMismatchError(ValueError):
+    """Raised when vectors were produced with a different column registry"""
+
+
+class FeatureSchema:
+    """Versioned, ordered registry of the columns in an encoded feature vector.
+
+    Columns are declared in blocks; a block is a name plus its width, and
+    each column is named `block` or `block[i]`. The fingerprint is a CRC of
+    the column names, so reordering or resizing a block changes it even if
+    someone forgets to bump the version.
+    """
+
+    def __init__(self, version, blocks):
+        self.version = version
+        self.blocks = list(blocks)
+        self.columns = []
+        self._slices = {}
+        for name, width in self.blocks:
+            start = len(self.columns)
+            self.columns.extend([name] if width == 1 else [f"{name}[{i}]" for i in range(width)])
+            self._slices[name] = slice(start, start + width)
+        self.size = len(self.columns)
+        self.fingerprint = zlib.crc32('\n'.join(self.columns).encode('utf-8'))
+
+    def slice(self, block):
+        return self._slices[block]
+
+    def width(self, block):
+        block_slice = self._slices[block]
+        return block_slice.stop - block_slice.start
+
+    def to_dict(self):
+        return {'version': self.version, 'fingerprint': self.fingerprint, 'columns': list(self.columns)}
+
+
+APP_SLOTS = 16
+
+# Sized so the vector is DataProcessor's 64 columns
+DEFAULT_SCHEMA = FeatureSchema(SCHEMA_VERSION, [
+    ('app_usage', APP_SLOTS),          # hashed app slots, fraction of tracked time
+    ('activity_hours', 24),            # fraction of activities per hour of day
+    ('activity_days', 7),              # fraction of activities per weekday
+    ('productivity', 3),               # high / medium / low fraction of tracked time
+    ('time_of_day', 1),                # current hour / 23
+    ('day_of_week', 1),                # current weekday / 6
+    ('is_weekend', 1),
+    ('activity_density', 1),           # log1p(activities per hour)
+    ('total_tracked_time', 1),         # log1p(tracked hours)
+    ('day_parts', 4),                  # morning / afternoon / evening / night fraction
+    ('system_health', 3),              # cpu / memory / disk fraction
+    ('system_health_available', 1),
+    ('features_available', 1),
+])
+
+PRODUCTIVITY_KEYS = ('high_productivity', 'medium_productivity', 'low_productivity')
+DAY_PART_KEYS = ('morning_pct', 'afternoon_pct', 'evening_pct', 'night_pct')
+HEALTH_KEYS = ('cpu_usage', 'memory_usage', 'disk_usage')
+
+
+def app_slot(app_name, slots=APP_SLOTS):
+    """Stable hash slot for an app name (crc32, unlike hash() it survives restarts)"""
+    return zlib.crc32(str(app_name).encode('utf-8')) % slots
+
+
+class FeatureEncoder:
+    """Encodes DataProcessor feature dicts into contiguous float32 vectors"""
+
+    def __init__(self, schema=DEFAULT_SCHEMA):
+        self.schema = schema
+        self.size = schema.size
+        self._slot_cache = {}
+        self._app_slice = schema.slice('app_usage')
+        self._app_slots = schema.width('app_usage')
+
+    def _slot(self, app_name):
+        slot = self._slot_cache.get(app_name)
+        if slot is None:
+            if len(self._slot_cache) > 65536:
+                self._slot_cache.clear()
+            slot = self._slot_cache[app_name] = app_slot(app_name, self._app_slots)
+        return slot
+
+    @staticmethod
+    def _histogram(out, counts):
+        # Keys may be ints or, after a JSON round trip, strings
+        total = 0.0
+        for key, count in counts.items():
+            index = int(key)
+            if 0 <= index < len(out):
+                out[index] += count
+                total += count
+        if total > 0:
+            out /= total
+
+    def encode(self, features, out=None):
+        """Encode one feature dict; writes into `out` (a float32 row) when given"""
+        schema = self.schema
+        vector = np.zeros(self.size, dtype=np.float32) if out is None else out
+        if out is not None:
+            vector[:] = 0
+        if not features:
+            return vector
+
+        apps = vector[self._app_slice]
+        for app, pct in (features.get('app_usage') or {}).items():
+            apps[self._slot(app)] += (pct or 0) / 100.0
+
+        self._histogram(vector[schema.slice('activity_hours')], features.get('activity_hours') or {})
+        self._histogram(vector[schema.slice('activity_days')], features.get('activity_days') or {})
+
+        vector[schema.slice('productivity')] = [(features.get(key) or 0) / 100.0 for key in PRODUCTIVITY_KEYS]
+        vector[schema.slice('day_parts')] = [(features.get(key) or 0) / 100.0 for key in DAY_PART_KEYS]
+
+        vector[schema.slice('time_of_day')] = (features.get('time_of_day') or 0) / 23.0
+        vector[schema.slice('day_of_week')] = (features.get('day_of_week') or 0) / 6.0
+        vector[schema.slice('is_weekend')] = features.get('is_weekend') or 0
+        vector[schema.slice('activity_density')] = np.log1p(max(0.0, features.get('activity_density') or 0))
+        vector[schema.slice('total_tracked_time')] = np.log1p(max(0.0, features.get('total_tracked_time') or 0) / 3600.0)
+
+        health = features.get('system_health_metrics') or {}
+        vector[schema.slice('system_health')] = [(health.get(key) or 0) / 100.0 for key in HEALTH_KEYS]
+        vector[schema.slice('system_health_available')] = 1.0 if features.get('system_health_available') else 0.0
+        vector[schema.slice('features_available')] = 0.0 if features.get('features_available') is False else 1.0
+        return vector
+
+    def encode_batch(self, feature_dicts):
+        """Encode many feature dicts into one (n, size) float32 array"""
+        feature_dicts = list(feature_dicts)
+        matrix = np.zeros((len(feature_dicts), self.size), dtype=np.float32)
+        for row, features in enumerate(feature_dicts):
+            self.encode(features, out=matrix[row])
+        return matrix
+
+    def check_schema(self, version, fingerprint=None):
+        """Raise SchemaMismatchError unless (version, fingerprint) matches this encoder"""
+        if version != self.schema.version or (fingerprint is not None and fingerprint != self.schema.fingerprint):
+            raise SchemaMismatchError(
+                f"Feature schema mismatch: encoder v{self.schema.version} ({self.schema.fingerprint:08x}), "
+                f"got v{version} ({(fingerprint or 0):08x})"
+            )
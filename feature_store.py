@@ -0,0 +1,486 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+
+from feature_encoder import DEFAULT_SCHEMA, FeatureEncoder
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+
+class FeatureStore:
+    """Append-only store of per-user feature snapshots in memory-mapped float32 columns.
+
+    Layout of `directory`:
+        meta.json        schema version/fingerprint, generation, row count and the
+                         committed length of users.jsonl
+        col_NNN.f32      one float32 file per schema column
+        user.i32         user code per row (line number in users.jsonl)
+        timestamp.f64    unix timestamp per row
+        users.jsonl      user ids, one JSON string per line, appended as new
+                         users arrive
+        meta.lock        flock held by writers
+
+    Data files of generation g > 0 are named `g<g>.<name>`. Several processes
+    (gunicorn workers) can share a directory: an append takes the flock,
+    picks up rows other processes appended since it last looked, writes its
+    rows after them and publishes the new row count in meta.json before
+    releasing the lock. meta.json stays a small fixed header; the user table
+    only grows by appending to users.jsonl. Rows and user bytes past the
+    counts in meta.json are ignored (and overwritten by the next append), so
+    a crash mid-append loses only that append; the memory maps are flushed to
+    disk every `commit_every` rows. compact() writes the kept rows as a new
+    generation and switches to it with the single rename of meta.json, so a
+    crash leaves either the old store or the new one. Column reads are
+    zero-copy views of the memory maps.
+    """
+
+    META_FILE = 'meta.json'
+    LOCK_FILE = 'meta.lock'
+    USERS_FILE = 'users.jsonl'
+
+    def __init__(self, directory, schema=DEFAULT_SCHEMA, cache_size=1024, initial_capacity=1024,
+                 commit_every=100):
+        self.directory = os.path.expanduser(directory)
+        self.schema = schema
+        self.encoder = FeatureEncoder(schema)
+        self.cache_size = cache_size
+        self.commit_every = commit_every
+        self.rows = 0
+        self.capacity = 0
+        self.generation = 0
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()  # user_id -> latest vector
+        self._users = []
+        self._user_codes = {}
+        self._users_bytes = 0  # committed length of users.jsonl read into _users
+        self._new_users = []  # users coded by the append in progress, not yet in users.jsonl
+        self._index = {}  # user_id -> ([timestamps], [rows]) in append order
+        self._uncommitted = 0
+        self._meta_stamp = None  # (inode, mtime, size) of the meta.json last read or written
+        self._columns = []
+        self._user_column = None
+        self._timestamp_column = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._open(initial_capacity)
+
+    # -- files ---------------------------------------------------------------
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _column_files(self):
+        return [f"col_{i:03d}.f32" for i in range(self.schema.size)]
+
+    def _data_files(self):
+        return self._column_files() + ['user.i32', 'timestamp.f64']
+
+    def _data_path(self, name, generation=None):
+        generation = self.generation if generation is None else generation
+        return self._path(name if generation == 0 else f"g{generation}.{name}")
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive access to the files across threads and processes"""
+        with self._lock, open(self._path(self.LOCK_FILE), 'a') as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _map(self, name, dtype, capacity):
+        path = self._data_path(name)
+        size = capacity * np.dtype(dtype).itemsize
+        with open(path, 'ab') as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode='r+', shape=(capacity,))
+
+    def _map_all(self, capacity):
+        # Another process may have grown the files past what this one asked for
+        timestamp_path = self._data_path('timestamp.f64')
+        if os.path.exists(timestamp_path):
+            capacity = max(capacity, os.path.getsize(timestamp_path) // 8)
+        self._columns = [self._map(name, np.float32, capacity) for name in self._column_files()]
+        self._user_column = self._map('user.i32', np.int32, capacity)
+        self._timestamp_column = self._map('timestamp.f64', np.float64, capacity)
+        self.capacity = capacity
+
+    @staticmethod
+    def _stamp(stat):
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read_meta(self):
+        try:
+            with open(self._path(self.META_FILE)) as f:
+                stamp = self._stamp(os.fstat(f.fileno()))
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        self._meta_stamp = stamp
+        return meta
+
+    def _read_users(self, end):
+        """Append the user ids in users.jsonl between what was read so far and byte `end`"""
+        if end <= self._users_bytes:
+            return
+        with open(self._data_path(self.USERS_FILE), 'rb') as f:
+            f.seek(self._users_bytes)
+            data = f.read(end - self._users_bytes)
+        for line in data.splitlines():
+            user_id = json.loads(line)
+            self._user_codes[user_id] = len(self._users)
+            self._users.append(user_id)
+        self._users_bytes = end
+
+    def _load_users(self, meta):
+        """Reload the whole user table for `meta`'s generation"""
+        self._users = []
+        self._user_codes = {}
+        self._users_bytes = 0
+        if 'users' in meta:
+            # Written before users.jsonl existed: move the table out of meta.json
+            self._users = list(meta['users'])
+            self._user_codes = {user_id: code for code, user_id in enumerate(self._users)}
+            self._write_users(self._users, truncate=True)
+            self._write_meta(sync=True)
+        else:
+            self._read_users(meta.get('users_bytes', 0))
+
+    def _write_users(self, users, truncate=False):
+        """Append user ids to users.jsonl after its committed length (or as the whole file with `truncate`)"""
+        path = self._data_path(self.USERS_FILE)
+        payload = b''.join(json.dumps(user_id).encode('utf-8') + b'\n' for user_id in users)
+        with open(path, 'ab') as f:
+            # Drop anything an interrupted append left past the committed length
+            f.truncate(0 if truncate else self._users_bytes)
+            f.write(payload)
+            if truncate:
+                # A new generation's table; appends are only as durable as the meta.json that publishes them
+                f.flush()
+                os.fsync(f.fileno())
+        self._users_bytes = (0 if truncate else self._users_bytes) + len(payload)
+
+    def _open(self, initial_capacity):
+        with self._locked():
+            meta = self._read_meta()
+            if meta is not None:
+                self.encoder.check_schema(meta['version'], meta['fingerprint'])
+                self.generation = meta.get('generation', 0)
+                self.rows = meta['rows']
+                self._load_users(meta)
+            self._map_all(max(initial_capacity, self.rows))
+            self._rebuild_index()
+        logger.info(f"Opened feature store {self.directory} with {self.rows} rows")
+
+    def _rebuild_index(self):
+        self._index = {}
+        self._cache.clear()
+        self._index_rows(0, self.rows)
+
+    def _index_rows(self, start, end):
+        codes = self._user_column[start:end]
+        timestamps = self._timestamp_column[start:end]
+        for offset in range(end - start):
+            user_id = self._users[codes[offset]]
+            timestamps_rows = self._index.setdefault(user_id, ([], []))
+            timestamps_rows[0].append(float(timestamps[offset]))
+            timestamps_rows[1].append(start + offset)
+            self._cache.pop(user_id, None)
+
+    def _refresh(self):
+        """Pick up rows appended by other processes, or their compaction; call under self._lock"""
+        if not self._columns:
+            return
+        try:
+            stamp = self._stamp(os.stat(self._path(self.META_FILE)))
+        except FileNotFoundError:
+            return
+        if stamp == self._meta_stamp:
+            return
+        meta = self._read_meta()
+        if meta is None:
+            return
+        start = self.rows
+        if meta.get('generation', 0) != self.generation or meta['rows'] < start or 'users' in meta:
+            self.generation = meta.get('generation', 0)
+            self.rows = meta['rows']
+            self._load_users(meta)
+            self._map_all(self.rows)
+            self._rebuild_index()
+            return
+        self._read_users(meta['users_bytes'])
+        self.rows = meta['rows']
+        if self.rows > self.capacity:
+            self._map_all(self.rows)
+        self._index_rows(start, self.rows)
+
+    def _write_meta(self, sync=False):
+        meta = {
+            'version': self.schema.version,
+            'fingerprint': self.schema.fingerprint,
+            'generation': self.generation,
+            'rows': self.rows,
+            'users_bytes': self._users_bytes
+        }
+        meta_path = self._path(self.META_FILE)
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, meta_path)
+        self._meta_stamp = self._stamp(os.stat(meta_path))
+
+    def _flush(self):
+        for column in self._columns:
+            column.flush()
+        if self._user_column is not None:
+            self._user_column.flush()
+            self._timestamp_column.flush()
+        self._uncommitted = 0
+
+    def commit(self):
+        """Flush the memory maps to disk (the row count is published on every append)"""
+        with self._locked():
+            self._flush()
+
+    def close(self):
+        with self._locked():
+            self._flush()
+            self._columns = []
+            self._user_column = None
+            self._timestamp_column = None
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        for column in self._columns:
+            column.flush()
+        self._map_all(capacity)
+
+    # -- writes --------------------------------------------------------------
+
+    def _user_code(self, user_id):
+        code = self._user_codes.get(user_id)
+        if code is None:
+            code = self._user_codes[user_id] = len(self._users)
+            self._users.append(user_id)
+            self._new_users.append(user_id)
+        return code
+
+    def append(self, user_id, vector, timestamp=None):
+        """Append one snapshot (a feature dict or a float32 vector); returns its row"""
+        return self.append_batch([user_id], [vector], None if timestamp is None else [timestamp])[0]
+
+    def append_batch(self, user_ids, vectors, timestamps=None):
+        """Append many snapshots; vectors may be feature dicts or an (n, size) array"""
+        user_ids = [str(user_id) for user_id in user_ids]
+        if len(vectors) and isinstance(vectors[0], dict):
+            matrix = self.encoder.encode_batch(vectors)
+        else:
+            matrix = np.asarray(vectors, dtype=np.float32).reshape(len(user_ids), self.schema.size)
+        now = time.time()
+        timestamps = [now if t is None else float(t) for t in (timestamps or [None] * len(user_ids))]
+
+        with self._locked():
+            if not self._columns:
+                raise ValueError(f"Feature store {self.directory} is closed")
+            # Other workers may have appended since we last looked: write after their rows
+            self._refresh()
+            start = self.rows
+            end = start + len(user_ids)
+            if end > self.capacity:
+                self._grow(end)
+            for i, column in enumerate(self._columns):
+                column[start:end] = matrix[:, i]
+            self._user_column[start:end] = [self._user_code(user_id) for user_id in user_ids]
+            self._timestamp_column[start:end] = timestamps
+            if self._new_users:
+                new_users, self._new_users = self._new_users, []
+                self._write_users(new_users)
+            self.rows = end
+            self._write_meta()
+
+            for offset, (user_id, timestamp) in enumerate(zip(user_ids, timestamps)):
+                timestamps_rows = self._index.setdefault(user_id, ([], []))
+                timestamps_rows[0].append(timestamp)
+                timestamps_rows[1].append(start + offset)
+                self._cache_put(user_id, matrix[offset].copy())
+
+            self._uncommitted += len(user_ids)
+            if self._uncommitted >= self.commit_every:
+                self._flush()
+            return list(range(start, end))
+
+    # -- reads ---------------------------------------------------------------
+
+    def _cache_put(self, user_id, vector):
+        self._cache[user_id] = vector
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def row(self, index):
+        """The vector stored at a row (a copy gathered across the column files)"""
+        with self._lock:
+            self._refresh()
+            if not 0 <= index < self.rows:
+                raise IndexError(index)
+            return np.array([column[index] for column in self._columns], dtype=np.float32)
+
+    def latest(self, user_id):
+        """Most recent snapshot for a user, or None; served from the hot cache when possible"""
+        user_id = str(user_id)
+        with self._lock:
+            self._refresh()
+            vector = self._cache.get(user_id)
+            if vector is not None:
+                self._cache.move_to_end(user_id)
+                return vector
+            timestamps_rows = self._index.get(user_id)
+            if not timestamps_rows:
+                return None
+            latest_row = max(zip(*timestamps_rows))[1]
+            vector = self.row(latest_row)
+            self._cache_put(user_id, vector)
+            return vector
+
+    def find(self, user_id, timestamp):
+        """Row index of the snapshot for (user_id, timestamp), or None"""
+        with self._lock:
+            self._refresh()
+            timestamps_rows = self._index.get(str(user_id))
+        if not timestamps_rows:
+            return None
+        timestamps, rows = timestamps_rows
+        for t, row in zip(reversed(timestamps), reversed(rows)):
+            if t == timestamp:
+                return row
+        return None
+
+    def rows_for(self, user_id, start=None, end=None):
+        """Row indices of a user's snapshots with start <= timestamp < end"""
+        with self._lock:
+            self._refresh()
+            timestamps_rows = self._index.get(str(user_id))
+        if not timestamps_rows:
+            return np.empty(0, dtype=np.int64)
+        timestamps = np.asarray(timestamps_rows[0])
+        rows = np.asarray(timestamps_rows[1], dtype=np.int64)
+        mask = np.ones(len(rows), dtype=bool)
+        if start is not None:
+            mask &= timestamps >= start
+        if end is not None:
+            mask &= timestamps < end
+        return rows[mask]
+
+    def column(self, name):
+        """Zero-copy view of one column (by schema column name) over all committed rows"""
+        with self._lock:
+            self._refresh()
+            return self._columns[self.schema.columns.index(name)][:self.rows]
+
+    def timestamps(self):
+        with self._lock:
+            self._refresh()
+            return self._timestamp_column[:self.rows]
+
+    def user_codes(self):
+        """Per-row user codes; `users[code]` is the user id"""
+        with self._lock:
+            self._refresh()
+            return self._user_column[:self.rows]
+
+    @property
+    def users(self):
+        return list(self._users)
+
+    def matrix(self, rows=None):
+        """(n, size) float32 array of the given rows (all rows by default)"""
+        with self._lock:
+            self._refresh()
+            if rows is None:
+                rows = slice(0, self.rows)
+            return np.stack([column[rows] for column in self._columns], axis=1)
+
+    def history(self, user_id, start=None, end=None):
+        """(timestamps, matrix) of a user's snapshots in a time range"""
+        rows = self.rows_for(user_id, start, end)
+        return self._timestamp_column[rows], self.matrix(rows)
+
+    # -- maintenance ---------------------------------------------------------
+
+    def compact(self, keep_per_user=None, older_than=None):
+        """Rewrite the store without dropped rows.
+
+        keep_per_user: keep only each user's newest N snapshots
+        older_than: drop snapshots with timestamp < older_than
+
+        The kept rows are written as the files of the next generation, which
+        replacing meta.json switches to in one atomic rename; the previous
+        generation's files are removed afterwards.
+        """
+        with self._locked():
+            self._refresh()
+            keep = np.ones(self.rows, dtype=bool)
+            if older_than is not None:
+                keep &= self._timestamp_column[:self.rows] >= older_than
+            if keep_per_user is not None:
+                for timestamps, rows in self._index.values():
+                    ordered = [row for _, row in sorted(zip(timestamps, rows))]
+                    keep[ordered[:max(0, len(ordered) - keep_per_user)]] = False
+            kept_rows = np.flatnonzero(keep)
+            dropped = self.rows - len(kept_rows)
+            if not dropped:
+                return 0
+
+            # Re-number users so the user table only lists users that still have rows
+            codes = self._user_column[kept_rows]
+            live_codes, new_codes = np.unique(codes, return_inverse=True)
+            users = [self._users[code] for code in live_codes]
+
+            previous = self.generation
+            generation = previous + 1
+            capacity = max(1024, len(kept_rows))
+            sources = self._columns + [self._user_column, self._timestamp_column]
+            for name, source in zip(self._data_files(), sources):
+                data = new_codes.astype(np.int32) if name == 'user.i32' else source[kept_rows]
+                out = np.zeros(capacity, dtype=source.dtype)
+                out[:len(kept_rows)] = data
+                with open(self._data_path(name, generation), 'wb') as f:
+                    out.tofile(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            self.generation = generation
+            self.rows = len(kept_rows)
+            self._users = users
+            self._user_codes = {user_id: code for code, user_id in enumerate(users)}
+            self._write_users(users, truncate=True)
+            self._write_meta(sync=True)
+            self._map_all(capacity)
+            self._rebuild_index()
+            self._uncommitted = 0
+            for name in self._data_files() + [self.USERS_FILE]:
+                try:
+                    os.remove(self._data_path(name, previous))
+                except FileNotFoundError:
+                    pass
+            logger.info(f"Compacted feature store: dropped {dropped} rows, {self.rows} remain")
+            return dropped
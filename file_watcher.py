@@ -0,0 +1,356 @@
+import os
+import re
+import time
+import errno
+import select
+import struct
+import logging
+import platform
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# inotify constants (from <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# Directory names that are never worth watching (checked once, when adding watches)
+DEFAULT_EXCLUDED_NAMES = frozenset({'.git', 'node_modules', '__pycache__', '.cache', '.venv', 'venv'})
+
+
+class PrefixTrie:
+    """Trie of excluded directory prefixes compiled into a single anchored regex.
+
+    The compiled pattern is matched by the regex engine in C, so checking a
+    path costs one match() call regardless of how many exclusions there are.
+    """
+
+    def __init__(self, prefixes=()):
+        self.root = {}
+        for prefix in prefixes:
+            self.add(prefix)
+        self._pattern = None
+
+    def add(self, prefix):
+        parts = [p for p in os.path.abspath(os.path.expanduser(prefix)).split('/') if p]
+        node = self.root
+        for part in parts:
+            if node.get('') is True:
+                return  # A shorter prefix already excludes this one
+            node = node.setdefault(part, {})
+        node.clear()
+        node[''] = True
+        self._pattern = None
+
+    def _node_regex(self, node):
+        if node.get('') is True:
+            return ''
+        branches = [re.escape(part) + (('/' + self._node_regex(child)) if child.get('') is not True else '')
+                    for part, child in sorted(node.items())]
+        return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+
+    def compile(self):
+        if not self.root:
+            self._pattern = re.compile(r'(?!)')  # Matches nothing
+        elif self.root.get('') is True:
+            self._pattern = re.compile('/')  # '/' itself is excluded
+        else:
+            self._pattern = re.compile('/' + self._node_regex(self.root) + r'(?:/|$)')
+        return self._pattern
+
+    def matches(self, path):
+        pattern = self._pattern or self.compile()
+        return pattern.match(path) is not None
+
+
+class EventCoalescer:
+    """Merges bursts of inotify events per path into one record per quiet window"""
+
+    def __init__(self, window=2.0):
+        self.window = window
+        self._pending = {}
+        self._moves = {}
+
+    def add(self, path, mask, cookie=0, now=None):
+        now = time.monotonic() if now is None else now
+
+        if mask & IN_MOVED_FROM:
+            self._moves[cookie] = (path, now)
+            return
+        if mask & IN_MOVED_TO and cookie in self._moves:
+            old_path, _ = self._moves.pop(cookie)
+            self._pending.pop(old_path, None)
+            self._pending[path] = {'action': 'rename', 'old_path': old_path, 'first': now, 'last': now, 'count': 1}
+            return
+
+        if mask & (IN_CREATE | IN_MOVED_TO):
+            action = 'create'
+        elif mask & (IN_DELETE | IN_DELETE_SELF):
+            action = 'delete'
+        else:
+            action = 'modify'
+
+        entry = self._pending.get(path)
+        if entry is None:
+            self._pending[path] = {'action': action, 'old_path': None, 'first': now, 'last': now, 'count': 1}
+            return
+
+        entry['last'] = now
+        entry['count'] += 1
+        if action == 'delete':
+            if entry['action'] == 'create':
+                # Created and deleted inside one window (temp/build files): drop it
+                del self._pending[path]
+                return
+            entry['action'] = 'delete'
+        elif action == 'create' and entry['action'] == 'delete':
+            entry['action'] = 'modify'
+        # modify after create/rename keeps the original action
+
+    def pop_ready(self, now=None, force=False):
+        """Return coalesced (path, entry) pairs whose path has been quiet for `window` seconds"""
+        now = time.monotonic() if now is None else now
+        ready = []
+        for path, entry in list(self._pending.items()):
+            if force or now - entry['last'] >= self.window:
+                ready.append((path, self._pending.pop(path)))
+        # A MOVED_FROM without a matching MOVED_TO means the file left the watched tree
+        for cookie, (path, seen) in list(self._moves.items()):
+            if force or now - seen >= self.window:
+                del self._moves[cookie]
+                ready.append((path, {'action': 'delete', 'old_path': None, 'first': seen, 'last': seen, 'count': 1}))
+        return ready
+
+
+class InotifyWatcher:
+    """Recursive inotify watcher that emits coalesced FileActivity-shaped records.
+
+    Excluded directories are never watched, so their events are never read
+    at all; the compiled PrefixTrie is only consulted when adding watches and
+    for paths arriving through moves.
+    """
+
+    def __init__(self, paths, emit, excluded_directories=(), excluded_names=DEFAULT_EXCLUDED_NAMES,
+                 coalesce_window=2.0, max_watches=8192, batch_size=200):
+        self.paths = [os.path.abspath(os.path.expanduser(p)) for p in paths]
+        self.emit = emit  # callable receiving a list of records
+        self.excluded = PrefixTrie(excluded_directories)
+        self.excluded.compile()
+        self.excluded_names = frozenset(excluded_names)
+        self.coalescer = EventCoalescer(coalesce_window)
+        self.max_watches = max_watches
+        self.batch_size = batch_size
+        self.device_id = None
+        self.session_id = None
+        self.stop_event = threading.Event()
+        self.overflows = 0
+        self._fd = None
+        self._watches = {}  # watch descriptor -> directory path
+        self._dir_moves = {}  # cookie -> (old path, seen) of directories moved away, until their MOVED_TO
+        self._thread = None
+        self._libc = None
+
+    @staticmethod
+    def is_supported():
+        return platform.system() == 'Linux'
+
+    def _load_libc(self):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+
+    def _add_watch(self, path):
+        """0 on success, else the errno (ENOSPC once max_watches or the kernel's limit is reached)"""
+        import ctypes
+
+        if len(self._watches) >= self.max_watches:
+            return errno.ENOSPC
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            return ctypes.get_errno()
+        self._watches[wd] = path
+        return 0
+
+    @staticmethod
+    def _under(path, top):
+        return path == top or path.startswith(top + '/')
+
+    def _forget_tree(self, top):
+        """Drop the watches of a directory (and its subdirectories) that left the watched tree"""
+        for wd, path in list(self._watches.items()):
+            if self._under(path, top):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def _move_tree(self, old, new):
+        """Re-key the watches of a renamed directory; returns how many moved"""
+        moved = 0
+        for wd, path in self._watches.items():
+            if self._under(path, old):
+                self._watches[wd] = new + path[len(old):]
+                moved += 1
+        return moved
+
+    def _is_excluded(self, path):
+        return os.path.basename(path) in self.excluded_names or self.excluded.matches(path)
+
+    def _watch_tree(self, top):
+        if self._is_excluded(top):
+            return
+        for dirpath, dirnames, _ in os.walk(top):
+            error = self._add_watch(dirpath)
+            if error == errno.ENOSPC:
+                logger.warning(f"inotify watch limit reached at {dirpath} ({len(self._watches)} watches)")
+                dirnames[:] = []
+                return
+            if error:
+                # Unreadable or vanished directory: skip its subtree and keep walking
+                logger.warning(f"Cannot watch {dirpath}: {os.strerror(error)}")
+                dirnames[:] = []
+                continue
+            dirnames[:] = [d for d in dirnames if not self._is_excluded(os.path.join(dirpath, d))]
+
+    def _read_events(self, data):
+        offset = 0
+        now = time.monotonic()
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.overflows += 1
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+
+            if mask & IN_ISDIR:
+                if mask & IN_MOVED_FROM:
+                    self._dir_moves[cookie] = (path, now)
+                elif mask & IN_MOVED_TO and cookie in self._dir_moves:
+                    # Renamed inside the tree: its watches stay valid but their paths change
+                    old_path, _ = self._dir_moves.pop(cookie)
+                    if self._is_excluded(path):
+                        self._forget_tree(old_path)
+                    elif not self._move_tree(old_path, path):
+                        self._watch_tree(path)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    # New or moved-in directories need their own watches
+                    self._watch_tree(path)
+                continue
+            if mask & IN_MOVED_TO and self.excluded.matches(path):
+                continue
+            self.coalescer.add(path, mask, cookie, now)
+
+    def _to_record(self, path, entry):
+        name = os.path.basename(path)
+        size = None
+        if entry['action'] != 'delete':
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                pass
+        return {
+            'activity_type': 'file_operation',
+            'file_path': path,
+            'file_name': name,
+            'file_extension': os.path.splitext(name)[1].lstrip('.').lower() or None,
+            'file_size': size,
+            'action': entry['action'],
+            'old_path': entry['old_path'],
+            'device_id': self.device_id,
+            'session_id': self.session_id,
+            'timestamp': datetime.utcnow().isoformat(),
+            'activity_data': {'event_count': entry['count']}
+        }
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        for cookie, (path, seen) in list(self._dir_moves.items()):
+            # A directory moved out of the watched tree never gets its MOVED_TO
+            if force or now - seen >= self.coalescer.window:
+                del self._dir_moves[cookie]
+                if self._fd is not None:
+                    self._forget_tree(path)
+        ready = self.coalescer.pop_ready(force=force)
+        for start in range(0, len(ready), self.batch_size):
+            chunk = ready[start:start + self.batch_size]
+            try:
+                self.emit([self._to_record(path, entry) for path, entry in chunk])
+            except Exception as e:
+                logger.error(f"Error emitting file activity: {str(e)}")
+        return len(ready)
+
+    def run(self):
+        self._libc = self._load_libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(errno.EPERM, "inotify_init1 failed")
+        try:
+            for path in self.paths:
+                self._watch_tree(path)
+            logger.info(f"Watching {len(self._watches)} directories for file activity")
+
+            poller = select.poll()
+            poller.register(self._fd, select.POLLIN)
+            timeout_ms = int(self.coalescer.window * 1000 / 2) or 100
+            while not self.stop_event.is_set():
+                if poller.poll(timeout_ms):
+                    try:
+                        self._read_events(os.read(self._fd, 64 * 1024))
+                    except BlockingIOError:
+                        pass
+                self.flush()
+        finally:
+            self.flush(force=True)
+            os.close(self._fd)
+            self._fd = None
+            self._watches.clear()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self.stop_event.clear()
+        self._thread = threading.Thread(target=self._run_safely, name='file-watcher', daemon=True)
+        self._thread.start()
+
+    def _run_safely(self):
+        try:
+            self.run()
+        except Exception as e:
+            logger.error(f"Error tracking file operations: {str(e)}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._thread = None
@@ -0,0 +1,275 @@
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timezone
+import numpy as np
+
+from feature_aggregates import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+PERCENT_METRICS = ('cpu_usage', 'memory_usage', 'disk_usage')
+# Already bytes/s in HealthSampler output
+RATE_METRICS = ('network_in', 'network_out', 'disk_read', 'disk_write')
+METRICS = PERCENT_METRICS + RATE_METRICS
+
+# name -> (window seconds, slots); each slot covers window/slots seconds, so a window's edge moves in steps of
+# 30 s, 5 min and 1 h respectively
+WINDOWS = OrderedDict([('5m', (300, 10)), ('1h', (3600, 12)), ('24h', (86400, 24))])
+
+BINS = 50
+# Per-slot histogram counts are uint16; a bin stops counting in a slot once it holds this many samples
+MAX_SLOT_COUNT = np.iinfo(np.uint16).max
+
+
+def _bin_edges():
+    """Upper bin edges per metric: 2% steps for percentages, log-spaced 1 B/s .. 10 GB/s for rates"""
+    percent = np.linspace(100.0 / BINS, 100.0, BINS)
+    rate = np.logspace(0, 10, BINS)
+    return np.array([percent] * len(PERCENT_METRICS) + [rate] * len(RATE_METRICS))
+
+
+BIN_EDGES = _bin_edges()
+_METRIC_INDEX = np.arange(len(METRICS))
+_RATE_LOG_SCALE = (BINS - 1) / np.log10(BIN_EDGES[-1][-1])
+
+
+def value_bins(values):
+    """Histogram bin of each metric value (same bins as BIN_EDGES, computed arithmetically)"""
+    percents = np.ceil(values[:len(PERCENT_METRICS)] * (BINS / 100.0)) - 1
+    rates = np.ceil(np.log10(np.maximum(values[len(PERCENT_METRICS):], 1.0)) * _RATE_LOG_SCALE)
+    return np.clip(np.concatenate([percents, rates]), 0, BINS - 1).astype(np.int64)
+
+
+def sample_values(sample):
+    """Metric values of a health sample as a float64 array (NaN where missing)"""
+    values = np.full(len(METRICS), np.nan)
+    for i, metric in enumerate(METRICS):
+        value = sample.get(metric)
+        if value is not None:
+            try:
+                values[i] = float(value)
+            except (TypeError, ValueError):
+                pass
+    return values
+
+
+class RollingWindow:
+    """Per-metric count/sum/max and a fixed-bin histogram over a sliding time window.
+
+    The window is a ring of time slots with running totals, so adding a
+    sample is O(metrics) and expiring a slot subtracts it from the totals;
+    only max and P95 look across slots/bins, and only when queried. The
+    arrays are allocated on the first sample.
+    """
+
+    def __init__(self, seconds, slots):
+        self.seconds = seconds
+        self.slots = slots
+        self.slot_width = seconds / slots
+        self.counts = None
+        self.filled = [False] * slots  # Lets expiry skip slots that never got a sample
+        self.current_slot = None
+
+    @staticmethod
+    def slot_bytes():
+        metrics = len(METRICS)
+        return metrics * (4 + 8 + 4 + BINS * 2)
+
+    @classmethod
+    def estimate_nbytes(cls, slots):
+        metrics = len(METRICS)
+        return slots * cls.slot_bytes() + metrics * (4 + 8 + BINS * 4)
+
+    def _allocate(self):
+        slots, metrics = self.slots, len(METRICS)
+        self.counts = np.zeros((slots, metrics), dtype=np.int32)
+        self.sums = np.zeros((slots, metrics))
+        self.maxes = np.full((slots, metrics), -np.inf, dtype=np.float32)
+        self.histograms = np.zeros((slots, metrics, BINS), dtype=np.uint16)
+        self.total_counts = np.zeros(metrics, dtype=np.int32)
+        self.total_sums = np.zeros(metrics)
+        self.total_histogram = np.zeros((metrics, BINS), dtype=np.int32)
+
+    def _clear(self, position):
+        if not self.filled[position]:
+            return
+        self.filled[position] = False
+        self.total_counts -= self.counts[position]
+        self.total_sums -= self.sums[position]
+        self.total_histogram -= self.histograms[position]
+        self.counts[position] = 0
+        self.sums[position] = 0
+        self.maxes[position] = -np.inf
+        self.histograms[position] = 0
+
+    def _advance(self, slot):
+        if self.current_slot is None or slot - self.current_slot >= self.slots:
+            for position in range(self.slots):
+                self._clear(position)
+        else:
+            for expired in range(self.current_slot + 1, slot + 1):
+                self._clear(expired % self.slots)
+        self.current_slot = slot
+
+    def add(self, timestamp, values, present, bins):
+        """Add one sample; `values` is zero where `present` is False"""
+        if self.counts is None:
+            self._allocate()
+        slot = int(timestamp // self.slot_width)
+        if self.current_slot is None or slot > self.current_slot:
+            self._advance(slot)
+        elif slot <= self.current_slot - self.slots:
+            return False  # Older than the whole window
+        position = slot % self.slots
+        self.filled[position] = True
+        self.counts[position] += present
+        self.sums[position] += values
+        np.maximum(self.maxes[position], np.where(present, values, -np.inf), out=self.maxes[position])
+        counted = present & (self.histograms[position, _METRIC_INDEX, bins] < MAX_SLOT_COUNT)
+        self.histograms[position, _METRIC_INDEX, bins] += counted
+        self.total_counts += present
+        self.total_sums += values
+        self.total_histogram[_METRIC_INDEX, bins] += counted
+        return True
+
+    def summary(self, now=None):
+        """{metric: {'mean', 'max', 'p95', 'samples'}} for metrics with samples in the window"""
+        if self.counts is None:
+            return {}
+        if now is not None and self.current_slot is not None and int(now // self.slot_width) > self.current_slot:
+            self._advance(int(now // self.slot_width))
+        maxes = self.maxes.max(axis=0)
+        cumulative = np.cumsum(self.total_histogram, axis=1)
+        result = {}
+        for i, metric in enumerate(METRICS):
+            count = int(self.total_counts[i])
+            if not count:
+                continue
+            # Against the histogram's own total, which can trail count once a slot's bin saturates
+            p95_bin = int(np.searchsorted(cumulative[i], math.ceil(0.95 * int(cumulative[i][-1]))))
+            result[metric] = {
+                'mean': float(self.total_sums[i] / count),
+                'max': float(maxes[i]),
+                # Upper edge of the P95 bin, but never above the observed max
+                'p95': float(min(BIN_EDGES[i][min(p95_bin, BINS - 1)], maxes[i])),
+                'samples': count
+            }
+        return result
+
+
+class HealthStats:
+    """Streaming health statistics for one device: EWMA plus 5 min / 1 h / 24 h windows"""
+
+    def __init__(self, half_life=300.0, windows=None):
+        self.half_life = half_life
+        self.windows = OrderedDict((name, RollingWindow(seconds, slots))
+                                   for name, (seconds, slots) in (windows or WINDOWS).items())
+        self.ewma = np.full(len(METRICS), np.nan)
+        self.latest = {}
+        self.last_timestamp = None
+        self.samples = 0
+
+    @staticmethod
+    def _epoch(sample):
+        parsed = parse_timestamp(sample.get('timestamp') or sample.get('last_updated'))
+        if parsed is None:
+            return time.time()
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+    def add(self, sample):
+        """Fold one health sample in"""
+        timestamp = self._epoch(sample)
+        values = sample_values(sample)
+        present = ~np.isnan(values)
+        values = np.where(present, values, 0.0)
+        bins = value_bins(values)
+        for window in self.windows.values():
+            window.add(timestamp, values, present, bins)
+
+        if self.last_timestamp is None or timestamp >= self.last_timestamp:
+            # Time-aware EWMA: weight of the old value halves every half_life seconds
+            alpha = 1.0 if self.last_timestamp is None else 1.0 - 0.5 ** ((timestamp - self.last_timestamp) / self.half_life)
+            fresh = present & np.isnan(self.ewma)
+            self.ewma[fresh] = values[fresh]
+            update = present & ~fresh
+            self.ewma[update] += alpha * (values[update] - self.ewma[update])
+            self.last_timestamp = timestamp
+            self.latest = {metric: float(values[i]) for i, metric in enumerate(METRICS) if present[i]}
+        self.samples += 1
+
+    @staticmethod
+    def estimate_nbytes(windows=None):
+        """Approximate bytes of one device's statistics once it has samples"""
+        return sum(RollingWindow.estimate_nbytes(slots) for _, slots in (windows or WINDOWS).values()) + 1024
+
+    def summary(self):
+        return {
+            'ewma': {metric: float(self.ewma[i]) for i, metric in enumerate(METRICS) if not np.isnan(self.ewma[i])},
+            'latest': dict(self.latest),
+            'windows': {name: window.summary(self.last_timestamp) for name, window in self.windows.items()},
+            'samples': self.samples
+        }
+
+    def to_features(self):
+        """Health features for the RL state"""
+        if not self.samples:
+            return {'system_health_available': False}
+        summary = self.summary()
+        ewma = summary['ewma']
+        features = {
+            # Smoothed percentages in the shape FeatureEncoder expects
+            'system_health_metrics': {metric: ewma.get(metric, 0) for metric in PERCENT_METRICS},
+            'system_health_available': True,
+            'system_health_windows': summary['windows'],
+            'system_health_rates': {metric: ewma[metric] for metric in RATE_METRICS if metric in ewma}
+        }
+        hour = summary['windows'].get('1h', {})
+        if 'cpu_usage' in hour:
+            features['cpu_p95_1h'] = hour['cpu_usage']['p95']
+        if 'memory_usage' in hour:
+            features['memory_p95_1h'] = hour['memory_usage']['p95']
+        return features
+
+
+class HealthStatsStore:
+    """LRU-bounded map of device_id -> HealthStats.
+
+    The device cap is the smaller of `max_devices` and what fits in
+    `memory_budget` bytes (about 40 KB per device with the default windows).
+    """
+
+    def __init__(self, max_devices=10000, half_life=300.0, memory_budget=64 * 1024 * 1024):
+        self.max_devices = max(1, min(max_devices, memory_budget // HealthStats.estimate_nbytes()))
+        self.half_life = half_life
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, device_id, create=False):
+        with self._lock:
+            stats = self._entries.get(device_id)
+            if stats is not None:
+                self._entries.move_to_end(device_id)
+            elif create:
+                stats = self._entries[device_id] = HealthStats(self.half_life)
+                if len(self._entries) > self.max_devices:
+                    self._entries.popitem(last=False)
+            return stats
+
+    def add(self, device_id, samples):
+        """Fold one sample or a list of samples into a device's statistics"""
+        if isinstance(samples, dict):
+            samples = [samples]
+        stats = self.get(device_id, create=True)
+        with self._lock:
+            for sample in samples:
+                if isinstance(sample, dict):
+                    stats.add(sample)
+        return stats
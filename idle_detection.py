@@ -0,0 +1,188 @@
+import os
+import time
+import logging
+import platform
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+
+class IdleSource:
+    """Base class for backends reporting seconds since the last user input"""
+
+    name = 'base'
+
+    def get_idle_seconds(self):
+        """Return idle seconds, or None if the backend can't tell"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class XScreenSaverIdleSource(IdleSource):
+    """X11 backend using the MIT-SCREEN-SAVER extension over one persistent connection"""
+
+    name = 'xscreensaver'
+
+    def __init__(self, display_name=None):
+        import ctypes
+        import ctypes.util
+
+        class XScreenSaverInfo(ctypes.Structure):
+            _fields_ = [
+                ('window', ctypes.c_ulong),
+                ('state', ctypes.c_int),
+                ('kind', ctypes.c_int),
+                ('til_or_since', ctypes.c_ulong),
+                ('idle', ctypes.c_ulong),
+                ('eventMask', ctypes.c_ulong)
+            ]
+
+        xlib_path = ctypes.util.find_library('X11')
+        xss_path = ctypes.util.find_library('Xss')
+        if not xlib_path or not xss_path:
+            raise OSError("libX11/libXss not found")
+
+        self._xlib = ctypes.cdll.LoadLibrary(xlib_path)
+        self._xss = ctypes.cdll.LoadLibrary(xss_path)
+        self._xlib.XOpenDisplay.restype = ctypes.c_void_p
+        self._xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        self._xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        self._xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        self._xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        self._xss.XScreenSaverAllocInfo.restype = ctypes.POINTER(XScreenSaverInfo)
+        self._xss.XScreenSaverQueryInfo.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(XScreenSaverInfo)
+        ]
+
+        name = display_name.encode() if display_name else None
+        self._display = self._xlib.XOpenDisplay(name)
+        if not self._display:
+            raise OSError("Cannot open X display")
+        self._root = self._xlib.XDefaultRootWindow(self._display)
+        self._info = self._xss.XScreenSaverAllocInfo()
+
+    def get_idle_seconds(self):
+        if not self._xss.XScreenSaverQueryInfo(self._display, self._root, self._info):
+            return None
+        return self._info.contents.idle / 1000.0
+
+    def close(self):
+        if self._display:
+            self._xlib.XCloseDisplay(self._display)
+            self._display = None
+
+
+class LogindIdleSource(IdleSource):
+    """systemd-logind backend based on the session IdleHint.
+
+    loginctl is only queried every `refresh_interval` seconds; in between,
+    idle time is extrapolated from IdleSinceHintMonotonic, which shares the
+    CLOCK_MONOTONIC base with time.monotonic() on Linux.
+    """
+
+    name = 'logind'
+
+    def __init__(self, session_id=None, refresh_interval=10):
+        self.session_id = session_id or os.environ.get('XDG_SESSION_ID')
+        if not self.session_id:
+            raise OSError("No logind session id")
+        self.refresh_interval = refresh_interval
+        self._checked_at = None
+        self._idle_since = None
+
+    def _refresh(self):
+        output = subprocess.check_output(
+            ['loginctl', 'show-session', self.session_id, '-p', 'IdleHint', '-p', 'IdleSinceHintMonotonic'],
+            timeout=2
+        ).decode()
+        values = dict(line.split('=', 1) for line in output.splitlines() if '=' in line)
+        if values.get('IdleHint') == 'yes' and values.get('IdleSinceHintMonotonic', '0') != '0':
+            self._idle_since = int(values['IdleSinceHintMonotonic']) / 1e6
+        else:
+            self._idle_since = None
+
+    def get_idle_seconds(self):
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.refresh_interval:
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.error(f"Error reading logind idle hint: {str(e)}")
+                return None
+            self._checked_at = now
+        if self._idle_since is None:
+            return 0.0
+        return max(0.0, now - self._idle_since)
+
+
+class Win32IdleSource(IdleSource):
+    """Windows backend using GetLastInputInfo"""
+
+    name = 'win32'
+
+    def __init__(self):
+        import ctypes
+
+        class LASTINPUTINFO(ctypes.Structure):
+            _fields_ = [('cbSize', ctypes.c_uint), ('dwTime', ctypes.c_uint)]
+
+        self._ctypes = ctypes
+        self._info = LASTINPUTINFO()
+        self._info.cbSize = ctypes.sizeof(LASTINPUTINFO)
+
+    def get_idle_seconds(self):
+        windll = self._ctypes.windll
+        if not windll.user32.GetLastInputInfo(self._ctypes.byref(self._info)):
+            return None
+        return ((windll.kernel32.GetTickCount() - self._info.dwTime) & 0xFFFFFFFF) / 1000.0
+
+
+class FakeIdleSource(IdleSource):
+    """In-process backend for tests and benchmarks"""
+
+    name = 'fake'
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._last_input = clock()
+
+    def touch(self):
+        """Simulate user input now"""
+        self._last_input = self.clock()
+
+    def set_idle(self, seconds):
+        self._last_input = self.clock() - seconds
+
+    def get_idle_seconds(self):
+        return max(0.0, self.clock() - self._last_input)
+
+
+class NullIdleSource(IdleSource):
+    """Backend for platforms without idle detection: the user is never idle"""
+
+    name = 'null'
+
+    def get_idle_seconds(self):
+        return 0.0
+
+
+def create_idle_source(system=None):
+    """Pick the cheapest idle backend available for the platform"""
+    system = system or platform.system()
+
+    if system == 'Linux':
+        for source_class in (XScreenSaverIdleSource, LogindIdleSource):
+            try:
+                return source_class()
+            except Exception as e:
+                logger.debug(f"Idle source {source_class.name} unavailable: {str(e)}")
+    elif system == 'Windows':
+        try:
+            return Win32IdleSource()
+        except Exception as e:
+            logger.debug(f"Idle source win32 unavailable: {str(e)}")
+
+    logger.warning("No idle detection available; idle time will be reported as 0")
+    return NullIdleSource()
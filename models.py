@@ -382,8 +382,8 @@ class SystemHealth(db.Model, TimestampMixin):
     cpu_usage = db.Column(db.Float)  # Percentage
     memory_usage = db.Column(db.Float)  # Percentage
     disk_usage = db.Column(db.Float)  # Percentage
-    network_in = db.Column(db.Float)  # Bytes
-    network_out = db.Column(db.Float)  # Bytes
+    network_in = db.Column(db.Float)  # Bytes per second
+    network_out = db.Column(db.Float)  # Bytes per second
     battery_level = db.Column(db.Float)  # Percentage
     processes_count = db.Column(db.Integer)  # Number of running processes
     
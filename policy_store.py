@@ -0,0 +1,516 @@
+import os
+import zlib
+import struct
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'WFQT'
+JOURNAL_MAGIC = b'WFQJ'
+FORMAT_VERSION = 1
+DEFAULT_Q = 0.1
+
+# magic, format version, generation, category count
+_HEADER = struct.Struct('<4sHQH')
+# record length (after this prefix), crc32 of the record body
+_RECORD_PREFIX = struct.Struct('<II')
+# writer id, key length
+_RECORD_HEAD = struct.Struct('<QH')
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+
+class PolicyFormatError(ValueError):
+    """A Q-table snapshot or journal that this version cannot read"""
+
+
+def _encode_header(magic, generation, categories):
+    names = b''.join(struct.pack('<H', len(name)) + name for name in (c.encode('utf-8') for c in categories))
+    return _HEADER.pack(magic, FORMAT_VERSION, generation, len(categories)) + names
+
+
+def decode_header(data, magic):
+    """(generation, categories, offset of the first record)"""
+    if len(data) < _HEADER.size:
+        raise PolicyFormatError("Truncated header")
+    found, version, generation, count = _HEADER.unpack_from(data)
+    if found != magic:
+        raise PolicyFormatError(f"Bad magic {found!r}")
+    if version != FORMAT_VERSION:
+        raise PolicyFormatError(f"Unsupported format version {version}")
+    offset = _HEADER.size
+    categories = []
+    for _ in range(count):
+        (length,) = struct.unpack_from('<H', data, offset)
+        offset += 2
+        categories.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    return generation, categories, offset
+
+
+def _encode_record(writer, key, values):
+    encoded_key = key.encode('utf-8')
+    body = _RECORD_HEAD.pack(writer, len(encoded_key)) + encoded_key + values.astype('<f4').tobytes()
+    return _RECORD_PREFIX.pack(len(body), zlib.crc32(body)) + body
+
+
+def iter_records(data, offset, width):
+    """Yield (writer, key, float32 values, end offset); stops at a torn or corrupt tail"""
+    while offset + _RECORD_PREFIX.size <= len(data):
+        length, crc = _RECORD_PREFIX.unpack_from(data, offset)
+        start = offset + _RECORD_PREFIX.size
+        body = data[start:start + length]
+        if len(body) < length or zlib.crc32(body) != crc:
+            return
+        writer, key_length = _RECORD_HEAD.unpack_from(body)
+        key = body[_RECORD_HEAD.size:_RECORD_HEAD.size + key_length].decode('utf-8')
+        values = np.frombuffer(body, dtype='<f4', count=width, offset=_RECORD_HEAD.size + key_length)
+        offset = start + length
+        yield writer, key, values, offset
+
+
+class QTableStore:
+    """Durable Q-table: a binary snapshot plus an append-only journal of value deltas.
+
+    Files next to `path`:
+        <path>           snapshot: header (magic, version, generation, category
+                         names) then one record per state with absolute values
+        <path>.journal   header with the same generation, then records of
+                         float32 deltas appended since the snapshot
+        <path>.lock      flock held while appending or compacting
+
+    Feedback updates only add to an in-memory pending map; a background
+    thread appends them to the journal at most every `debounce` seconds and
+    rewrites the snapshot (temp file, fsync, atomic rename) once the journal
+    holds `compact_every` records. Deltas from several processes sharing the
+    files add up, and each flush also picks up the records other processes
+    appended since the last one.
+    """
+
+    def __init__(self, path, categories, debounce=2.0, compact_every=5000, sync_interval=30.0, default=DEFAULT_Q):
+        self.path = os.path.expanduser(path)
+        self.journal_path = self.path + '.journal'
+        self.lock_path = self.path + '.lock'
+        self.categories = list(categories)
+        self.debounce = debounce
+        self.compact_every = compact_every
+        self.sync_interval = sync_interval
+        self.default = default
+        self.writer_id = (os.getpid() << 32) | int.from_bytes(os.urandom(4), 'little')
+        self.generation = 0
+        self.flushes = 0
+        self._journal_offset = 0
+        self._journal_records = 0
+        self._pending = {}  # state_key -> float32 deltas not yet in the journal
+        self._remote = {}  # state_key -> deltas appended by other processes, not yet applied
+        self._reload = None  # full table to adopt after another process compacted
+        self._relayout = False
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # -- table conversion ------------------------------------------------------
+
+    def _row(self, values, categories, fill=None):
+        """Map values stored under `categories` onto this store's category order"""
+        if categories == self.categories:
+            return np.array(values, dtype=np.float32)
+        row = np.full(len(self.categories), self.default if fill is None else fill, dtype=np.float32)
+        index = {category: i for i, category in enumerate(categories)}
+        for i, category in enumerate(self.categories):
+            if category in index:
+                row[i] = values[index[category]]
+        return row
+
+    def to_dict(self, table):
+        return {key: dict(zip(self.categories, row.tolist())) for key, row in table.items()}
+
+    # -- file access -------------------------------------------------------------
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive access to the files across threads and processes"""
+        with self._file_lock, open(self.lock_path, 'a') as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read(path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _read_table(self):
+        """(generation, {state_key: float32 values}, journal end offset, journal records); call under the file lock.
+
+        The end offset is None when the journal has to be recreated (missing,
+        stale or written with other categories).
+        """
+        table = {}
+        generation = 0
+        self._relayout = False
+        snapshot = self._read(self.path)
+        if snapshot is not None:
+            generation, categories, offset = decode_header(snapshot, SNAPSHOT_MAGIC)
+            self._relayout = categories != self.categories
+            for _, key, values, offset in iter_records(snapshot, offset, len(categories)):
+                table[key] = self._row(values, categories)
+
+        journal = self._read(self.journal_path)
+        end, records = None, 0
+        if journal is not None:
+            try:
+                journal_generation, categories, end = decode_header(journal, JOURNAL_MAGIC)
+            except PolicyFormatError as e:
+                logger.warning(f"Discarding unreadable journal {self.journal_path}: {str(e)}")
+                journal_generation, end = None, None
+            if journal_generation is not None and journal_generation == generation:
+                for _, key, values, end in iter_records(journal, end, len(categories)):
+                    row = table.get(key)
+                    if row is None:
+                        row = table[key] = np.full(len(self.categories), self.default, dtype=np.float32)
+                    row += self._row(values, categories, fill=0.0)
+                    records += 1
+                if end < len(journal):
+                    # Torn tail from a crash mid-append: cut it so later appends stay readable
+                    logger.warning(f"Truncating {len(journal) - end} corrupt bytes from {self.journal_path}")
+                    with open(self.journal_path, 'r+b') as f:
+                        f.truncate(end)
+                if categories != self.categories:
+                    self._relayout = True
+            else:
+                # Unreadable, or left over from before the last snapshot swap (its deltas are in the snapshot)
+                end = None
+        return generation, table, end, records
+
+    def _write_atomic(self, path, payload):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _new_journal(self, generation):
+        header = _encode_header(JOURNAL_MAGIC, generation, self.categories)
+        self._write_atomic(self.journal_path, header)
+        return len(header)
+
+    def load(self):
+        """Warm start: {state_key: {category: value}} from the snapshot plus the journal"""
+        with self._locked():
+            try:
+                generation, table, end, records = self._read_table()
+            except PolicyFormatError as e:
+                logger.error(f"Ignoring unreadable Q-table at {self.path}: {str(e)}")
+                return {}
+            self.generation = generation
+            if self._relayout:
+                # Categories changed since the files were written: rewrite them in the current layout
+                self._compact()
+            else:
+                if end is None:
+                    end, records = self._new_journal(generation), 0
+                self._journal_offset = end
+                self._journal_records = records
+        logger.info(f"Loaded {len(table)} Q-table states (generation {generation}, {records} journal records)")
+        return self.to_dict(table)
+
+    # -- updates -----------------------------------------------------------------
+
+    def record(self, state_key, category, delta):
+        """Queue a Q-value change; never touches the disk"""
+        try:
+            index = self.categories.index(category)
+        except ValueError:
+            return
+        with self._lock:
+            row = self._pending.get(state_key)
+            if row is None:
+                row = self._pending[state_key] = np.zeros(len(self.categories), dtype=np.float32)
+            row[index] += delta
+        self._wake.set()
+
+    def drain(self):
+        """(full table or None, {state_key: deltas}) picked up from other processes since the last call.
+
+        When a full table is returned it already includes this process's
+        flushed updates; pending ones still have to be added on top.
+        """
+        with self._lock:
+            reload, remote = self._reload, self._remote
+            self._reload, self._remote = None, {}
+            if reload is not None:
+                for key, row in self._pending.items():
+                    base = reload.setdefault(key, np.full(len(self.categories), self.default, dtype=np.float32))
+                    base += row
+        return (self.to_dict(reload) if reload is not None else None), \
+            {key: dict(zip(self.categories, row.tolist())) for key, row in remote.items()}
+
+    def flush(self):
+        """Append pending deltas to the journal, pick up other writers' records, compact if due"""
+        pending = {}
+        try:
+            with self._locked():
+                # Swapped under the file lock so readers never see deltas that are neither pending nor written
+                with self._lock:
+                    pending, self._pending = self._pending, {}
+                generation, tail = self._journal_since(self._journal_offset)
+                if generation != self.generation:
+                    self._adopt_generation(pending)
+                else:
+                    self._tail(tail)
+
+                if pending:
+                    payload = b''.join(_encode_record(self.writer_id, key, row) for key, row in pending.items())
+                    fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND)
+                    try:
+                        os.write(fd, payload)
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                    self._journal_offset += len(payload)
+                    self._journal_records += len(pending)
+                    self._appended(pending)
+
+                if self._journal_records >= self.compact_every:
+                    self._compact()
+        except Exception as e:
+            logger.error(f"Error writing Q-table journal: {str(e)}")
+            with self._lock:
+                # Keep the deltas for the next attempt
+                for key, row in pending.items():
+                    current = self._pending.get(key)
+                    self._pending[key] = row if current is None else current + row
+            return False
+        self.flushes += 1
+        return True
+
+    def _journal_since(self, offset):
+        """(journal generation or None if missing/unreadable, bytes after `offset`; none if offset is None)"""
+        if not os.path.exists(self.journal_path):
+            return None, b''
+        with open(self.journal_path, 'rb') as f:
+            try:
+                generation = decode_header(f.read(65536), JOURNAL_MAGIC)[0]
+            except PolicyFormatError:
+                return None, b''
+            if offset is None:
+                return generation, b''
+            f.seek(offset)
+            return generation, f.read()
+
+    def _adopt_generation(self, pending):
+        """Another process swapped in a new snapshot: adopt it wholesale (call under the file lock)"""
+        self.generation, table, end, self._journal_records = self._read_table()
+        if end is None:
+            end, self._journal_records = self._new_journal(self.generation), 0
+        self._journal_offset = end
+        for key, row in pending.items():
+            base = table.setdefault(key, np.full(len(self.categories), self.default, dtype=np.float32))
+            base += row
+        with self._lock:
+            self._reload, self._remote = table, {}
+
+    def _appended(self, pending):
+        """Hook: `pending` deltas were just written to the journal"""
+
+    def _remote_record(self, key, values):
+        row = self._remote.get(key)
+        self._remote[key] = values.copy() if row is None else row + values
+
+    def _tail(self, data):
+        """Collect records other processes appended after our offset"""
+        if not data:
+            return
+        width = len(self.categories)
+        end = 0
+        with self._lock:
+            for writer, key, values, end in iter_records(data, 0, width):
+                self._journal_records += 1
+                if writer != self.writer_id:
+                    self._remote_record(key, values)
+        self._journal_offset += end
+
+    def _compact(self):
+        """Fold the journal into a new snapshot generation; call under the file lock"""
+        generation, table, _, _ = self._read_table()
+        generation += 1
+        parts = [_encode_header(SNAPSHOT_MAGIC, generation, self.categories)]
+        # Sorted so keys sharing a prefix are contiguous in the snapshot
+        parts.extend(_encode_record(0, key, table[key]) for key in sorted(table))
+        self._write_atomic(self.path, b''.join(parts))
+        # A crash between the two swaps leaves an old-generation journal, which load() ignores
+        self._journal_offset = self._new_journal(generation)
+        self._journal_records = 0
+        self.generation = generation
+        logger.info(f"Compacted Q-table to {len(table)} states (generation {generation})")
+
+    def compact(self):
+        self.flush()
+        with self._locked():
+            self._compact()
+
+    # -- background writer -----------------------------------------------------------
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='qtable-writer', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._closed.is_set():
+            # Woken by feedback, or periodically to pick up other processes' updates
+            self._wake.wait(self.sync_interval)
+            # Debounce: let a burst of feedback collect into one append
+            if self._closed.wait(self.debounce):
+                break
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        """Stop the writer and flush whatever is pending"""
+        self._closed.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+
+class FeedbackLedger:
+    """Shared record of the reward last applied for each suggestion, so feedback is applied once across processes.
+
+    Files next to `path`:
+        <path>          header (journal magic, generation, ['reward']) then one
+                        record per rating: suggestion id and the reward applied
+        <path>.lock     flock held while reading the tail and appending
+
+    apply() reads what other processes appended, looks up the previous
+    reward for the id and appends the new one, all under the flock, so a
+    repeated or changed rating replaces the earlier one instead of adding
+    to it whichever worker receives it. Only the newest `capacity` ids are
+    remembered; once the file holds twice that many records it is rewritten
+    with just those. With no path the ledger is in-memory only.
+    """
+
+    def __init__(self, path=None, capacity=100000):
+        self.path = os.path.expanduser(path) if path else None
+        self.lock_path = self.path + '.lock' if self.path else None
+        self.capacity = capacity
+        self.writer_id = (os.getpid() << 32) | int.from_bytes(os.urandom(4), 'little')
+        self.generation = None
+        self._offset = 0
+        self._records = 0
+        self._rewards = OrderedDict()  # suggestion id -> reward last applied
+        self._file_lock = threading.Lock()
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        with self._file_lock, open(self.lock_path, 'a') as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _remember(self, suggestion_id, reward):
+        self._rewards[suggestion_id] = reward
+        self._rewards.move_to_end(suggestion_id)
+        if len(self._rewards) > self.capacity:
+            self._rewards.popitem(last=False)
+
+    def _write(self, generation):
+        """Rewrite the file with the remembered rewards; call under the file lock"""
+        parts = [_encode_header(JOURNAL_MAGIC, generation, ['reward'])]
+        parts.extend(_encode_record(0, key, np.array([reward], dtype=np.float32))
+                     for key, reward in self._rewards.items())
+        payload = b''.join(parts)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.generation = generation
+        self._offset = len(payload)
+        self._records = len(self._rewards)
+
+    def _catch_up(self):
+        """Fold in records other processes appended since the last call; call under the file lock"""
+        data = QTableStore._read(self.path)
+        generation = None
+        if data is not None:
+            try:
+                generation, _, offset = decode_header(data, JOURNAL_MAGIC)
+            except PolicyFormatError as e:
+                logger.warning(f"Discarding unreadable feedback ledger {self.path}: {str(e)}")
+                data = None
+        if data is None:
+            self._write(0 if self.generation is None else self.generation + 1)
+            return
+        if generation != self.generation:
+            # First read, or another process rewrote the file
+            self._rewards.clear()
+            self.generation, self._records = generation, 0
+        else:
+            offset = self._offset
+        end = offset
+        for _, key, values, end in iter_records(data, offset, 1):
+            # Rewards are short decimals; undo the float32 rounding so re-sent feedback cancels exactly
+            self._remember(key, round(float(values[0]), 6))
+            self._records += 1
+        if end < len(data):
+            # Torn tail from a crash mid-append: cut it so later appends stay readable
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+        self._offset = end
+
+    def apply(self, suggestion_id, reward):
+        """Record `reward` as applied for a suggestion; returns the reward applied before, or None"""
+        if self.path is None:
+            with self._file_lock:
+                previous = self._rewards.get(suggestion_id)
+                self._remember(suggestion_id, reward)
+            return previous
+        with self._locked():
+            self._catch_up()
+            previous = self._rewards.get(suggestion_id)
+            record = _encode_record(self.writer_id, suggestion_id, np.array([reward], dtype=np.float32))
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+            try:
+                os.write(fd, record)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._offset += len(record)
+            self._records += 1
+            self._remember(suggestion_id, reward)
+            if self._records >= 2 * self.capacity:
+                self._write(self.generation + 1)
+        return previous
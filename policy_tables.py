@@ -0,0 +1,303 @@
+import os
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from policy_store import QTableStore, PolicyFormatError, SNAPSHOT_MAGIC, JOURNAL_MAGIC, decode_header, iter_records
+
+logger = logging.getLogger(__name__)
+
+GROUP_SEP = '\x1f'
+
+
+def group_key(group, key):
+    return f"{group}{GROUP_SEP}{key}"
+
+
+class GroupedQTableStore(QTableStore):
+    """QTableStore with '<group>\\x1f<key>' keys that is read back one group (user) at a time.
+
+    Snapshots are written sorted by key, so a group's records are one
+    contiguous byte range; only those ranges are indexed in memory. Journal
+    deltas since the last snapshot are kept in memory by group (bounded by
+    compact_every), so loading a group is one seek plus dict lookups.
+    """
+
+    def __init__(self, path, categories, compact_every=2000, **kwargs):
+        kwargs.setdefault('default', 0.0)
+        super().__init__(path, categories, compact_every=compact_every, **kwargs)
+        self._spans = {}  # group -> (start, end) of its snapshot records
+        self._journal_groups = {}  # group -> {key: deltas} journaled since the snapshot
+        self._stale = False
+
+    def _add_journal(self, key, values):
+        group, _, state_key = key.partition(GROUP_SEP)
+        rows = self._journal_groups.setdefault(group, {})
+        row = rows.get(state_key)
+        rows[state_key] = values.copy() if row is None else row + values
+
+    def _index(self):
+        """Index the snapshot by group and read the journal; call under the file lock.
+
+        Returns False when the files were written with other categories and
+        need rewriting first.
+        """
+        self._spans, self._journal_groups = {}, {}
+        generation = 0
+        snapshot = self._read(self.path)
+        if snapshot is not None:
+            generation, categories, offset = decode_header(snapshot, SNAPSHOT_MAGIC)
+            if categories != self.categories:
+                return False
+            for _, key, _, end in iter_records(snapshot, offset, len(categories)):
+                group = key.partition(GROUP_SEP)[0]
+                span = self._spans.get(group)
+                self._spans[group] = (offset if span is None else span[0], end)
+                offset = end
+
+        self.generation = generation
+        journal = self._read(self.journal_path)
+        try:
+            journal_generation, categories, end = decode_header(journal, JOURNAL_MAGIC) if journal else (None, None, 0)
+        except PolicyFormatError:
+            journal_generation = None
+        if journal_generation != generation:
+            self._journal_offset, self._journal_records = self._new_journal(generation), 0
+            return True
+        if categories != self.categories:
+            return False
+        records = 0
+        for _, key, values, end in iter_records(journal, end, len(categories)):
+            self._add_journal(key, values)
+            records += 1
+        if end < len(journal):
+            logger.warning(f"Truncating {len(journal) - end} corrupt bytes from {self.journal_path}")
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(end)
+        self._journal_offset, self._journal_records = end, records
+        return True
+
+    def load(self):
+        """Index the files; groups are read on demand with load_group()"""
+        with self._locked():
+            try:
+                if not self._index():
+                    self._compact()
+            except PolicyFormatError as e:
+                logger.error(f"Ignoring unreadable policy shard at {self.path}: {str(e)}")
+        return {}
+
+    def load_group(self, group):
+        """{key: float32 values} of one group: snapshot records plus journaled and pending deltas"""
+        prefix = group + GROUP_SEP
+        table = {}
+        with self._locked():
+            if self._journal_since(None)[0] != self.generation:
+                self._adopt_generation({})
+            span = self._spans.get(group)
+            if span is not None:
+                with open(self.path, 'rb') as f:
+                    f.seek(span[0])
+                    data = f.read(span[1] - span[0])
+                for _, key, values, _ in iter_records(data, 0, len(self.categories)):
+                    if key.startswith(prefix):
+                        table[key[len(prefix):]] = values.copy()
+            for key, row in self._journal_groups.get(group, {}).items():
+                table[key] = table[key] + row if key in table else row.copy()
+            with self._lock:
+                # Other processes' deltas for this group are in the journal rows read above
+                for key in [key for key in self._remote if key.startswith(prefix)]:
+                    del self._remote[key]
+                for key, row in self._pending.items():
+                    if key.startswith(prefix):
+                        key = key[len(prefix):]
+                        table[key] = table[key] + row if key in table else row.copy()
+        return table
+
+    def _adopt_generation(self, pending):
+        # Another process compacted: re-index, and make resident groups re-read themselves
+        self._index()
+        with self._lock:
+            self._stale, self._remote = True, {}
+
+    def _appended(self, pending):
+        for key, row in pending.items():
+            self._add_journal(key, row)
+
+    def _remote_record(self, key, values):
+        super()._remote_record(key, values)
+        self._add_journal(key, values)
+
+    def _compact(self):
+        super()._compact()
+        self._index()
+
+    def drain_groups(self):
+        """(stale, {group: {key: deltas}}): whether resident groups must be reloaded, and other processes' deltas"""
+        with self._lock:
+            stale, remote = self._stale, self._remote
+            self._stale, self._remote = False, {}
+        grouped = {}
+        for key, row in remote.items():
+            group, _, state_key = key.partition(GROUP_SEP)
+            grouped.setdefault(group, {})[state_key] = row
+        return stale, grouped
+
+
+class PolicyTable:
+    """One user's Q-value offsets: state_key -> row of a float32 matrix"""
+
+    __slots__ = ('rows', 'values')
+
+    # Rough Python overhead of the table itself, and of one dict entry plus its key string
+    TABLE_BYTES = 400
+    ENTRY_BYTES = 120
+
+    def __init__(self, width, rows=None):
+        self.rows = {}
+        self.values = np.zeros((max(4, len(rows or ())), width), dtype=np.float32)
+        for state_key, values in (rows or {}).items():
+            self.row(state_key, create=True)[:] = values
+
+    def __len__(self):
+        return len(self.rows)
+
+    def row(self, state_key, create=False):
+        """Writable view of a state's offsets; None for unseen states unless create"""
+        index = self.rows.get(state_key)
+        if index is None:
+            if not create:
+                return None
+            index = self.rows[state_key] = len(self.rows)
+            if index == len(self.values):
+                grown = np.zeros((2 * len(self.values), self.values.shape[1]), dtype=np.float32)
+                grown[:index] = self.values
+                self.values = grown
+        return self.values[index]
+
+    @property
+    def nbytes(self):
+        return self.TABLE_BYTES + self.values.nbytes + self.ENTRY_BYTES * len(self.rows)
+
+
+class PolicyShard:
+    """LRU of resident user tables for the users hashed to one shard"""
+
+    def __init__(self, categories, budget, path=None, debounce=2.0):
+        self.categories = list(categories)
+        self.budget = budget
+        self.tables = OrderedDict()  # user_id -> PolicyTable, least recently used first
+        self.bytes = 0
+        self.loads = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.store = None
+        if path:
+            self.store = GroupedQTableStore(path, self.categories, debounce=debounce)
+            self.store.load()
+            self.store.start()
+
+    def _sync(self):
+        if self.store is None:
+            return
+        stale, remote = self.store.drain_groups()
+        if stale:
+            self.tables.clear()
+            self.bytes = 0
+            return
+        for user_id, rows in remote.items():
+            table = self.tables.get(user_id)
+            if table is None:
+                continue
+            before = table.nbytes
+            for state_key, deltas in rows.items():
+                table.row(state_key, create=True)[:] += deltas
+            self.bytes += table.nbytes - before
+
+    def table(self, user_id):
+        """The user's table, loaded from the store on a miss; call under self.lock"""
+        self._sync()
+        table = self.tables.get(user_id)
+        if table is not None:
+            self.tables.move_to_end(user_id)
+            return table
+        rows = self.store.load_group(user_id) if self.store is not None else None
+        table = self.tables[user_id] = PolicyTable(len(self.categories), rows)
+        self.bytes += table.nbytes
+        self.loads += 1
+        self._evict()
+        return table
+
+    def _evict(self):
+        # Everything a user learned is already journaled (or pending), so eviction only drops memory
+        while self.bytes > self.budget and len(self.tables) > 1:
+            _, table = self.tables.popitem(last=False)
+            self.bytes -= table.nbytes
+            self.evictions += 1
+
+    def update(self, user_id, state_key, category_index, delta):
+        with self.lock:
+            table = self.table(user_id)
+            before = table.nbytes
+            table.row(state_key, create=True)[category_index] += delta
+            self.bytes += table.nbytes - before
+            if self.store is not None:
+                self.store.record(group_key(user_id, state_key), self.categories[category_index], delta)
+            self._evict()
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+class PolicyTables:
+    """Per-user Q-value tables, sharded by user id and bounded by a memory budget.
+
+    Each user's table holds offsets on top of a shared prior (the global
+    Q-table), so a new user starts from what everyone taught the model and
+    only states a user gave feedback in cost memory. Users are hashed to
+    `shards` shards, each with its own lock, LRU and persistent store under
+    `directory`; when a shard exceeds its share of `memory_budget` bytes its
+    least recently used users are dropped from memory and read back from the
+    store on their next request. Without a directory evicted users start
+    over from the prior.
+    """
+
+    def __init__(self, categories, directory=None, shards=16, memory_budget=64 * 1024 * 1024, debounce=2.0):
+        self.categories = list(categories)
+        self.directory = os.path.expanduser(directory) if directory else None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        budget = memory_budget // shards
+        self.shards = [
+            PolicyShard(self.categories, budget,
+                        os.path.join(self.directory, f"shard_{i:03d}.bin") if self.directory else None, debounce)
+            for i in range(shards)
+        ]
+
+    def shard(self, user_id):
+        return self.shards[zlib.crc32(str(user_id).encode('utf-8')) % len(self.shards)]
+
+    def offsets(self, user_id, state_key):
+        """The user's float32 offsets for a state (zeros if they never gave feedback there)"""
+        shard = self.shard(user_id)
+        with shard.lock:
+            row = shard.table(str(user_id)).row(state_key)
+            return row.copy() if row is not None else np.zeros(len(self.categories), dtype=np.float32)
+
+    def update(self, user_id, state_key, category, delta):
+        self.shard(user_id).update(str(user_id), state_key, self.categories.index(category), delta)
+
+    def stats(self):
+        return {
+            'resident_users': sum(len(shard.tables) for shard in self.shards),
+            'bytes': sum(shard.bytes for shard in self.shards),
+            'loads': sum(shard.loads for shard in self.shards),
+            'evictions': sum(shard.evictions for shard in self.shards)
+        }
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
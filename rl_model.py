@@ -1,15 +1,52 @@
+import re
 import logging
 import numpy as np
 from datetime import datetime, timedelta
 import os
 import json
 import random
+import threading
+from collections import deque
+
+from suggestion_history import SuggestionHistory
+from suggestion_templates import TemplateCorpus
+from feature_encoder import APP_SLOTS, app_slot
 
 logger = logging.getLogger(__name__)
 
+FEEDBACK_REWARDS = {'helpful': 1.0, 'somewhat_helpful': 0.5, 'not_helpful': -0.2}
+# What _get_state_key produces
+STATE_KEY_PATTERN = re.compile(r'(morning|afternoon|evening|night)_\d_[01]_(high|medium|low)_(app\d{1,3}|unknown)')
+
 class RLModel:
-    def __init__(self):
-        """Initialize the RL model for workflow suggestions"""
+    def __init__(self, state_path=None, checkpoint_interval=2.0, history_size=10000, history_max_age=7 * 86400,
+                 policy_dir=None, policy_shards=16, policy_memory_budget=64 * 1024 * 1024, prior_rate=0.1,
+                 templates_path=None, template_cache_size=4096,
+                 policy='q_table', bandit_alpha=1.0, bandit_path=None, bandit_save_every=100,
+                 bandit_sync_interval=30.0, id_secret=None):
+        """Initialize the RL model for workflow suggestions
+
+        Args:
+            state_path: File the Q-table is persisted to (warm-started from at boot); None keeps it in memory only
+            checkpoint_interval: Seconds feedback updates are collected before being written out
+            history_size: Suggestions (and feedback records) kept for attributing feedback
+            history_max_age: Seconds after which a suggestion no longer takes feedback from history
+            policy_dir: Directory for per-user policy shards; None keeps per-user tables in memory only
+            policy_shards: Number of user shards (each with its own lock, LRU and store file)
+            policy_memory_budget: Bytes of per-user tables kept in memory before cold users are evicted
+            prior_rate: Share of a user's feedback that also moves the global prior all users start from
+            templates_path: Corpus file (JSON or JSON lines) whose categories replace the built-in templates
+            template_cache_size: Rendered suggestions kept in the render cache
+            policy: 'q_table' (epsilon-greedy over state keys), or 'linucb' / 'thompson' contextual bandits
+                over the encoded feature vector
+            bandit_alpha: LinUCB exploration width
+            bandit_path: .npz file the bandit parameters are saved to and warm-started from; workers sharing it
+                pool their updates
+            bandit_save_every: Feedback updates between background saves of the bandit parameters
+            bandit_sync_interval: Seconds between saves that pick up other workers' bandit updates
+            id_secret: Key suggestion ids are signed with; workers sharing it accept each other's ids, and without
+                one only this process's ids are accepted
+        """
         logger.info("Initializing RL model")
         
         # Initialize model parameters
@@ -92,9 +129,140 @@ class RLModel:
             ]
         }
         
-        # Initialize suggestion history
-        self.suggestion_history = []
-        self.feedback_history = []
+        # Templates are compiled once; a corpus file can replace the built-in ones per category
+        if templates_path:
+            try:
+                corpus = TemplateCorpus.load(templates_path)
+                unknown = [category for category in corpus.categories if category not in self.suggestion_categories]
+                if unknown:
+                    logger.warning(f"Ignoring templates for unknown categories: {', '.join(unknown)}")
+                for category in self.suggestion_categories:
+                    if corpus.categories.get(category):
+                        self.suggestion_templates[category] = [template.text for template in corpus.categories[category]]
+            except Exception as e:
+                logger.error(f"Error loading suggestion templates from {templates_path}: {str(e)}")
+        self.template_corpus = TemplateCorpus(self.suggestion_templates, cache_size=template_cache_size)
+        
+        # Contextual bandit alternative to the Q-table, over FeatureEncoder vectors plus a bias term
+        self.policy = policy
+        self.bandit = None
+        self.bandit_path = bandit_path
+        self.bandit_save_every = bandit_save_every
+        self.bandit_sync_interval = bandit_sync_interval
+        self._bandit_updates = 0
+        self._bandit_wake = threading.Event()
+        self._bandit_closed = threading.Event()
+        self._bandit_writer = None
+        if policy != 'q_table':
+            from bandits import LinearBandit
+            from feature_encoder import FeatureEncoder
+            self.encoder = FeatureEncoder()
+            self.bandit = LinearBandit(self.suggestion_categories, self.encoder.size + 1, strategy=policy,
+                                       alpha=bandit_alpha)
+            if bandit_path:
+                try:
+                    self.bandit.load(bandit_path, expect=self._bandit_meta())
+                except Exception as e:
+                    logger.error(f"Error loading bandit state: {str(e)}")
+                self._bandit_writer = threading.Thread(target=self._run_bandit_writer, name='bandit-writer',
+                                                       daemon=True)
+                self._bandit_writer.start()
+        
+        # Bounded suggestion and feedback history; memory stays flat in long-running servers
+        self.suggestion_history = SuggestionHistory(capacity=history_size, max_age=history_max_age,
+                                                    secret=id_secret)
+        self.feedback_history = deque(maxlen=history_size)
+
+        # Durable Q-table: warm start from disk, write feedback updates in the background
+        self.policy_store = None
+        if state_path:
+            try:
+                from policy_store import QTableStore
+                self.policy_store = QTableStore(state_path, self.suggestion_categories, debounce=checkpoint_interval)
+                self.q_values.update(self.policy_store.load())
+                self.policy_store.start()
+            except Exception as e:
+                logger.error(f"Error loading persisted Q-table: {str(e)}")
+                self.policy_store = None
+
+        # Reward applied per suggestion id, shared by the workers so a rating counts once whichever one receives it
+        from policy_store import FeedbackLedger
+        self.feedback_ledger = FeedbackLedger(state_path + '.feedback' if state_path else None, capacity=history_size)
+
+        # Per-user offsets on top of the global Q-table, which acts as the prior
+        self.prior_rate = prior_rate
+        self.user_policies = None
+        try:
+            from policy_tables import PolicyTables
+            self.user_policies = PolicyTables(self.suggestion_categories, directory=policy_dir, shards=policy_shards,
+                                              memory_budget=policy_memory_budget, debounce=checkpoint_interval)
+        except Exception as e:
+            logger.error(f"Error opening per-user policy tables: {str(e)}")
+
+    def _new_q_row(self):
+        return {category: 0.1 for category in self.suggestion_categories}
+
+    def _sync_policy(self):
+        """Apply Q-table updates other processes have written since the last call"""
+        if self.policy_store is None:
+            return
+        table, remote = self.policy_store.drain()
+        if table is not None:
+            self.q_values = table
+        for state_key, deltas in remote.items():
+            row = self.q_values.setdefault(state_key, self._new_q_row())
+            for category, delta in deltas.items():
+                row[category] = row.get(category, 0.1) + delta
+
+    def _bandit_meta(self):
+        return {'schema_version': self.encoder.schema.version, 'schema_fingerprint': self.encoder.schema.fingerprint}
+    
+    def _save_bandit(self, background=True):
+        """Merge bandit updates into the shared file; in the background this only wakes the writer thread"""
+        if self.bandit is None or not self.bandit_path:
+            return
+        if background:
+            self._bandit_wake.set()
+            return
+        try:
+            self.bandit.save(self.bandit_path, expect=self._bandit_meta())
+        except Exception as e:
+            logger.error(f"Error saving bandit state: {str(e)}")
+
+    def _run_bandit_writer(self):
+        # One writer, so saves never race; waking periodically also picks up other workers' updates
+        while not self._bandit_closed.is_set():
+            self._bandit_wake.wait(self.bandit_sync_interval)
+            if self._bandit_closed.is_set():
+                break
+            self._bandit_wake.clear()
+            self._save_bandit(background=False)
+
+    def _context_vector(self, features):
+        """Numeric bandit context: the encoded feature vector plus a constant bias term"""
+        context = np.empty(self.encoder.size + 1)
+        context[:-1] = self.encoder.encode(features)
+        context[-1] = 1.0
+        return context
+    
+    def score_categories(self, feature_dicts):
+        """(n, categories) bandit scores for many feature dicts at once"""
+        contexts = np.ones((len(feature_dicts), self.encoder.size + 1))
+        contexts[:, :-1] = self.encoder.encode_batch(feature_dicts)
+        return self.bandit.scores(contexts)
+    
+    def close(self):
+        """Flush pending Q-table updates to disk"""
+        self._bandit_closed.set()
+        self._bandit_wake.set()
+        if self._bandit_writer is not None:
+            self._bandit_writer.join(timeout=5)
+            self._bandit_writer = None
+        self._save_bandit(background=False)
+        if self.policy_store is not None:
+            self.policy_store.close()
+        if self.user_policies is not None:
+            self.user_policies.close()
     
     def _extract_features_for_rl(self, features_dict):
         """Extract relevant features from the feature dictionary for RL decision making"""
@@ -131,7 +299,8 @@ class RLModel:
         # Simplified state key - just use the hour of day and top app
         time_of_day = state_features.get('time_of_day', 0)
         day_of_week = state_features.get('day_of_week', 0)
-        top_app = state_features.get('top_app_1', 'unknown')
+        # Hashed app slot rather than the raw name, so the number of states stays bounded however many apps users run
+        top_app = f"app{app_slot(state_features['top_app_1'], APP_SLOTS)}" if 'top_app_1' in state_features else 'unknown'
         is_weekend = state_features.get('is_weekend', 0)
         
         # Time period (morning, afternoon, evening, night)
@@ -162,64 +331,23 @@ class RLModel:
     
     def _format_suggestion(self, template, state_features):
         """Format a suggestion template with actual state values"""
-        # Extract values for formatting
-        formatted = template
-        
-        # Replace {app} with the top app
-        if '{app}' in template:
-            app = state_features.get('top_app_1', 'your frequently used application')
-            formatted = formatted.replace('{app}', app)
-        
-        # Replace {app1} and {app2} for workflow optimization
-        if '{app1}' in template:
-            app1 = state_features.get('top_app_1', 'your first application')
-            formatted = formatted.replace('{app1}', app1)
-        
-        if '{app2}' in template:
-            app2 = state_features.get('top_app_2', 'your second application')
-            formatted = formatted.replace('{app2}', app2)
-        
-        if '{app3}' in template:
-            app3 = state_features.get('top_app_3', 'your third application')
-            formatted = formatted.replace('{app3}', app3)
-        
-        # Replace {duration} with a reasonable duration based on app usage
-        if '{duration}' in template:
-            duration = int(state_features.get('activity_density', 5) * 10)
-            duration = max(10, min(duration, 120))  # Between 10 and 120 minutes
-            formatted = formatted.replace('{duration}', str(duration))
-        
-        # Replace {time_of_day} with the current period
-        if '{time_of_day}' in template:
-            hour = state_features.get('time_of_day', datetime.now().hour)
-            if 5 <= hour < 12:
-                time_of_day = 'morning'
-            elif 12 <= hour < 17:
-                time_of_day = 'afternoon'
-            elif 17 <= hour < 22:
-                time_of_day = 'evening'
-            else:
-                time_of_day = 'late night'
-            formatted = formatted.replace('{time_of_day}', time_of_day)
-        
-        # Replace {start_time} and {end_time} with reasonable work hours
-        if '{start_time}' in template:
-            start_hour = max(8, min(state_features.get('time_of_day', 9) - 1, 11))
-            start_time = f"{start_hour}:00"
-            formatted = formatted.replace('{start_time}', start_time)
-        
-        if '{end_time}' in template:
-            end_hour = max(16, min(state_features.get('time_of_day', 17) + 1, 20))
-            end_time = f"{end_hour}:00"
-            formatted = formatted.replace('{end_time}', end_time)
-        
-        return formatted
+        return self.template_corpus.render(self.template_corpus.compile(template), state_features)
     
-    def _select_suggestion_category(self, state_key):
+    def _q_values_for(self, state_key, user_id=None):
+        """Q-values of a state: the global table, plus the user's own offsets when a user is given"""
+        self._sync_policy()
+        if state_key not in self.q_values:
+            self.q_values[state_key] = self._new_q_row()
+        q_values = self.q_values[state_key]
+        if user_id is None or self.user_policies is None:
+            return q_values
+        offsets = self.user_policies.offsets(user_id, state_key)
+        return {category: q_values[category] + float(offsets[i]) for i, category in enumerate(self.suggestion_categories)}
+    
+    def _select_suggestion_category(self, state_key, user_id=None):
         """Select a suggestion category using reinforcement learning"""
         # If this state doesn't exist in our Q-table, initialize it
-        if state_key not in self.q_values:
-            self.q_values[state_key] = {category: 0.1 for category in self.suggestion_categories}
+        q_values = self._q_values_for(state_key, user_id)
         
         # Epsilon-greedy strategy for exploration/exploitation
         if random.random() < self.exploration_rate:
@@ -227,90 +355,108 @@ class RLModel:
             return random.choice(self.suggestion_categories)
         else:
             # Exploitation: Choose the best category according to Q-values
-            q_values = self.q_values[state_key]
             return max(q_values, key=q_values.get)
     
     def _get_suggestions_for_category(self, category, state_features, count=1):
         """Get suggestions for a specific category"""
-        if category not in self.suggestion_templates:
+        if category not in self.template_corpus.categories:
             logger.warning(f"Unknown suggestion category: {category}")
             category = 'productivity'  # Fallback to productivity
         
-        # Get templates for this category
-        templates = self.suggestion_templates[category]
-        
-        # Format templates with state data
-        formatted_suggestions = []
-        for template in templates:
-            formatted = self._format_suggestion(template, state_features)
-            formatted_suggestions.append(formatted)
-        
-        # Shuffle and take requested number
-        random.shuffle(formatted_suggestions)
-        return formatted_suggestions[:count]
+        # Render only the sampled templates
+        return self.template_corpus.sample(category, state_features, count)
     
-    def generate_suggestions(self, features):
-        """Generate workflow suggestions based on the provided feature vector"""
+    def generate_suggestion_items(self, features, user_id=None):
+        """Generate workflow suggestions as [{'id', 'content', 'category'}]; ids identify them in feedback"""
         try:
+            user_id = str(user_id) if user_id is not None else None
             # Extract features for RL
             state_features = self._extract_features_for_rl(features)
             
             # Get state key for the Q-table
             state_key = self._get_state_key(state_features)
             
-            # Generate suggestions from different categories
-            suggestions = []
-            
             # Use RL to select the primary suggestion category
-            primary_category = self._select_suggestion_category(state_key)
+            context = None
+            if self.bandit is not None:
+                context = self._context_vector(features)
+                scores = self.bandit.scores(context)[0]
+                if user_id is not None and self.user_policies is not None:
+                    # The user's own offsets for this state, as with the Q-table
+                    scores = scores + self.user_policies.offsets(user_id, state_key)
+                primary_category = self.suggestion_categories[int(np.argmax(scores))]
+            else:
+                primary_category = self._select_suggestion_category(state_key, user_id)
             primary_suggestions = self._get_suggestions_for_category(primary_category, state_features, count=2)
-            suggestions.extend(primary_suggestions)
             
             # Get one suggestion from other categories
             other_categories = [c for c in self.suggestion_categories if c != primary_category]
             random.shuffle(other_categories)
             secondary_category = other_categories[0]
             secondary_suggestions = self._get_suggestions_for_category(secondary_category, state_features, count=1)
-            suggestions.extend(secondary_suggestions)
             
             # Add these suggestions to the history
-            for suggestion in suggestions:
-                self.suggestion_history.append({
-                    'content': suggestion,
-                    'state_key': state_key,
-                    'category': primary_category if suggestion in primary_suggestions else secondary_category,
-                    'timestamp': datetime.now().isoformat()
-                })
+            items = []
+            for category, contents in ((primary_category, primary_suggestions), (secondary_category, secondary_suggestions)):
+                for content in contents:
+                    suggestion_id = self.suggestion_history.add(
+                        state_key, category, content, self.suggestion_categories.index(category), user_id, context)
+                    items.append({'id': suggestion_id, 'content': content, 'category': category})
             
             # Ensure we have a reasonable number of suggestions
-            if len(suggestions) > 3:
-                suggestions = suggestions[:3]
-            elif len(suggestions) < 3:
-                # Fill with generic suggestions if needed
+            if len(items) > 3:
+                items = items[:3]
+            elif len(items) < 3:
+                # Fill with generic suggestions if needed; they carry no id as no category was chosen for them
                 generic_suggestions = [
                     "Consider organizing your files into project-based folders for easier access.",
                     "Take regular breaks to maintain productivity. Try the Pomodoro technique: 25 minutes of focus followed by a 5-minute break.",
                     "Keep your workspace organized to improve focus and efficiency."
                 ]
-                suggestions.extend(generic_suggestions[:(3 - len(suggestions))])
+                items.extend({'id': None, 'content': content, 'category': None}
+                             for content in generic_suggestions[:(3 - len(items))])
             
-            return suggestions
+            return items
             
         except Exception as e:
             logger.error(f"Error generating suggestions: {str(e)}")
             # Return generic suggestions as fallback
-            return [
+            return [{'id': None, 'content': content, 'category': None} for content in [
                 "Consider organizing your files into project-based folders for easier access.",
                 "Clean up your desktop and dock/taskbar to focus on applications you actually use.",
                 "Take regular breaks to maintain productivity. Try the Pomodoro technique."
-            ]
+            ]]
+    
+    def generate_suggestions(self, features, user_id=None):
+        """Generate workflow suggestions based on the provided feature vector"""
+        return [item['content'] for item in self.generate_suggestion_items(features, user_id)]
+    
+    def _resolve_suggestion(self, suggestion):
+        """(suggestion id, state_key, category, user_id, context or None) a feedback payload refers to, or None"""
+        suggestion_id = suggestion.get('id')
+        if not suggestion_id and suggestion.get('content'):
+            # Older clients send the suggestion text instead of its id
+            suggestion_id = self.suggestion_history.find_content(suggestion['content'])
+        if not suggestion_id:
+            return None
+        entry = self.suggestion_history.get(suggestion_id)
+        if entry is not None:
+            return suggestion_id, entry['state_key'], entry['category'], entry['user_id'], entry['context']
+        # Generated by another worker or before a restart: the id itself names the state, category and context
+        parsed = self.suggestion_history.parse_id(suggestion_id)
+        if parsed is None or not 0 <= parsed[1] < len(self.suggestion_categories):
+            return None
+        state_key, category_index, user_id, context = parsed
+        if not STATE_KEY_PATTERN.fullmatch(state_key):
+            return None
+        if self.bandit is not None and context is not None and not self.bandit.valid_context(context):
+            logger.warning(f"Ignoring invalid bandit context in suggestion {suggestion_id}")
+            context = None
+        return suggestion_id, state_key, self.suggestion_categories[category_index], user_id, context
     
     def update_from_feedback(self, suggestion, feedback):
         """Update the RL model based on user feedback"""
         try:
-            # In client-side implementation, suggestion would be the actual suggestion object
-            # But here it might just be the ID, so we'll simplify
-            
             # Record the feedback
             feedback_record = {
                 'suggestion_id': suggestion.get('id', 'unknown'),
@@ -319,34 +465,47 @@ class RLModel:
             }
             self.feedback_history.append(feedback_record)
             
-            # Normally we'd look up the state and category from the suggestion
-            # but here we'll use a simplified approach
-            for recent_suggestion in reversed(self.suggestion_history[-10:]):  # Look at 10 most recent
-                if recent_suggestion.get('content') == suggestion.get('content', ''):
-                    state_key = recent_suggestion.get('state_key')
-                    category = recent_suggestion.get('category')
-                    
-                    if state_key and category:
-                        # Initialize Q-value if needed
-                        if state_key not in self.q_values:
-                            self.q_values[state_key] = {cat: 0.1 for cat in self.suggestion_categories}
-                        
-                        # Update Q-value based on feedback
-                        if feedback == 'helpful':
-                            reward = 1.0
-                        elif feedback == 'somewhat_helpful':
-                            reward = 0.5
-                        else:  # 'not_helpful'
-                            reward = -0.2
-                        
-                        # Simple update rule
-                        self.q_values[state_key][category] += self.learning_rate * reward
-                        
-                        logger.info(f"Updated Q-value for {state_key} {category} based on {feedback} feedback")
-                    break
+            resolved = self._resolve_suggestion(suggestion)
+            if resolved is None:
+                logger.info(f"Feedback for unknown suggestion {feedback_record['suggestion_id']} ignored")
+                return True
+            suggestion_id, state_key, category, user_id, context = resolved
+            
+            # Changing earlier feedback on the same suggestion replaces its reward instead of adding to it,
+            # and sending the same feedback again changes nothing, whichever worker handled it before
+            reward = FEEDBACK_REWARDS.get(feedback, FEEDBACK_REWARDS['not_helpful'])
+            self.suggestion_history.set_feedback(suggestion_id, feedback)
+            previous = self.feedback_ledger.apply(suggestion_id, reward)
+            if previous is not None:
+                reward -= previous
+                if reward == 0:
+                    logger.info(f"Repeated {feedback} feedback for {suggestion_id} ignored")
+                    return True
+            
+            # Initialize Q-value if needed
+            self._sync_policy()
+            if state_key not in self.q_values:
+                self.q_values[state_key] = self._new_q_row()
+            
+            # Simple update rule; a user's feedback goes to their own table and, scaled down, to the shared prior
+            global_delta = self.learning_rate * reward
+            if user_id is not None and self.user_policies is not None:
+                self.user_policies.update(user_id, state_key, category, self.learning_rate * reward)
+                global_delta *= self.prior_rate
+            self.q_values[state_key][category] += global_delta
+            if self.policy_store is not None:
+                self.policy_store.record(state_key, category, global_delta)
+            
+            # The bandit regresses on each suggestion's first rating, in the context it was chosen for
+            if self.bandit is not None and context is not None and previous is None:
+                self.bandit.update(self.suggestion_categories.index(category), context, reward)
+                self._bandit_updates += 1
+                if self._bandit_updates % self.bandit_save_every == 0:
+                    self._save_bandit()
             
+            logger.info(f"Updated Q-value for {state_key} {category} based on {feedback} feedback")
             return True
             
         except Exception as e:
             logger.error(f"Error updating from feedback: {str(e)}")
-            return False
\ No newline at end of file
+            return False
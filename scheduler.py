@@ -0,0 +1,127 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveInterval:
+    """Sampling interval that backs off while nothing changes and tightens on activity"""
+
+    def __init__(self, base, min_interval=None, max_interval=None, backoff=1.5, tighten=0.5):
+        self.base = float(base)
+        self.min_interval = float(min_interval if min_interval is not None else base)
+        self.max_interval = float(max_interval if max_interval is not None else base)
+        self.backoff_factor = backoff
+        self.tighten_factor = tighten
+        self.current = self.base
+
+    def stable(self):
+        """Nothing changed since the last sample: lengthen the interval"""
+        self.current = min(self.max_interval, self.current * self.backoff_factor)
+        return self.current
+
+    def changed(self):
+        """Something changed: shorten the interval, down to min_interval on rapid switching"""
+        self.current = max(self.min_interval, min(self.base, self.current * self.tighten_factor))
+        return self.current
+
+    def idle(self):
+        """User is idle: jump straight to the longest interval"""
+        self.current = self.max_interval
+        return self.current
+
+    def reset(self):
+        self.current = self.base
+        return self.current
+
+    def __call__(self):
+        return self.current
+
+
+class ScheduledTask:
+    """A callback run on its own cadence by the Scheduler"""
+
+    def __init__(self, name, callback, interval, next_run):
+        self.name = name
+        self.callback = callback
+        self.interval = interval  # seconds, or a callable returning seconds
+        self.next_run = next_run
+        self.run_count = 0
+
+    def get_interval(self):
+        interval = self.interval() if callable(self.interval) else self.interval
+        return max(0.01, float(interval))
+
+
+class Scheduler:
+    """Drift-free scheduler on monotonic time.
+
+    Each task's next deadline is computed from its previous deadline rather than
+    from when the callback finished, so samples stay evenly spaced regardless
+    of how long callbacks take. A task that falls more than one interval behind
+    is realigned instead of being run repeatedly to catch up.
+    """
+
+    def __init__(self, stop_event=None, clock=time.monotonic):
+        self.stop_event = stop_event or threading.Event()
+        self.clock = clock
+        self.tasks = {}
+
+    def add_task(self, name, callback, interval, run_immediately=True):
+        """Register a callback to run every `interval` seconds"""
+        now = self.clock()
+        task = ScheduledTask(name, callback, interval, now)
+        if not run_immediately:
+            task.next_run = now + task.get_interval()
+        self.tasks[name] = task
+        return task
+
+    def remove_task(self, name):
+        return self.tasks.pop(name, None)
+
+    def reschedule(self, name, delay=0):
+        """Pull a task's next run forward (never pushes it back)"""
+        task = self.tasks.get(name)
+        if task:
+            task.next_run = min(task.next_run, self.clock() + delay)
+
+    def time_until_next(self):
+        if not self.tasks:
+            return None
+        next_run = min(task.next_run for task in self.tasks.values())
+        return max(0.0, next_run - self.clock())
+
+    def run_pending(self):
+        """Run every task whose deadline has passed; returns the number of tasks run"""
+        now = self.clock()
+        ran = 0
+        for task in list(self.tasks.values()):
+            if task.next_run > now:
+                continue
+            try:
+                task.callback()
+            except Exception as e:
+                logger.error(f"Error in scheduled task {task.name}: {str(e)}")
+            task.run_count += 1
+            ran += 1
+
+            interval = task.get_interval()
+            task.next_run += interval
+            now = self.clock()
+            if task.next_run <= now:
+                # Fell behind (e.g. suspend/resume) - realign instead of bursting
+                task.next_run = now + interval
+        return ran
+
+    def run(self):
+        """Run tasks until stop_event is set"""
+        while not self.stop_event.is_set():
+            self.run_pending()
+            wait = self.time_until_next()
+            if wait is None:
+                wait = 1.0
+            self.stop_event.wait(wait)
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,252 @@
+import logging
+import threading
+import warnings
+from collections import OrderedDict, deque
+from datetime import timezone
+import numpy as np
+
+from feature_aggregates import activity_key, parse_duration, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+SESSION_FIELDS = ('start', 'end', 'duration', 'active_time', 'activity_count',
+                  'switches', 'switch_rate', 'focus_ratio', 'productivity_score')
+
+
+def to_epoch_seconds(timestamps, with_offsets=False):
+    """ISO strings or datetimes -> float64 unix seconds (naive values are taken as UTC)
+
+    With `with_offsets`, returns (seconds, UTC offsets in seconds); seconds + offsets
+    is the time on each timestamp's own wall clock.
+    """
+    try:
+        with warnings.catch_warnings():
+            # numpy only warns about timezone suffixes; treat that as "use the slow path"
+            warnings.simplefilter('error')
+            parsed = np.array(timestamps, dtype='datetime64[ms]')
+        # None and '' parse to NaT, whose int64 view is a huge negative number rather than NaN
+        epochs = parsed.astype(np.int64) / 1000.0
+        epochs[np.isnat(parsed)] = np.nan
+        return (epochs, np.zeros(len(epochs))) if with_offsets else epochs
+    except (ValueError, TypeError, Warning):
+        epochs = np.empty(len(timestamps), dtype=np.float64)
+        offsets = np.zeros(len(timestamps), dtype=np.float64)
+        for i, value in enumerate(timestamps):
+            parsed = parse_timestamp(value)
+            if parsed is None:
+                epochs[i] = np.nan
+                continue
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            else:
+                offsets[i] = parsed.utcoffset().total_seconds()
+            epochs[i] = parsed.timestamp()
+        return (epochs, offsets) if with_offsets else epochs
+
+
+def sessionize(timestamps, durations, app_codes, scores, gap=1800.0, focus_threshold=600.0):
+    """Split a time-sorted activity stream into sessions.
+
+    A new session starts when an activity begins more than `gap` seconds
+    after everything before it has ended. Inputs are equal-length arrays
+    sorted by timestamp; the result is a dict of per-session arrays keyed by
+    SESSION_FIELDS plus 'first_index' (the row each session starts at).
+
+    focus_ratio is the share of active time spent in uninterrupted same-app
+    stints of at least `focus_threshold` seconds; productivity_score is the
+    duration-weighted mean of the activity scores.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    durations = np.asarray(durations, dtype=np.float64)
+    app_codes = np.asarray(app_codes, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    count = len(timestamps)
+    if count == 0:
+        return {field: np.empty(0) for field in SESSION_FIELDS + ('first_index',)}
+
+    ends = timestamps + durations
+    covered_until = np.maximum.accumulate(ends)
+    is_start = np.empty(count, dtype=bool)
+    is_start[0] = True
+    is_start[1:] = timestamps[1:] - covered_until[:-1] > gap
+    first_index = np.flatnonzero(is_start)
+    session_of_row = np.cumsum(is_start) - 1
+    n_sessions = len(first_index)
+
+    start = timestamps[first_index]
+    end = np.maximum.reduceat(ends, first_index)
+    duration = end - start
+    active_time = np.add.reduceat(durations, first_index)
+    activity_count = np.diff(np.append(first_index, count))
+
+    # An app switch is a change of app between consecutive rows of the same session
+    changed = np.empty(count, dtype=bool)
+    changed[0] = True
+    changed[1:] = app_codes[1:] != app_codes[:-1]
+    switches = np.bincount(session_of_row[changed & ~is_start], minlength=n_sessions).astype(np.float64)
+    hours = np.maximum(duration, 1.0) / 3600.0
+    switch_rate = switches / hours
+
+    # Same-app stints (runs) never cross a session boundary
+    run_start = np.flatnonzero(changed | is_start)
+    run_time = np.add.reduceat(durations, run_start)
+    focused_time = np.bincount(session_of_row[run_start], weights=np.where(run_time >= focus_threshold, run_time, 0.0),
+                               minlength=n_sessions)
+    weighted_scores = np.add.reduceat(scores * durations, first_index)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        focus_ratio = np.where(active_time > 0, focused_time / active_time, 0.0)
+        productivity_score = np.where(active_time > 0, weighted_scores / active_time,
+                                      np.add.reduceat(scores, first_index) / activity_count)
+
+    return {
+        'start': start,
+        'end': end,
+        'duration': duration,
+        'active_time': active_time,
+        'activity_count': activity_count,
+        'switches': switches,
+        'switch_rate': switch_rate,
+        'focus_ratio': focus_ratio,
+        'productivity_score': productivity_score,
+        'first_index': first_index
+    }
+
+
+class SessionState:
+    """Incremental sessionization for one (user, device) stream.
+
+    Closed sessions are reduced to summaries; only the activities of the
+    still-open session are kept, so an update costs O(open session + new
+    activities) rather than a rescan of the history.
+    """
+
+    def __init__(self, gap=1800.0, focus_threshold=600.0, max_sessions=100):
+        self.gap = gap
+        self.focus_threshold = focus_threshold
+        self.closed = deque(maxlen=max_sessions)
+        self.closed_count = 0
+        self.closed_totals = {'duration': 0.0, 'switch_rate': 0.0, 'focus_ratio': 0.0, 'productivity_score': 0.0}
+        self.watermark = None
+        self._at_watermark = {}  # activity key -> times seen at the watermark
+        self._app_codes = {}
+        self._open = {
+            'timestamps': np.empty(0), 'durations': np.empty(0),
+            'apps': np.empty(0, dtype=np.int64), 'scores': np.empty(0)
+        }
+        self.current = None
+
+    def _code(self, app):
+        code = self._app_codes.get(app)
+        if code is None:
+            code = self._app_codes[app] = len(self._app_codes)
+        return code
+
+    def update(self, activities, score_of=None):
+        """Fold new activities in; returns the number added"""
+        if not activities:
+            return 0
+        timestamps = to_epoch_seconds([a.get('timestamp') for a in activities])
+        valid = ~np.isnan(timestamps)
+        if self.watermark is not None:
+            valid &= timestamps >= self.watermark
+            # Resent history: keep only copies beyond those already seen at the watermark
+            in_payload = {}
+            for i in np.flatnonzero(valid & (timestamps == self.watermark)):
+                key = activity_key(activities[i])
+                in_payload[key] = in_payload.get(key, 0) + 1
+                if in_payload[key] <= self._at_watermark.get(key, 0):
+                    valid[i] = False
+        rows = np.flatnonzero(valid)
+        if not len(rows):
+            return 0
+
+        new_timestamps = timestamps[rows]
+        order = np.argsort(new_timestamps, kind='stable')
+        rows = rows[order]
+        new_timestamps = new_timestamps[order]
+        picked = [activities[i] for i in rows]
+        durations = np.array([parse_duration(a.get('duration')) for a in picked], dtype=np.float64)
+        apps = np.array([self._code(a.get('application_name') or '') for a in picked], dtype=np.int64)
+        score_of = score_of or (lambda a: 0.5 if a.get('productivity_score') is None else a['productivity_score'])
+        scores = np.array([score_of(a) for a in picked], dtype=np.float64)
+
+        latest = new_timestamps[-1]
+        if self.watermark is None or latest > self.watermark:
+            self._at_watermark = {}
+        self.watermark = latest
+        for a, t in zip(picked, new_timestamps):
+            if t == latest:
+                key = activity_key(a)
+                self._at_watermark[key] = self._at_watermark.get(key, 0) + 1
+
+        stream = {
+            'timestamps': np.concatenate([self._open['timestamps'], new_timestamps]),
+            'durations': np.concatenate([self._open['durations'], durations]),
+            'apps': np.concatenate([self._open['apps'], apps]),
+            'scores': np.concatenate([self._open['scores'], scores])
+        }
+        sessions = sessionize(stream['timestamps'], stream['durations'], stream['apps'], stream['scores'],
+                              gap=self.gap, focus_threshold=self.focus_threshold)
+
+        # Every session but the last is final; the last may still grow
+        n_sessions = len(sessions['start'])
+        for i in range(n_sessions - 1):
+            self._close({field: float(sessions[field][i]) for field in SESSION_FIELDS})
+        open_from = int(sessions['first_index'][-1])
+        self._open = {key: values[open_from:] for key, values in stream.items()}
+        self.current = {field: float(sessions[field][-1]) for field in SESSION_FIELDS}
+        return len(rows)
+
+    def _close(self, summary):
+        self.closed.append(summary)
+        self.closed_count += 1
+        for field in self.closed_totals:
+            self.closed_totals[field] += summary[field]
+
+    def to_features(self):
+        """Session features for the RL state: the current session plus averages over all sessions"""
+        if self.current is None:
+            return {'session_features_available': False}
+        count = self.closed_count + 1
+        averages = {field: (total + self.current[field]) / count for field, total in self.closed_totals.items()}
+        return {
+            'session_features_available': True,
+            'session_count': count,
+            'session_duration': self.current['duration'],
+            'session_active_time': self.current['active_time'],
+            'session_switch_rate': self.current['switch_rate'],
+            'session_focus_ratio': self.current['focus_ratio'],
+            'session_productivity': self.current['productivity_score'],
+            'avg_session_duration': averages['duration'],
+            'avg_switch_rate': averages['switch_rate'],
+            'avg_focus_ratio': averages['focus_ratio'],
+            'avg_session_productivity': averages['productivity_score']
+        }
+
+
+class SessionStore:
+    """LRU-bounded map of (user_id, device_id) -> SessionState"""
+
+    def __init__(self, max_entries=10000, gap=1800.0, focus_threshold=600.0):
+        self.max_entries = max_entries
+        self.gap = gap
+        self.focus_threshold = focus_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self, user_id, device_id, activities, score_of=None):
+        """Fold activities into the (user, device) sessions and return the state"""
+        key = (user_id, device_id)
+        with self._lock:
+            state = self._entries.get(key)
+            if state is None:
+                state = self._entries[key] = SessionState(self.gap, self.focus_threshold)
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+            state.update(activities, score_of)
+            return state
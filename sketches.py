@@ -0,0 +1,146 @@
+import math
+import hashlib
+import logging
+from functools import lru_cache
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_MASK64 = (1 << 64) - 1
+
+
+@lru_cache(maxsize=65536)
+def hash_pair(key):
+    """Two independent 64-bit hashes of a string key (memoized: app names and n-grams repeat constantly)"""
+    digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+
+class CountMinSketch:
+    """Count-Min sketch: fixed-size frequency estimates that never undercount.
+
+    With width = ceil(e / epsilon) and depth = ceil(ln(1 / delta)), an
+    estimate exceeds the true count by more than epsilon * total with
+    probability at most delta. Sketches of the same shape merge by adding
+    their tables.
+    """
+
+    def __init__(self, width=272, depth=5):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.uint32)
+        self.total = 0
+        self._flat = self.table.reshape(-1)
+        self._offsets = [i * width for i in range(depth)]
+
+    @classmethod
+    def from_error(cls, epsilon=0.01, delta=0.01):
+        return cls(width=int(math.ceil(math.e / epsilon)), depth=int(math.ceil(math.log(1.0 / delta))))
+
+    def _cells(self, key):
+        # Double hashing: h1 + i * h2 gives `depth` pairwise independent columns
+        h1, h2 = hash_pair(key)
+        width = self.width
+        return [offset + ((h1 + i * h2) & _MASK64) % width for i, offset in enumerate(self._offsets)]
+
+    def add(self, key, count=1):
+        """Count `key` and return its new estimate"""
+        flat = self._flat
+        estimate = None
+        for cell in self._cells(key):
+            value = int(flat[cell]) + count
+            flat[cell] = value
+            if estimate is None or value < estimate:
+                estimate = value
+        self.total += count
+        return estimate
+
+    def estimate(self, key):
+        flat = self._flat
+        return min(int(flat[cell]) for cell in self._cells(key))
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Cannot merge Count-Min sketches of different shapes")
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+
+class HeavyHitters:
+    """Top-k keys by Count-Min estimate, tracking a bounded candidate set"""
+
+    def __init__(self, k=5, sketch=None, candidates=None):
+        self.k = k
+        self.sketch = sketch or CountMinSketch()
+        self.capacity = candidates or max(4 * k, 16)
+        self.candidates = {}  # key -> estimate, insertion order breaks ties
+
+    def add(self, key, count=1):
+        estimate = self.sketch.add(key, count)
+        self._offer(key, estimate)
+
+    def _offer(self, key, estimate):
+        if key in self.candidates or len(self.candidates) < self.capacity:
+            self.candidates[key] = estimate
+            return
+        smallest = min(self.candidates, key=self.candidates.get)
+        if estimate > self.candidates[smallest]:
+            del self.candidates[smallest]
+            self.candidates[key] = estimate
+
+    def top(self, k=None):
+        """[(key, estimate)] for the k most frequent keys, most frequent first"""
+        ranked = sorted(self.candidates.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:k or self.k]
+
+    def merge(self, other):
+        """Merge another tracker; costs O(sketch size + candidates), independent of history length"""
+        self.sketch.merge(other.sketch)
+        keys = list(self.candidates) + [key for key in other.candidates if key not in self.candidates]
+        self.candidates = {}
+        for key in keys:
+            self._offer(key, self.sketch.estimate(key))
+        return self
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter with 2**precision one-byte registers (~1.04/sqrt(m) error)"""
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+        self._bits = 64 - precision
+        self._alpha = 0.7213 / (1 + 1.079 / self.m)
+
+    def add(self, value):
+        h, _ = hash_pair(value)
+        index = h >> self._bits
+        remainder = h & ((1 << self._bits) - 1)
+        rank = self._bits - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        registers = self.registers.astype(np.float64)
+        estimate = self._alpha * self.m * self.m / np.sum(np.exp2(-registers))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.m and zeros:
+            # Small-range correction: linear counting
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        if self.precision != other.precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @property
+    def nbytes(self):
+        return self.registers.nbytes
@@ -0,0 +1,163 @@
+import os
+import hmac
+import time
+import base64
+import hashlib
+import logging
+import threading
+from itertools import count
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SuggestionHistory:
+    """Fixed-size ring buffer of generated suggestions with an id -> slot index.
+
+    Each slot holds (id, state_key, category, content, created, feedback, user_id, context).
+    Adding to a full buffer overwrites the oldest slot, and entries older than
+    `max_age` seconds are dropped as new ones arrive, so memory stays flat and
+    looking up an id for feedback attribution is O(1).
+
+    Ids end in an HMAC tag keyed on `secret`; parse_id() only decodes ids
+    whose tag checks out, so feedback cannot name a state, user or context
+    this service never issued. Processes sharing the secret accept each
+    other's ids; without one, a random per-process key is used.
+    """
+
+    def __init__(self, capacity=10000, max_age=7 * 86400, secret=None):
+        self.capacity = capacity
+        self.max_age = max_age
+        self._slots = [None] * capacity
+        self._index = {}  # suggestion id -> slot
+        self._lock = threading.Lock()
+        self._next = 0
+        self.count = 0
+        self._ids = count()
+        self._prefix = f"{os.getpid() & 0xffff:04x}{int.from_bytes(os.urandom(3), 'little'):06x}"
+        if secret is None:
+            secret = os.urandom(32)
+        self._secret = secret.encode('utf-8') if isinstance(secret, str) else bytes(secret)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, suggestion_id):
+        return self.get(suggestion_id) is not None
+
+    @staticmethod
+    def _b64(data):
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def _unb64(text):
+        return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+    def _tag(self, body):
+        return self._b64(hmac.new(self._secret, body.encode('ascii'), hashlib.sha256).digest()[:16])
+
+    def make_id(self, prefix, sequence, state_key, category_index, user_id=None, context=None):
+        """Unique signed id that also carries its user, state, category and bandit context, so any worker can attribute feedback.
+
+        The context (all but the trailing bias term) is stored as float16;
+        encoded feature vectors are small fractions and logs, well within
+        its range.
+        """
+        payload = state_key if user_id is None else f"{user_id}\x1f{state_key}"
+        body = f"{prefix}{sequence:x}.{category_index:x}.{self._b64(payload.encode('utf-8'))}"
+        if context is not None:
+            body += '.' + self._b64(np.asarray(context[:-1], dtype='<f2').tobytes())
+        return f"{body}.{self._tag(body)}"
+
+    def parse_id(self, suggestion_id):
+        """(state_key, category index, user_id or None, context or None) encoded in a signed suggestion id, or None"""
+        try:
+            body, _, tag = str(suggestion_id).rpartition('.')
+            if not body or not hmac.compare_digest(tag.encode('ascii'), self._tag(body).encode('ascii')):
+                return None
+            _, category_index, key, *packed = body.split('.', 3)
+            user_id, _, state_key = self._unb64(key).decode('utf-8').rpartition('\x1f')
+            context = None
+            if packed:
+                context = np.append(np.frombuffer(self._unb64(packed[0]), dtype='<f2').astype(np.float64), 1.0)
+            return state_key, int(category_index, 16), user_id or None, context
+        except (ValueError, UnicodeError):
+            return None
+
+    def _evict_slot(self, slot):
+        entry = self._slots[slot]
+        if entry is not None:
+            self._index.pop(entry[0], None)
+            self._slots[slot] = None
+            self.count -= 1
+
+    def _expire(self, now):
+        # Oldest entry sits at _next - count
+        while self.count:
+            oldest = (self._next - self.count) % self.capacity
+            if now - self._slots[oldest][4] <= self.max_age:
+                break
+            self._evict_slot(oldest)
+
+    def add(self, state_key, category, content, category_index=0, user_id=None, context=None, now=None):
+        """Record a generated suggestion (and optionally the context vector it was chosen for); returns its id"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire(now)
+            suggestion_id = self.make_id(self._prefix, next(self._ids), state_key, category_index, user_id, context)
+            slot = self._next
+            self._evict_slot(slot)
+            self._slots[slot] = [suggestion_id, state_key, category, content, now, None, user_id, context]
+            self._index[suggestion_id] = slot
+            self._next = (slot + 1) % self.capacity
+            self.count += 1
+        return suggestion_id
+
+    def get(self, suggestion_id):
+        """{'id', 'state_key', 'category', 'content', 'timestamp', 'feedback', 'user_id', 'context'} or None if unknown or evicted"""
+        with self._lock:
+            slot = self._index.get(suggestion_id)
+            if slot is None:
+                return None
+            entry = self._slots[slot]
+            if time.time() - entry[4] > self.max_age:
+                return None
+            return self._as_dict(entry)
+
+    def set_feedback(self, suggestion_id, feedback):
+        """Store feedback on an entry and return the feedback it replaces"""
+        with self._lock:
+            slot = self._index.get(suggestion_id)
+            if slot is None:
+                return None
+            previous = self._slots[slot][5]
+            self._slots[slot][5] = feedback
+            return previous
+
+    def find_content(self, content, limit=10):
+        """Id of the newest of the last `limit` entries with this content"""
+        with self._lock:
+            for back in range(1, min(limit, self.count) + 1):
+                entry = self._slots[(self._next - back) % self.capacity]
+                if entry[3] == content:
+                    return entry[0]
+        return None
+
+    def recent(self, limit=None):
+        """Entries newest first"""
+        with self._lock:
+            total = self.count if not limit else min(limit, self.count)
+            return [self._as_dict(self._slots[(self._next - back) % self.capacity]) for back in range(1, total + 1)]
+
+    @staticmethod
+    def _as_dict(entry):
+        return {
+            'id': entry[0],
+            'state_key': entry[1],
+            'category': entry[2],
+            'content': entry[3],
+            'timestamp': entry[4],
+            'feedback': entry[5],
+            'user_id': entry[6],
+            'context': entry[7]
+        }
@@ -0,0 +1,150 @@
+import re
+import json
+import random
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+
+def _period(hour):
+    if 5 <= hour < 12:
+        return 'morning'
+    if 12 <= hour < 17:
+        return 'afternoon'
+    if 17 <= hour < 22:
+        return 'evening'
+    return 'late night'
+
+
+def _duration(features):
+    # A reasonable duration based on app usage, between 10 and 120 minutes
+    return str(max(10, min(int(features.get('activity_density', 5) * 10), 120)))
+
+
+# placeholder -> value from the RL state features
+RESOLVERS = {
+    'app': lambda f: str(f.get('top_app_1', 'your frequently used application')),
+    'app1': lambda f: str(f.get('top_app_1', 'your first application')),
+    'app2': lambda f: str(f.get('top_app_2', 'your second application')),
+    'app3': lambda f: str(f.get('top_app_3', 'your third application')),
+    'duration': _duration,
+    'time_of_day': lambda f: _period(f.get('time_of_day', datetime.now().hour)),
+    'start_time': lambda f: f"{max(8, min(f.get('time_of_day', 9) - 1, 11))}:00",
+    'end_time': lambda f: f"{max(16, min(f.get('time_of_day', 17) + 1, 20))}:00"
+}
+
+
+class CompiledTemplate:
+    """A template parsed once into literal text and placeholder slots.
+
+    `parts` alternates literal strings and placeholder names (odd indexes);
+    placeholders without a resolver stay in the text as written. Each
+    distinct placeholder is resolved once per render even if repeated.
+    """
+
+    __slots__ = ('template_id', 'text', 'parts', 'placeholders', '_slots')
+
+    def __init__(self, template_id, text):
+        self.template_id = template_id
+        self.text = text
+        self.parts = ['']
+        for i, piece in enumerate(PLACEHOLDER.split(text)):
+            if i % 2 == 0:
+                self.parts[-1] += piece
+            elif piece in RESOLVERS:
+                self.parts.extend([piece, ''])
+            else:
+                self.parts[-1] += '{' + piece + '}'
+        self.placeholders = tuple(dict.fromkeys(self.parts[1::2]))
+        self._slots = tuple(self.placeholders.index(name) for name in self.parts[1::2])
+
+    def values(self, features):
+        """The placeholder values this template needs, in placeholder order"""
+        return tuple(RESOLVERS[name](features) for name in self.placeholders)
+
+    def render(self, values):
+        if not self.placeholders:
+            return self.text
+        parts = list(self.parts)
+        parts[1::2] = [values[slot] for slot in self._slots]
+        return ''.join(parts)
+
+
+class TemplateCorpus:
+    """Suggestion templates by category, compiled once, with a bounded render cache.
+
+    Requests sample templates and render only those, so the cost per
+    suggestion does not depend on how many templates a category holds.
+    Rendered strings are cached by (template, placeholder values).
+    """
+
+    def __init__(self, templates=None, cache_size=4096):
+        self.cache_size = cache_size
+        self.categories = OrderedDict()  # category -> [CompiledTemplate]
+        self._compiled = {}  # template text -> CompiledTemplate
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        if templates:
+            self.update(templates)
+
+    def __len__(self):
+        return sum(len(templates) for templates in self.categories.values())
+
+    def compile(self, text):
+        with self._lock:
+            compiled = self._compiled.get(text)
+            if compiled is None:
+                compiled = self._compiled[text] = CompiledTemplate(len(self._compiled), text)
+            return compiled
+
+    def update(self, templates):
+        """Add {category: [template text]} to the corpus"""
+        for category, texts in templates.items():
+            compiled = self.categories.setdefault(category, [])
+            compiled.extend(self.compile(text) for text in texts)
+
+    @classmethod
+    def load(cls, path, cache_size=4096):
+        """Read a corpus file: JSON {category: [templates]}, or .jsonl lines of {"category", "template"}"""
+        with open(path, encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                templates = {}
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        templates.setdefault(record['category'], []).append(record['template'])
+            else:
+                templates = json.load(f)
+        corpus = cls(templates, cache_size=cache_size)
+        logger.info(f"Loaded {len(corpus)} suggestion templates in {len(corpus.categories)} categories from {path}")
+        return corpus
+
+    def render(self, template, features):
+        values = template.values(features)
+        key = (template.template_id, values)
+        with self._lock:
+            rendered = self._cache.get(key)
+            if rendered is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return rendered
+        rendered = template.render(values)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = rendered
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return rendered
+
+    def sample(self, category, features, count=1):
+        """Render `count` distinct randomly chosen templates of a category"""
+        templates = self.categories.get(category) or []
+        picked = random.sample(templates, min(count, len(templates)))
+        return [self.render(template, features) for template in picked]
@@ -0,0 +1,195 @@
+import time
+import logging
+import threading
+from array import array
+from datetime import datetime
+import psutil
+
+from scheduler import Scheduler
+
+logger = logging.getLogger(__name__)
+
+# Numeric fields kept in the ring buffer, in column order
+HEALTH_FIELDS = (
+    'timestamp',
+    'cpu_usage',
+    'memory_usage',
+    'disk_usage',
+    'network_in',
+    'network_out',
+    'disk_read',
+    'disk_write',
+    'battery_level',
+    'processes_count'
+)
+
+
+class HealthHistory:
+    """Fixed-size ring buffer of health samples stored as one array('d') per field.
+
+    Readers get zero-copy memoryviews over the columns (usable directly with
+    np.frombuffer). Missing values are stored as NaN.
+    """
+
+    def __init__(self, capacity=720, fields=HEALTH_FIELDS):
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self._columns = {name: array('d', [float('nan')]) * capacity for name in self.fields}
+        self._lock = threading.Lock()
+        self._next = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, sample):
+        """Write one sample (dict of field -> number) into the next slot"""
+        with self._lock:
+            index = self._next
+            for name in self.fields:
+                value = sample.get(name)
+                self._columns[name][index] = float('nan') if value is None else float(value)
+            self._next = (index + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def column(self, name):
+        """Return the raw ring column as a memoryview (slot order, not time order)"""
+        return memoryview(self._columns[name])
+
+    def ordered(self, name):
+        """Return (older, newer) memoryviews that together form the column in time order"""
+        with self._lock:
+            view = memoryview(self._columns[name])
+            if self.count < self.capacity:
+                return view[:self.count], view[0:0]
+            return view[self._next:], view[:self._next]
+
+    def as_numpy(self, name):
+        """Return the column in time order as a numpy array (copies only when wrapped)"""
+        import numpy as np
+
+        older, newer = self.ordered(name)
+        if not len(newer):
+            return np.frombuffer(older, dtype=np.float64)
+        return np.concatenate((np.frombuffer(older, dtype=np.float64),
+                               np.frombuffer(newer, dtype=np.float64)))
+
+    def latest(self):
+        """Return the most recent sample as a dict, or None if empty"""
+        with self._lock:
+            if not self.count:
+                return None
+            index = (self._next - 1) % self.capacity
+            return {name: self._columns[name][index] for name in self.fields}
+
+    def to_dict(self, limit=None):
+        """Return recent samples as plain lists in time order (for JSON responses)"""
+        result = {}
+        for name in self.fields:
+            older, newer = self.ordered(name)
+            values = older.tolist() + newer.tolist()
+            if limit:
+                values = values[-limit:]
+            result[name] = [None if v != v else v for v in values]
+        return result
+
+
+class HealthSampler:
+    """Non-blocking system health sampler.
+
+    CPU usage comes from psutil's delta since the previous call (interval=None),
+    network and disk I/O are reported as per-second rates, and every sample is
+    appended to a HealthHistory ring buffer. start() runs it on a background
+    thread so sampling never blocks the tracking loop.
+    """
+
+    def __init__(self, device_id=None, capacity=720, disk_path='/'):
+        self.device_id = device_id
+        self.disk_path = disk_path
+        self.history = HealthHistory(capacity)
+        self.stop_event = threading.Event()
+        self._thread = None
+        self._last_counters = None
+        self.listeners = []  # callables receiving each new sample dict
+        # Prime the CPU counters so the first real sample has a baseline
+        psutil.cpu_percent(interval=None)
+
+    def _read_counters(self):
+        net = psutil.net_io_counters()
+        try:
+            disk = psutil.disk_io_counters()
+        except Exception:
+            disk = None
+        return (
+            time.monotonic(),
+            net.bytes_recv if net else 0,
+            net.bytes_sent if net else 0,
+            disk.read_bytes if disk else 0,
+            disk.write_bytes if disk else 0
+        )
+
+    def _rates(self, counters):
+        previous = self._last_counters
+        self._last_counters = counters
+        if previous is None:
+            return 0.0, 0.0, 0.0, 0.0
+        elapsed = counters[0] - previous[0]
+        if elapsed <= 0:
+            return 0.0, 0.0, 0.0, 0.0
+        # Counters can reset (e.g. interface restart); clamp negative deltas to zero
+        return tuple(max(0, counters[i] - previous[i]) / elapsed for i in range(1, 5))
+
+    def sample(self):
+        """Collect one sample without blocking and append it to the history"""
+        try:
+            network_in, network_out, disk_read, disk_write = self._rates(self._read_counters())
+
+            battery_level = None
+            try:
+                battery = psutil.sensors_battery()
+                if battery:
+                    battery_level = battery.percent
+            except (AttributeError, NotImplementedError):
+                pass
+
+            now = time.time()
+            health_data = {
+                'device_id': self.device_id,
+                'cpu_usage': psutil.cpu_percent(interval=None),
+                'memory_usage': psutil.virtual_memory().percent,
+                'disk_usage': psutil.disk_usage(self.disk_path).percent,
+                'network_in': network_in,  # bytes/s
+                'network_out': network_out,  # bytes/s
+                'disk_read': disk_read,  # bytes/s
+                'disk_write': disk_write,  # bytes/s
+                'battery_level': battery_level,
+                'processes_count': len(psutil.pids()),
+                'timestamp': datetime.utcfromtimestamp(now).isoformat()
+            }
+
+            self.history.append({**health_data, 'timestamp': now})
+            for listener in self.listeners:
+                listener(health_data)
+            logger.debug(f"System health: CPU {health_data['cpu_usage']}%, "
+                         f"Memory {health_data['memory_usage']}%, Disk {health_data['disk_usage']}%")
+            return health_data
+
+        except Exception as e:
+            logger.error(f"Error monitoring system health: {str(e)}")
+            return None
+
+    def start(self, interval=60):
+        """Sample every `interval` seconds on a background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self.stop_event.clear()
+        scheduler = Scheduler(stop_event=self.stop_event)
+        scheduler.add_task('health', self.sample, interval)
+        self._thread = threading.Thread(target=scheduler.run, name='health-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        self._thread = None
@@ -0,0 +1,81 @@
+"""AppClassifier table loading. Run from the repository root:
+
+    python -m unittest discover -s tests
+"""
+import logging
+import unittest
+from types import SimpleNamespace
+
+from app_classifier import AppClassifier
+from data_processor import DataProcessor
+
+
+class TableClassifier(AppClassifier):
+    """Serves rows from lists instead of the database"""
+
+    def __init__(self, categories, applications, **kwargs):
+        super().__init__(DataProcessor.productivity_categories, **kwargs)
+        self.categories = categories
+        self.applications = applications
+        self.queries = 0
+
+    def _query_tables(self):
+        self.queries += 1
+        return self.categories, self.applications
+
+
+def category(id, name, score):
+    return SimpleNamespace(id=id, name=name, productivity_score=score)
+
+
+def application(name, category_id=None, score=None, processes=None):
+    return SimpleNamespace(name=name, category_id=category_id, productivity_score=score, common_processes=processes)
+
+
+class AppClassifierTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+
+    def test_bound_classifier_loads_tables_on_first_lookup(self):
+        classifier = TableClassifier([category(1, 'design', 0.8)],
+                                     [application('Neovim', processes=['nvim', 'vim'], score=0.9)])
+        self.assertIsNone(classifier.classify('nvim'))
+        classifier.bind()
+        self.assertEqual(classifier.classify('nvim'), 'high')
+        self.assertEqual(classifier.classify('neovim.exe'), 'high')
+        # Category names become keywords
+        self.assertEqual(classifier.classify('design-studio'), 'high')
+        self.assertEqual(classifier.queries, 1)
+
+    def test_alias_overrides_keyword(self):
+        # 'slack' is a medium keyword by default; an application row makes it low
+        classifier = TableClassifier([category(1, 'chat', 0.2)], [application('Slack', category_id=1)])
+        self.assertEqual(classifier.classify('slack'), 'medium')
+        classifier.bind()
+        self.assertEqual(classifier.classify('slack'), 'low')
+
+    def test_invalidate_reloads_changed_tables(self):
+        classifier = TableClassifier([], [])
+        classifier.bind()
+        self.assertIsNone(classifier.classify('figma'))
+        classifier.applications = [application('Figma', score=0.5)]
+        classifier.invalidate()
+        self.assertEqual(classifier.classify('figma'), 'medium')
+        self.assertEqual(classifier.queries, 2)
+
+    def test_unavailable_tables_keep_defaults(self):
+        classifier = TableClassifier([], [])
+        classifier._query_tables = lambda: (_ for _ in ()).throw(ImportError('no database'))
+        classifier.bind()
+        self.assertEqual(classifier.classify('code'), 'high')
+        self.assertEqual(classifier.classify('slack'), 'medium')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""LinearBandit updates and merging of saved statistics between workers. Run from the repository root:
+
+    python -m unittest discover -s tests
+"""
+import logging
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from bandits import LinearBandit
+
+ARMS = ['focus', 'breaks', 'organization']
+DIM = 4
+
+
+def observations(seed, n):
+    rng = np.random.default_rng(seed)
+    return [(int(rng.integers(len(ARMS))), rng.normal(size=DIM), float(rng.normal())) for _ in range(n)]
+
+
+class LinearBanditTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'bandit.npz')
+
+    def trained(self, data):
+        bandit = LinearBandit(ARMS, DIM)
+        for arm, context, reward in data:
+            bandit.update(arm, context, reward)
+        return bandit
+
+    def test_round_trip(self):
+        bandit = self.trained(observations(1, 50))
+        bandit.save(self.path, expect={'schema': 'v1'})
+        restored = LinearBandit(ARMS, DIM)
+        self.assertTrue(restored.load(self.path, expect={'schema': 'v1'}))
+        np.testing.assert_allclose(restored.theta, bandit.theta, atol=1e-9)
+        np.testing.assert_array_equal(restored.counts, bandit.counts)
+        np.testing.assert_allclose(restored.scores(np.ones(DIM)), bandit.scores(np.ones(DIM)), atol=1e-9)
+
+    def test_mismatched_state_is_ignored(self):
+        self.trained(observations(1, 10)).save(self.path, expect={'schema': 'v1'})
+        self.assertFalse(LinearBandit(ARMS, DIM).load(self.path, expect={'schema': 'v2'}))
+        self.assertFalse(LinearBandit(ARMS, DIM + 1).load(self.path))
+        self.assertFalse(LinearBandit(ARMS[:2], DIM).load(self.path))
+
+    def test_saves_from_workers_merge(self):
+        first_data, second_data = observations(1, 40), observations(2, 60)
+        first, second = self.trained(first_data[:20]), self.trained(second_data[:30])
+        first.save(self.path)
+        second.save(self.path)
+        for arm, context, reward in first_data[20:]:
+            first.update(arm, context, reward)
+        for arm, context, reward in second_data[30:]:
+            second.update(arm, context, reward)
+        first.save(self.path)
+        second.save(self.path)
+
+        expected = self.trained(first_data + second_data)
+        merged = LinearBandit(ARMS, DIM)
+        merged.load(self.path)
+        for bandit in (merged, second):
+            np.testing.assert_allclose(bandit.theta, expected.theta, atol=1e-9)
+            np.testing.assert_array_equal(bandit.counts, expected.counts)
+        # first catches up with second's last save on its next one, without counting its own updates twice
+        first.save(self.path)
+        np.testing.assert_allclose(first.theta, expected.theta, atol=1e-9)
+        np.testing.assert_array_equal(first.counts, expected.counts)
+
+    def test_invalid_updates_are_rejected(self):
+        bandit = LinearBandit(ARMS, DIM)
+        for context, reward in ((np.full(DIM, np.inf), 1.0), (np.full(DIM, 1e6), 1.0),
+                                (np.ones(DIM + 1), 1.0), (np.ones(DIM), np.nan)):
+            with self.subTest(context=context, reward=reward), self.assertRaises(ValueError):
+                bandit.update(0, context, reward)
+        self.assertEqual(bandit.counts.sum(), 0)
+        self.assertTrue(np.all(np.isfinite(bandit.theta)))
+
+
+if __name__ == '__main__':
+    unittest.main()
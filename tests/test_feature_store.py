@@ -0,0 +1,124 @@
+"""FeatureStore persistence, sharing between processes and crash recovery. Run from the repository root:
+
+    python -m unittest discover -s tests
+"""
+import json
+import logging
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from feature_store import FeatureStore
+
+
+class FeatureStoreTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def open(self, **kwargs):
+        store = FeatureStore(self.directory, initial_capacity=4, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def vector(self, store, value):
+        return np.full(store.schema.size, value, dtype=np.float32)
+
+    def test_round_trip(self):
+        store = self.open()
+        for i in range(10):
+            store.append(f"user{i % 3}", self.vector(store, i), timestamp=1000.0 + i)
+        store.close()
+
+        store = self.open()
+        self.assertEqual(store.rows, 10)
+        self.assertEqual(store.users, ['user0', 'user1', 'user2'])
+        np.testing.assert_array_equal(store.latest('user0'), self.vector(store, 9))
+        self.assertEqual(store.find('user1', 1004.0), 4)
+        np.testing.assert_array_equal(store.rows_for('user2'), [2, 5, 8])
+        np.testing.assert_array_equal(store.timestamps(), 1000.0 + np.arange(10))
+
+    def test_meta_stays_a_fixed_header(self):
+        store = self.open()
+        store.append('first', self.vector(store, 1))
+        size = os.path.getsize(os.path.join(self.directory, FeatureStore.META_FILE))
+        store.append_batch([f"user{i}" for i in range(50)], [self.vector(store, i) for i in range(50)])
+        with open(os.path.join(self.directory, FeatureStore.META_FILE)) as f:
+            meta = json.load(f)
+        self.assertNotIn('users', meta)
+        self.assertLess(abs(os.path.getsize(os.path.join(self.directory, FeatureStore.META_FILE)) - size), 8)
+
+    def test_appends_from_two_processes_interleave(self):
+        first, second = self.open(), self.open()
+        first.append('a', self.vector(first, 1), timestamp=1.0)
+        second.append('b', self.vector(second, 2), timestamp=2.0)
+        first.append('b', self.vector(first, 3), timestamp=3.0)
+        for store in (first, second):
+            self.assertEqual(store.find('a', 1.0), 0)
+            np.testing.assert_array_equal(store.rows_for('b'), [1, 2])
+            np.testing.assert_array_equal(store.latest('b'), self.vector(store, 3))
+
+    def test_interrupted_append_is_ignored(self):
+        store = self.open()
+        store.append('kept', self.vector(store, 1))
+        store.close()
+        # A crash after writing a new user but before publishing the row count
+        with open(os.path.join(self.directory, FeatureStore.USERS_FILE), 'ab') as f:
+            f.write(b'"lost"\n"half')
+
+        store = self.open()
+        self.assertEqual(store.users, ['kept'])
+        store.append('next', self.vector(store, 2))
+        store.close()
+        store = self.open()
+        self.assertEqual(store.users, ['kept', 'next'])
+        np.testing.assert_array_equal(store.latest('next'), self.vector(store, 2))
+
+    def test_compact(self):
+        store = self.open()
+        for i in range(12):
+            store.append('busy' if i % 4 else f"once{i}", self.vector(store, i), timestamp=float(i))
+        self.assertEqual(store.compact(keep_per_user=2, older_than=4.0), 8)
+        self.assertEqual(store.rows, 4)
+        store.close()
+
+        store = self.open()
+        self.assertEqual(store.generation, 1)
+        self.assertEqual(sorted(store.users), ['busy', 'once4', 'once8'])
+        np.testing.assert_array_equal(store.timestamps()[store.rows_for('busy')], [10.0, 11.0])
+        np.testing.assert_array_equal(store.latest('busy'), self.vector(store, 11))
+
+    def test_legacy_users_in_meta_are_migrated(self):
+        store = self.open()
+        store.append('legacy', self.vector(store, 1))
+        store.close()
+        meta_path = os.path.join(self.directory, FeatureStore.META_FILE)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        meta['users'] = ['legacy']
+        del meta['users_bytes']
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+        os.remove(os.path.join(self.directory, FeatureStore.USERS_FILE))
+
+        store = self.open()
+        self.assertEqual(store.users, ['legacy'])
+        with open(meta_path) as f:
+            self.assertNotIn('users', json.load(f))
+        np.testing.assert_array_equal(store.latest('legacy'), self.vector(store, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+"""Parity of the feature engines: pandas, pure-Python fast path and grouped NumPy batch encoding.
+
+Run from the repository root:
+
+    python -m unittest discover -s tests
+"""
+import logging
+import unittest
+from datetime import datetime
+from itertools import islice
+
+import numpy as np
+
+from batch_features import columns_from_users, encode_activity_columns
+from data_processor import DataProcessor
+from workload import WorkloadGenerator
+
+AS_OF = datetime(2026, 3, 4, 15, 30)
+
+
+def same(a, b, tolerance=1e-9):
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[k], b[k], tolerance) for k in a)
+    if isinstance(a, (int, float, np.number)) and isinstance(b, (int, float, np.number)):
+        return abs(a - b) <= tolerance * max(1.0, abs(a), abs(b))
+    return a == b
+
+
+def activity(app, duration, timestamp):
+    return {'application_name': app, 'duration': duration, 'timestamp': timestamp}
+
+
+EDGE_CASES = {
+    'missing timestamps': [
+        activity('code', 5, '2026-03-04T09:00:00'),
+        activity('slack', 5, None),
+        activity('code', 5, '2026-03-04T09:05:00'),
+        activity('chrome', 5, ''),
+        activity('slack', 5, '2026-03-04T09:10:00'),
+    ],
+    'unparseable timestamp': [
+        activity('code', 5, '2026-03-04T09:00:00'),
+        activity('chrome', 5, 'yesterday'),
+        activity('code', 5, '2026-03-04T09:01:00'),
+    ],
+    'first timestamp missing': [
+        activity('slack', 7, None),
+        activity('code', 5, '2026-03-04T09:00:00'),
+        activity('chrome', 5, '2026-03-04T10:00:00'),
+    ],
+    'no timestamps': [
+        activity('code', 5, None),
+        activity('chrome', 3, None),
+    ],
+    'missing apps': [
+        activity('code', 5, '2026-03-04T09:00:00'),
+        activity(None, 30, '2026-03-04T09:01:00'),
+        activity('chrome', 5, '2026-03-04T09:02:00'),
+        activity('', 4, '2026-03-04T09:03:00'),
+        activity('code', 5, '2026-03-04T09:04:00'),
+    ],
+    'no apps': [
+        activity(None, 5, '2026-03-04T09:00:00'),
+        activity(None, 5, '2026-03-04T09:01:00'),
+    ],
+    'string durations': [
+        activity('code', '5', '2026-03-04T09:00:00'),
+        activity('chrome', 'abc', '2026-03-04T09:01:00'),
+        activity('code', None, '2026-03-04T09:02:00'),
+        activity('slack', 2.5, '2026-03-04T09:03:00'),
+    ],
+    'utc offset': [
+        activity('code', 5, '2026-03-04T23:50:00+05:30'),
+        activity('slack', 5, '2026-03-05T00:10:00+05:30'),
+        activity('chrome', 5, '2026-03-05T04:45:00+05:30'),
+    ],
+    'single activity': [
+        activity('code', 60, '2026-03-04T22:00:00'),
+    ],
+}
+
+
+class FeatureParityTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+        cls.fast = DataProcessor(incremental=False)
+        cls.pandas = DataProcessor(incremental=False, fast_path_max_activities=0)
+        cls.incremental = DataProcessor(incremental=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+
+    def assertSameFeatures(self, activities):
+        expected = self.pandas.process_activities(activities, as_of=AS_OF)
+        actual = self.fast.process_activities(activities, as_of=AS_OF)
+        differing = sorted(k for k in set(expected) | set(actual) if not same(expected.get(k), actual.get(k)))
+        self.assertEqual(differing, [], f"pandas {[expected.get(k) for k in differing]} "
+                                        f"fast {[actual.get(k) for k in differing]}")
+        return expected
+
+    def assertSameIncremental(self, activities, user_id):
+        expected = self.pandas.process_activities(activities, user_id=user_id, as_of=AS_OF)
+        actual = self.incremental.process_activities(activities, user_id=user_id, as_of=AS_OF)
+        differing = sorted(k for k in set(expected) | set(actual) if not same(expected.get(k), actual.get(k)))
+        self.assertEqual(differing, [], f"pandas {[expected.get(k) for k in differing]} "
+                                        f"incremental {[actual.get(k) for k in differing]}")
+
+    def assertSameEncoding(self, activities, processor=None):
+        processor = processor or self.pandas
+        expected = processor.encode_features(processor.process_activities(activities, as_of=AS_OF))
+        matrix, user_ids = encode_activity_columns(columns_from_users({'u': activities}), self.pandas.encoder,
+                                                   self.pandas._classify_app, now=AS_OF)
+        self.assertEqual(user_ids, ['u'])
+        np.testing.assert_allclose(matrix[0], expected, rtol=1e-5, atol=1e-6)
+
+    def test_edge_cases(self):
+        for name, activities in EDGE_CASES.items():
+            with self.subTest(name):
+                self.assertSameFeatures(activities)
+
+    def test_edge_cases_batch(self):
+        for name, activities in EDGE_CASES.items():
+            with self.subTest(name):
+                self.assertSameEncoding(activities)
+
+    def test_edge_cases_incremental(self):
+        for name, activities in EDGE_CASES.items():
+            with self.subTest(name):
+                # Clients resend their whole history: the second fold must not count anything twice
+                self.assertSameIncremental(activities, user_id=f"edge {name}")
+                self.assertSameIncremental(activities, user_id=f"edge {name}")
+
+    def test_incremental_untimed_activities_in_growing_history(self):
+        activities = EDGE_CASES['missing timestamps'] + [
+            activity('chrome', 5, None),
+            activity('slack', 5, None),
+            activity('code', 5, '2026-03-04T09:20:00'),
+        ]
+        for size in range(1, len(activities) + 1):
+            with self.subTest(size=size):
+                self.assertSameIncremental(activities[:size], user_id='growing')
+
+    def test_untimestamped_activities_count_towards_app_usage(self):
+        features = self.assertSameFeatures(EDGE_CASES['missing timestamps'])
+        self.assertEqual(features['total_tracked_time'], 25)
+        self.assertEqual(sum(features['activity_hours'].values()), 3)
+        self.assertEqual(features['common_transitions'], {'code -> code': 1, 'code -> slack': 1})
+
+    def test_missing_apps_are_not_apps(self):
+        features = self.assertSameFeatures(EDGE_CASES['missing apps'])
+        self.assertNotIn(None, features['app_usage'])
+        self.assertIn('', features['app_usage'])
+        self.assertEqual(features['total_tracked_time'], 19)
+        self.assertEqual(sum(features['activity_hours'].values()), 5)
+
+    def test_string_durations(self):
+        features = self.assertSameFeatures(EDGE_CASES['string durations'])
+        self.assertEqual(features['total_tracked_time'], 7.5)
+        # Sessions coerce durations the same way
+        features = self.incremental.process_activities(EDGE_CASES['string durations'], user_id='durations', as_of=AS_OF)
+        self.assertTrue(features['session_features_available'])
+        self.assertEqual(features['session_active_time'], 7.5)
+
+    def test_mixed_utc_offsets(self):
+        # pandas rejects mixed offsets, so only the fast and batch paths are compared; both bucket on wall clock time
+        activities = [
+            activity('code', 5, '2026-03-04T23:50:00+05:30'),
+            activity('slack', 5, '2026-03-04T18:45:00Z'),
+            activity('chrome', 5, '2026-03-04T13:00:00-08:00'),
+        ]
+        features = self.fast.process_activities(activities, as_of=AS_OF)
+        self.assertEqual(features['activity_hours'], {13: 1, 18: 1, 23: 1})
+        self.assertSameEncoding(activities, processor=self.fast)
+
+    def test_generated_workload(self):
+        generator = WorkloadGenerator(seed=7)
+        for user_index in range(2):
+            activities = list(islice(generator.iter_activities(user_index, 600), 600))
+            for size in (1, 2, 3, 50, 600):
+                with self.subTest(user=user_index, size=size):
+                    self.assertSameFeatures(activities[:size])
+                    self.assertSameEncoding(activities[:size])
+                    self.assertSameIncremental(activities[:size], user_id=f"workload {user_index}")
+
+
+if __name__ == '__main__':
+    unittest.main()
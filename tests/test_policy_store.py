@@ -0,0 +1,181 @@
+"""Q-table journal, feedback ledger and per-user policy tables. Run from the repository root:
+
+    python -m unittest discover -s tests
+"""
+import logging
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from policy_store import DEFAULT_Q, FeedbackLedger, QTableStore
+from policy_tables import PolicyTables
+
+CATEGORIES = ['focus', 'breaks', 'organization']
+
+
+class PolicyStoreTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+
+class QTableStoreTest(PolicyStoreTestCase):
+
+    def open(self, categories=CATEGORIES, **kwargs):
+        store = QTableStore(os.path.join(self.directory, 'q.bin'), categories, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def test_round_trip(self):
+        store = self.open()
+        self.assertEqual(store.load(), {})
+        store.record('morning', 'focus', 0.5)
+        store.record('morning', 'focus', 0.25)
+        store.record('night', 'breaks', -0.1)
+        store.record('night', 'unknown category', 1.0)
+        self.assertTrue(store.flush())
+
+        table = self.open().load()
+        self.assertAlmostEqual(table['morning']['focus'], DEFAULT_Q + 0.75, places=6)
+        self.assertAlmostEqual(table['morning']['breaks'], DEFAULT_Q, places=6)
+        self.assertAlmostEqual(table['night']['breaks'], DEFAULT_Q - 0.1, places=6)
+
+    def test_writers_pick_up_each_others_deltas(self):
+        first, second = self.open(), self.open()
+        first.load(), second.load()
+        first.record('morning', 'focus', 0.5)
+        first.flush()
+        second.record('morning', 'focus', 0.25)
+        second.flush()
+        reload, remote = second.drain()
+        self.assertIsNone(reload)
+        self.assertAlmostEqual(remote['morning']['focus'], 0.5, places=6)
+        self.assertAlmostEqual(self.open().load()['morning']['focus'], DEFAULT_Q + 0.75, places=6)
+
+    def test_torn_journal_tail_is_truncated(self):
+        store = self.open()
+        store.load()
+        store.record('morning', 'focus', 0.5)
+        store.flush()
+        store.close()
+        with open(store.journal_path, 'ab') as f:
+            f.write(b'\x01\x02\x03 torn record')
+
+        store = self.open()
+        self.assertAlmostEqual(store.load()['morning']['focus'], DEFAULT_Q + 0.5, places=6)
+        store.record('morning', 'focus', 0.25)
+        store.flush()
+        self.assertAlmostEqual(self.open().load()['morning']['focus'], DEFAULT_Q + 0.75, places=6)
+
+    def test_compaction_is_adopted_by_other_writers(self):
+        first, second = self.open(), self.open()
+        first.load(), second.load()
+        first.record('morning', 'focus', 0.5)
+        first.compact()
+        self.assertEqual(first.generation, 1)
+
+        second.record('night', 'breaks', 0.25)
+        second.flush()
+        reload, _ = second.drain()
+        self.assertAlmostEqual(reload['morning']['focus'], DEFAULT_Q + 0.5, places=6)
+        self.assertAlmostEqual(reload['night']['breaks'], DEFAULT_Q + 0.25, places=6)
+        table = self.open().load()
+        self.assertAlmostEqual(table['night']['breaks'], DEFAULT_Q + 0.25, places=6)
+
+    def test_changed_categories_are_relaid(self):
+        store = self.open()
+        store.load()
+        store.record('morning', 'breaks', 0.5)
+        store.close()
+
+        table = self.open(categories=['breaks', 'hydration']).load()
+        self.assertAlmostEqual(table['morning']['breaks'], DEFAULT_Q + 0.5, places=6)
+        self.assertAlmostEqual(table['morning']['hydration'], DEFAULT_Q, places=6)
+
+
+class FeedbackLedgerTest(PolicyStoreTestCase):
+
+    def open(self, **kwargs):
+        return FeedbackLedger(os.path.join(self.directory, 'feedback'), **kwargs)
+
+    def test_in_memory(self):
+        ledger = FeedbackLedger()
+        self.assertIsNone(ledger.apply('s1', 1.0))
+        self.assertEqual(ledger.apply('s1', -0.2), 1.0)
+
+    def test_shared_between_processes(self):
+        first, second = self.open(), self.open()
+        self.assertIsNone(first.apply('s1', 1.0))
+        self.assertEqual(second.apply('s1', 1.0), 1.0)
+        self.assertEqual(first.apply('s1', -0.2), 1.0)
+        self.assertEqual(self.open().apply('s1', 0.5), -0.2)
+
+    def test_torn_tail_is_truncated(self):
+        ledger = self.open()
+        ledger.apply('s1', 0.5)
+        with open(ledger.path, 'ab') as f:
+            f.write(b'\xff\xfe torn')
+        ledger = self.open()
+        self.assertEqual(ledger.apply('s1', 1.0), 0.5)
+        self.assertIsNone(ledger.apply('s2', 1.0))
+        self.assertEqual(self.open().apply('s2', 1.0), 1.0)
+
+    def test_rewrite_keeps_newest(self):
+        ledger = self.open(capacity=4)
+        for i in range(8):
+            ledger.apply(f"s{i}", 0.5)
+        self.assertEqual(ledger.generation, 1)
+        self.assertLess(os.path.getsize(ledger.path), 8 * 20)
+        other = self.open(capacity=4)
+        self.assertIsNone(other.apply('s0', 1.0))
+        self.assertEqual(other.apply('s7', 1.0), 0.5)
+
+
+class PolicyTablesTest(PolicyStoreTestCase):
+
+    def open(self, **kwargs):
+        tables = PolicyTables(CATEGORIES, directory=self.directory, shards=2, **kwargs)
+        self.addCleanup(tables.close)
+        return tables
+
+    def test_round_trip(self):
+        tables = self.open()
+        tables.update('alice', 'morning', 'focus', 0.5)
+        tables.update('alice', 'morning', 'focus', 0.25)
+        tables.update('bob', 'night', 'breaks', -0.1)
+        np.testing.assert_allclose(tables.offsets('alice', 'morning'), [0.75, 0, 0])
+        np.testing.assert_array_equal(tables.offsets('carol', 'morning'), [0, 0, 0])
+        tables.close()
+
+        tables = self.open()
+        np.testing.assert_allclose(tables.offsets('alice', 'morning'), [0.75, 0, 0])
+        np.testing.assert_allclose(tables.offsets('bob', 'night'), [0, -0.1, 0], rtol=1e-6)
+
+    def test_evicted_users_are_read_back(self):
+        tables = self.open(memory_budget=2 * 1024)
+        for i in range(20):
+            tables.update(f"user{i}", 'morning', 'organization', float(i))
+        self.assertGreater(tables.stats()['evictions'], 0)
+        for i in range(20):
+            np.testing.assert_array_equal(tables.offsets(f"user{i}", 'morning'), [0, 0, float(i)])
+
+    def test_in_memory(self):
+        tables = PolicyTables(CATEGORIES, shards=2)
+        tables.update('alice', 'morning', 'breaks', 0.5)
+        np.testing.assert_array_equal(tables.offsets('alice', 'morning'), [0, 0.5, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
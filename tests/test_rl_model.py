@@ -0,0 +1,90 @@
+"""Feedback attribution across workers sharing the model's files. Run from the repository root:
+
+    python -m unittest discover -s tests
+"""
+import logging
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from data_processor import DataProcessor
+from rl_model import RLModel
+
+SECRET = 'test-secret'
+
+
+class FeedbackAcrossWorkersTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+        activities = [{'application_name': app, 'duration': 60, 'timestamp': f"2026-03-04T09:{minute:02d}:00"}
+                      for minute, app in enumerate(['code', 'slack', 'code', 'chrome', 'code'])]
+        cls.features = DataProcessor(incremental=False).process_activities(activities,
+                                                                           as_of=datetime(2026, 3, 4, 9, 30))
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.state_path = os.path.join(tmp.name, 'q.bin')
+
+    def worker(self, **kwargs):
+        model = RLModel(state_path=self.state_path, checkpoint_interval=0.01, id_secret=SECRET, **kwargs)
+        self.addCleanup(model.close)
+        return model
+
+    def suggestion(self, model):
+        item = model.generate_suggestion_items(self.features)[0]
+        state_key = model.suggestion_history.parse_id(item['id'])[0]
+        return item, state_key
+
+    def test_feedback_counts_once_whichever_worker_gets_it(self):
+        first, second = self.worker(), self.worker()
+        item, state_key = self.suggestion(first)
+        category = item['category']
+
+        self.assertTrue(second.update_from_feedback({'id': item['id']}, 'helpful'))
+        second.policy_store.flush()
+        # Resent to the worker that made the suggestion, and again to the other one
+        self.assertTrue(first.update_from_feedback({'id': item['id']}, 'helpful'))
+        self.assertTrue(second.update_from_feedback({'id': item['id']}, 'helpful'))
+        first.policy_store.flush()
+        first._sync_policy()
+        self.assertAlmostEqual(first.q_values[state_key][category], 0.2, places=6)
+
+        # Changing the rating replaces the earlier reward
+        self.assertTrue(first.update_from_feedback({'id': item['id']}, 'not_helpful'))
+        self.assertAlmostEqual(first.q_values[state_key][category], 0.08, places=6)
+        first.close()
+        second.close()
+        self.assertAlmostEqual(self.worker().q_values[state_key][category], 0.08, places=6)
+
+    def test_forged_ids_are_ignored(self):
+        first, second = self.worker(), self.worker()
+        item, state_key = self.suggestion(first)
+        head, _, tag = item['id'].rpartition('.')
+        forged = f"{head}.{'A' if tag[0] != 'A' else 'B'}{tag[1:]}"
+        self.assertTrue(second.update_from_feedback({'id': forged}, 'helpful'))
+        self.assertNotIn(state_key, second.q_values)
+
+        stranger = RLModel(id_secret='other-secret')
+        self.addCleanup(stranger.close)
+        self.assertTrue(stranger.update_from_feedback({'id': item['id']}, 'helpful'))
+        self.assertNotIn(state_key, stranger.q_values)
+
+    def test_bandit_learns_each_suggestion_once(self):
+        bandit_path = os.path.join(os.path.dirname(self.state_path), 'bandit.npz')
+        first, second = (self.worker(policy='linucb', bandit_path=bandit_path) for _ in range(2))
+        item, _ = self.suggestion(first)
+        for model, feedback in ((second, 'helpful'), (first, 'helpful'), (second, 'not_helpful')):
+            self.assertTrue(model.update_from_feedback({'id': item['id']}, feedback))
+        self.assertEqual(first.bandit.counts.sum() + second.bandit.counts.sum(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Collector wire format round trips and malformed input. Run from the repository root:
+
+    python -m unittest discover -s tests
+"""
+import unittest
+import zlib
+
+import wire_format
+from wire_format import FrameError, encode_frame, iter_frames
+
+
+def records(n):
+    return [{'application_name': f"app{i}", 'duration': i, 'timestamp': f"2026-03-04T09:{i % 60:02d}:00"}
+            for i in range(n)]
+
+
+class WireFormatTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for n in (0, 1, 200):
+            with self.subTest(records=n):
+                body = encode_frame(wire_format.FRAME_ACTIVITIES, records(n))
+                self.assertEqual(list(iter_frames(body)), [(wire_format.FRAME_ACTIVITIES, records(n))])
+
+    def test_large_frames_are_compressed(self):
+        small = encode_frame(wire_format.FRAME_HEALTH, records(1))
+        large = encode_frame(wire_format.FRAME_HEALTH, records(200))
+        self.assertFalse(small[4] & wire_format.FLAG_ZLIB)
+        self.assertTrue(large[4] & wire_format.FLAG_ZLIB)
+
+    def test_several_frames_in_one_body(self):
+        body = (encode_frame(wire_format.FRAME_DEVICE, [{'device_id': 'd1'}])
+                + encode_frame(wire_format.FRAME_ACTIVITIES, records(100))
+                + encode_frame(wire_format.FRAME_HEALTH, [{'cpu_percent': 12.5}]))
+        frames = list(iter_frames(body))
+        self.assertEqual([frame_type for frame_type, _ in frames],
+                         [wire_format.FRAME_DEVICE, wire_format.FRAME_ACTIVITIES, wire_format.FRAME_HEALTH])
+        self.assertEqual(frames[1][1], records(100))
+
+    def test_truncated_body(self):
+        body = encode_frame(wire_format.FRAME_ACTIVITIES, records(100))
+        for cut in (3, wire_format.HEADER.size, len(body) - 1):
+            with self.subTest(cut=cut), self.assertRaises(FrameError):
+                list(iter_frames(body[:cut]))
+
+    def test_malformed_frames(self):
+        def frame(payload, flags=0, magic=wire_format.MAGIC, version=wire_format.VERSION):
+            return wire_format.HEADER.pack(magic, version, wire_format.FRAME_ACTIVITIES, flags, len(payload)) + payload
+
+        cases = {
+            'bad magic': frame(b'[]', magic=b'XX'),
+            'unknown version': frame(b'[]', version=wire_format.VERSION + 1),
+            'not json': frame(b'[{'),
+            'not a list': frame(b'{"a": 1}'),
+            'not objects': frame(b'[1, 2]'),
+            'corrupt zlib': frame(b'not zlib', flags=wire_format.FLAG_ZLIB),
+            'zlib bomb': frame(zlib.compress(b' ' * (wire_format.MAX_DECOMPRESSED + 1)), flags=wire_format.FLAG_ZLIB),
+        }
+        for name, body in cases.items():
+            with self.subTest(name), self.assertRaises(FrameError):
+                list(iter_frames(body))
+
+    def test_device_token(self):
+        token = wire_format.device_token('secret', 'device-1')
+        self.assertEqual(token, wire_format.device_token(b'secret', 'device-1'))
+        self.assertNotEqual(token, wire_format.device_token('secret', 'device-2'))
+        self.assertNotEqual(token, wire_format.device_token('other', 'device-1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
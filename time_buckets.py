@@ -0,0 +1,255 @@
+import logging
+from datetime import datetime, timedelta
+
+from sketches import CountMinSketch, HeavyHitters
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+
+
+def wall_seconds(timestamp):
+    """Seconds since 1970-01-01 on the timestamp's own wall clock (matches the .hour features use)"""
+    return (timestamp.replace(tzinfo=None) - EPOCH).total_seconds()
+
+
+def from_wall_seconds(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+
+class Bucket:
+    """Pre-aggregated activity counters for one minute, hour or day"""
+
+    __slots__ = ('count', 'app_durations', 'hour_counts', 'transitions', 'workflows', 'first', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.app_durations = {}
+        self.hour_counts = {}  # (day index, hour) -> activities, so day buckets keep weekday and hour
+        self.transitions = {}
+        self.workflows = {}
+        self.first = None
+        self.last = None
+
+    def add(self, seconds, app, duration, transition=None, workflow=None):
+        self.count += 1
+        if app is not None:
+            self.app_durations[app] = self.app_durations.get(app, 0) + duration
+        slot = (int(seconds // DAY), int(seconds % DAY // HOUR))
+        self.hour_counts[slot] = self.hour_counts.get(slot, 0) + 1
+        if transition is not None:
+            self._count_transition(transition)
+        if workflow is not None:
+            self._count_workflow(workflow)
+        if self.first is None or seconds < self.first:
+            self.first = seconds
+        if self.last is None or seconds > self.last:
+            self.last = seconds
+
+    def _count_transition(self, key):
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+
+    def _count_workflow(self, key):
+        self.workflows[key] = self.workflows.get(key, 0) + 1
+
+    def transition_counts(self):
+        """{(app, app): count} of the transitions in this bucket"""
+        return dict(self.transitions)
+
+    def workflow_counts(self):
+        return dict(self.workflows)
+
+    def _merge_ngrams(self, other):
+        for mine, theirs in ((self.transitions, other.transitions), (self.workflows, other.workflows)):
+            for key, value in theirs.items():
+                mine[key] = mine.get(key, 0) + value
+
+    def merge(self, other):
+        self.count += other.count
+        for mine, theirs in ((self.app_durations, other.app_durations), (self.hour_counts, other.hour_counts)):
+            for key, value in theirs.items():
+                mine[key] = mine.get(key, 0) + value
+        self._merge_ngrams(other)
+        if other.first is not None and (self.first is None or other.first < self.first):
+            self.first = other.first
+        if other.last is not None and (self.last is None or other.last > self.last):
+            self.last = other.last
+        return self
+
+
+class SketchBucket(Bucket):
+    """Bucket whose transition and workflow counts move into small Count-Min sketches as they grow.
+
+    Counts stay exact up to `exact_limit` distinct n-grams (most minute
+    buckets never get there); past that they go into a Count-Min sketch with
+    heavy-hitter candidates, so a bucket never costs more than two
+    width x depth sketches however many distinct n-grams fall in it.
+    Sketched counts are estimates that never undercount.
+    """
+
+    __slots__ = ('top_transitions', 'top_workflows', 'width', 'depth', 'exact_limit')
+
+    def __init__(self, top_transitions=5, top_workflows=3, width=128, depth=4, exact_limit=32):
+        super().__init__()
+        self.top_transitions = top_transitions
+        self.top_workflows = top_workflows
+        self.width = width
+        self.depth = depth
+        self.exact_limit = exact_limit
+
+    def _hitters(self, counts, k):
+        if isinstance(counts, HeavyHitters):
+            return counts
+        hitters = HeavyHitters(k, CountMinSketch(self.width, self.depth))
+        for key, value in counts.items():
+            hitters.add(key, value)
+        return hitters
+
+    def _add(self, counts, key, value, k):
+        if isinstance(counts, HeavyHitters):
+            counts.add(key, value)
+            return counts
+        counts[key] = counts.get(key, 0) + value
+        return self._hitters(counts, k) if len(counts) > self.exact_limit else counts
+
+    def _count_transition(self, key):
+        self.transitions = self._add(self.transitions, key, 1, self.top_transitions)
+
+    def _count_workflow(self, key):
+        self.workflows = self._add(self.workflows, key, 1, self.top_workflows)
+
+    @staticmethod
+    def _estimates(counts):
+        if isinstance(counts, HeavyHitters):
+            return {key: counts.sketch.estimate(key) for key in counts.candidates}
+        return dict(counts)
+
+    def transition_counts(self):
+        return self._estimates(self.transitions)
+
+    def workflow_counts(self):
+        return self._estimates(self.workflows)
+
+    def _merge_counts(self, mine, theirs, k):
+        if isinstance(theirs, HeavyHitters):
+            return self._hitters(mine, k).merge(theirs)
+        for key, value in theirs.items():
+            mine = self._add(mine, key, value, k)
+        return mine
+
+    def _merge_ngrams(self, other):
+        self.transitions = self._merge_counts(self.transitions, other.transitions, self.top_transitions)
+        self.workflows = self._merge_counts(self.workflows, other.workflows, self.top_workflows)
+
+
+class TimeBuckets:
+    """Minute, hour and day pre-aggregates of one activity stream.
+
+    Every activity is added to one bucket per level. A window query covers
+    its whole days with day buckets, the remaining whole hours with hour
+    buckets and the ragged edges with minute buckets, so it sums O(days + 48
+    + 120) buckets however many activities fall inside. Minute and hour
+    buckets are kept for a limited time; edges older than that are answered
+    at the next coarser level, so they may include activities just outside
+    the window.
+
+    `max_buckets` caps how many buckets each level keeps, dropping the
+    oldest first, so memory is bounded by 3 * max_buckets buckets whatever
+    the retention; `bucket_factory` builds empty buckets (SketchBucket for
+    fixed-size n-gram counts).
+    """
+
+    def __init__(self, minute_retention=6 * HOUR, hour_retention=31 * DAY, day_retention=731 * DAY,
+                 max_buckets=None, bucket_factory=Bucket):
+        self.retention = {MINUTE: minute_retention, HOUR: hour_retention, DAY: day_retention}
+        self.max_buckets = max_buckets
+        self.bucket_factory = bucket_factory
+        self.levels = {MINUTE: {}, HOUR: {}, DAY: {}}
+        self._oldest = {MINUTE: None, HOUR: None, DAY: None}  # lowest index that may still be stored
+        self._floor = {MINUTE: None, HOUR: None, DAY: None}  # buckets below this were dropped by max_buckets
+        self.latest = None
+
+    def add(self, seconds, app, duration, transition=None, workflow=None):
+        for width, buckets in self.levels.items():
+            index = int(seconds // width)
+            bucket = buckets.get(index)
+            if bucket is None:
+                floor = self._floor[width]
+                if floor is not None and index < floor:
+                    continue
+                bucket = buckets[index] = self.bucket_factory()
+                if self._oldest[width] is None or index < self._oldest[width]:
+                    self._oldest[width] = index
+                if self.max_buckets is not None and len(buckets) > self.max_buckets:
+                    self._drop_oldest(width)
+                    if index not in buckets:
+                        continue
+            bucket.add(seconds, app, duration, transition, workflow)
+        if self.latest is None or seconds > self.latest:
+            self.latest = seconds
+            self.prune()
+
+    def prune(self):
+        """Drop buckets past their level's retention; costs O(expired buckets)"""
+        if self.latest is None:
+            return
+        for width, buckets in self.levels.items():
+            cutoff = int((self.latest - self.retention[width]) // width)
+            oldest = self._oldest[width]
+            if oldest is None or oldest >= cutoff:
+                continue
+            if cutoff - oldest > len(buckets):
+                for index in [index for index in buckets if index < cutoff]:
+                    del buckets[index]
+            else:
+                for index in range(oldest, cutoff):
+                    buckets.pop(index, None)
+            self._oldest[width] = cutoff
+
+    def _drop_oldest(self, width):
+        buckets = self.levels[width]
+        index = self._oldest[width]
+        while index not in buckets:
+            index += 1
+        del buckets[index]
+        self._oldest[width] = self._floor[width] = index + 1
+
+    def _retained(self, width, index):
+        if self.latest is None or index < int((self.latest - self.retention[width]) // width):
+            return False
+        floor = self._floor[width]
+        return floor is None or index >= floor
+
+    def _cover(self, start, end, widths):
+        """Yield (width, index) buckets covering [start, end), coarsest level first"""
+        width = widths[0]
+        first = -(-int(start) // width)  # ceil
+        last = int(end) // width
+        # A finer level is only usable while its retention still reaches this sub-range
+        finer = [finer_width for finer_width in widths[1:] if self._retained(finer_width, int(start // finer_width))]
+        if not finer:
+            # Finest level: include every bucket overlapping the range
+            for index in range(int(start) // width, -(-int(end) // width)):
+                yield width, index
+            return
+        if first >= last:
+            yield from self._cover(start, end, finer)
+            return
+        yield from self._cover(start, first * width, finer)
+        for index in range(first, last):
+            yield width, index
+        yield from self._cover(last * width, end, finer)
+
+    def query(self, start, end):
+        """Sum of the buckets covering [start, end) in wall-clock seconds"""
+        total = self.bucket_factory()
+        if self.latest is None or end <= start:
+            return total
+        for width, index in self._cover(start, end, (DAY, HOUR, MINUTE)):
+            bucket = self.levels[width].get(index)
+            if bucket is not None:
+                total.merge(bucket)
+        return total
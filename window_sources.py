@@ -0,0 +1,287 @@
+import platform
+import logging
+import subprocess
+from collections import OrderedDict
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+def _empty_window_info():
+    return {
+        'application_name': '',
+        'window_title': '',
+        'pid': None
+    }
+
+
+class ProcessNameCache:
+    """Bounded pid -> process name cache so we don't build a psutil.Process on every sample"""
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._names = OrderedDict()
+
+    def get(self, pid):
+        """Return the process name for a pid, resolving it through psutil on a miss"""
+        if pid is None:
+            return ''
+        name = self._names.get(pid)
+        if name is not None:
+            self._names.move_to_end(pid)
+            return name
+        try:
+            name = psutil.Process(pid).name()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return ''
+        self._names[pid] = name
+        if len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+        return name
+
+
+class WindowSource:
+    """Base class for platform backends that report the foreground window"""
+
+    name = 'base'
+
+    def __init__(self, process_names=None):
+        self.process_names = process_names or ProcessNameCache()
+
+    def get_active_window_info(self):
+        """Return a dict with application_name, window_title and pid"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the backend"""
+        pass
+
+
+class XlibWindowSource(WindowSource):
+    """Linux backend that keeps one X connection open and caches the active window.
+
+    The root window is subscribed to PropertyNotify so that changes of
+    _NET_ACTIVE_WINDOW (and title changes on the active window) mark the cache
+    dirty. Samples only drain pending events and re-query X when something changed.
+    """
+
+    name = 'xlib'
+
+    def __init__(self, display_name=None, process_names=None):
+        super().__init__(process_names)
+        # python-xlib is optional; ImportError lets the factory fall back to xdotool
+        from Xlib import X, display as xdisplay
+
+        self._X = X
+        self._display = xdisplay.Display(display_name)
+        self._root = self._display.screen().root
+        self._atom_active = self._display.intern_atom('_NET_ACTIVE_WINDOW')
+        self._atom_name = self._display.intern_atom('_NET_WM_NAME')
+        self._atom_pid = self._display.intern_atom('_NET_WM_PID')
+        self._atom_utf8 = self._display.intern_atom('UTF8_STRING')
+        self._watched_atoms = {self._atom_active, self._atom_name, X.WM_NAME}
+
+        self._root.change_attributes(event_mask=X.PropertyChangeMask)
+        self._active_window = None
+        self._cached = _empty_window_info()
+        self._dirty = True
+
+    def _drain_events(self):
+        """Consume queued X events and note whether the cached info is stale"""
+        while self._display.pending_events():
+            event = self._display.next_event()
+            if event.type == self._X.PropertyNotify and event.atom in self._watched_atoms:
+                self._dirty = True
+
+    def _get_property(self, window, atom, prop_type):
+        prop = window.get_full_property(atom, prop_type)
+        return prop.value if prop else None
+
+    def _refresh(self):
+        """Re-read the active window, its title and pid from the X server"""
+        info = _empty_window_info()
+        value = self._get_property(self._root, self._atom_active, self._X.AnyPropertyType)
+        window_id = int(value[0]) if value is not None and len(value) else 0
+
+        if not window_id:
+            self._active_window = None
+            self._cached = info
+            return
+
+        window = self._display.create_resource_object('window', window_id)
+        if self._active_window is None or self._active_window.id != window_id:
+            # Follow title changes on the new active window as well
+            try:
+                window.change_attributes(event_mask=self._X.PropertyChangeMask)
+            except Exception:
+                pass
+            self._active_window = window
+
+        title = self._get_property(window, self._atom_name, self._atom_utf8)
+        if title is None:
+            title = self._get_property(window, self._X.WM_NAME, self._X.AnyPropertyType)
+        if isinstance(title, bytes):
+            title = title.decode('utf-8', 'replace')
+        info['window_title'] = title or ''
+
+        pid = self._get_property(window, self._atom_pid, self._X.AnyPropertyType)
+        if pid is not None and len(pid):
+            info['pid'] = int(pid[0])
+            info['application_name'] = self.process_names.get(info['pid'])
+
+        self._cached = info
+
+    def get_active_window_info(self):
+        try:
+            self._drain_events()
+            if self._dirty:
+                self._dirty = False
+                self._refresh()
+        except Exception as e:
+            logger.error(f"Error getting Linux active window via Xlib: {str(e)}")
+            self._dirty = True
+            return _empty_window_info()
+        return dict(self._cached)
+
+    def close(self):
+        try:
+            self._display.close()
+        except Exception:
+            pass
+
+
+class XdotoolWindowSource(WindowSource):
+    """Linux fallback that queries xdotool, chaining all lookups into a single process"""
+
+    name = 'xdotool'
+
+    def get_active_window_info(self):
+        info = _empty_window_info()
+        try:
+            output = subprocess.check_output(
+                ['xdotool', 'getactivewindow', 'getwindowpid', 'getwindowname']
+            ).decode(errors='replace').split('\n', 1)
+            pid = int(output[0].strip())
+            info['pid'] = pid
+            info['window_title'] = output[1].strip() if len(output) > 1 else ''
+            info['application_name'] = self.process_names.get(pid)
+        except Exception as e:
+            logger.error(f"Error getting Linux active window: {str(e)}")
+        return info
+
+
+class Win32WindowSource(WindowSource):
+    """Windows backend using pywin32"""
+
+    name = 'win32'
+
+    def get_active_window_info(self):
+        info = _empty_window_info()
+        try:
+            import win32gui
+            import win32process
+
+            window = win32gui.GetForegroundWindow()
+            if window:
+                info['window_title'] = win32gui.GetWindowText(window)
+                _, pid = win32process.GetWindowThreadProcessId(window)
+                info['pid'] = pid
+                info['application_name'] = self.process_names.get(pid)
+        except Exception as e:
+            logger.error(f"Error getting Windows active window: {str(e)}")
+        return info
+
+
+class AppleScriptWindowSource(WindowSource):
+    """MacOS backend using osascript"""
+
+    name = 'applescript'
+
+    script = '''
+    tell application "System Events"
+        set frontApp to name of first application process whose frontmost is true
+        set frontAppPath to path of first application process whose frontmost is true
+        set windowTitle to ""
+        tell process frontApp
+            if exists (1st window whose value of attribute "AXMain" is true) then
+                set windowTitle to name of 1st window whose value of attribute "AXMain" is true
+            end if
+        end tell
+        return {frontApp, windowTitle, frontAppPath}
+    end tell
+    '''
+
+    def get_active_window_info(self):
+        info = _empty_window_info()
+        try:
+            result = subprocess.check_output(['osascript', '-e', self.script]).decode().strip()
+            parts = result.split(', ')
+
+            info['application_name'] = parts[0] if len(parts) > 0 else ''
+            info['window_title'] = parts[1] if len(parts) > 1 else ''
+
+            # Try to find the PID of the application
+            for proc in psutil.process_iter(['pid', 'name']):
+                if proc.info['name'] and info['application_name'] in proc.info['name']:
+                    info['pid'] = proc.info['pid']
+                    break
+        except Exception as e:
+            logger.error(f"Error getting MacOS active window: {str(e)}")
+        return info
+
+
+class FakeWindowSource(WindowSource):
+    """In-process backend for tests and benchmarks.
+
+    Either set the window explicitly with set_active() or pass a list of
+    window info dicts that are replayed one per sample (the last one repeats).
+    """
+
+    name = 'fake'
+
+    def __init__(self, windows=None, process_names=None):
+        super().__init__(process_names)
+        self._windows = list(windows or [])
+        self._index = 0
+        self._current = _empty_window_info()
+
+    def set_active(self, application_name, window_title='', pid=None):
+        self._current = {
+            'application_name': application_name,
+            'window_title': window_title,
+            'pid': pid
+        }
+
+    def get_active_window_info(self):
+        if self._windows:
+            window = self._windows[min(self._index, len(self._windows) - 1)]
+            self._index += 1
+            self._current = {**_empty_window_info(), **window}
+        return dict(self._current)
+
+
+class NullWindowSource(WindowSource):
+    """Backend for platforms without foreground window support"""
+
+    name = 'null'
+
+    def get_active_window_info(self):
+        return _empty_window_info()
+
+
+def create_window_source(system=None, display_name=None):
+    """Pick the best window backend available for the platform"""
+    system = system or platform.system()
+
+    if system == 'Linux':
+        try:
+            return XlibWindowSource(display_name=display_name)
+        except Exception as e:
+            logger.warning(f"Xlib window backend unavailable, falling back to xdotool: {str(e)}")
+            return XdotoolWindowSource()
+    elif system == 'Windows':
+        return Win32WindowSource()
+    elif system == 'Darwin':
+        return AppleScriptWindowSource()
+
+    return NullWindowSource()
@@ -0,0 +1,104 @@
+"""Compact framing used between the collector agent and the /api/ingest endpoint.
+
+Each frame is a fixed 9-byte header followed by the payload:
+
+    magic (2s, b'WF') | version (B) | frame type (B) | flags (B) | payload length (I, big-endian)
+
+The payload is a compact JSON array of records (objects), zlib-compressed
+when the FLAG_ZLIB bit is set. A payload may not exceed MAX_PAYLOAD bytes
+on the wire nor MAX_DECOMPRESSED bytes once inflated. Frames are simply concatenated in a request body or
+spool file. Only the standard library is used so the agent stays light.
+"""
+import hmac
+import json
+import zlib
+import struct
+import hashlib
+
+MAGIC = b'WF'
+VERSION = 1
+
+FRAME_ACTIVITIES = 1
+FRAME_HEALTH = 2
+FRAME_DEVICE = 3
+
+FLAG_ZLIB = 0x01
+
+HEADER = struct.Struct('>2sBBBI')
+MAX_PAYLOAD = 16 * 1024 * 1024
+MAX_DECOMPRESSED = 64 * 1024 * 1024
+COMPRESS_THRESHOLD = 512  # bytes; smaller payloads aren't worth compressing
+
+CONTENT_TYPE = 'application/x-workflowai-frames'
+
+
+class FrameError(ValueError):
+    """Raised when a frame can't be decoded"""
+
+
+def device_token(secret, device_id):
+    """Bearer token a device sends with its uploads: HMAC-SHA256 of its id under the server secret"""
+    key = secret.encode('utf-8') if isinstance(secret, str) else secret
+    return hmac.new(key, f"device:{device_id}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def encode_frame(frame_type, records):
+    """Encode a list of JSON-serialisable records into one frame"""
+    payload = json.dumps(records, separators=(',', ':'), default=str).encode('utf-8')
+    if len(payload) > MAX_DECOMPRESSED:
+        raise FrameError(f"Frame records too large: {len(payload)} bytes")
+    flags = 0
+    if len(payload) >= COMPRESS_THRESHOLD:
+        payload = zlib.compress(payload, 6)
+        flags |= FLAG_ZLIB
+    if len(payload) > MAX_PAYLOAD:
+        raise FrameError(f"Frame payload too large: {len(payload)} bytes")
+    return HEADER.pack(MAGIC, VERSION, frame_type, flags, len(payload)) + payload
+
+
+def _inflate(payload):
+    # Bounded so a small compressed frame can't expand into gigabytes (zlib bomb)
+    inflater = zlib.decompressobj()
+    try:
+        data = inflater.decompress(payload, MAX_DECOMPRESSED)
+    except zlib.error as e:
+        raise FrameError(f"Corrupt compressed payload: {str(e)}")
+    if inflater.unconsumed_tail:
+        raise FrameError(f"Frame payload inflates past {MAX_DECOMPRESSED} bytes")
+    if not inflater.eof:
+        raise FrameError("Truncated compressed payload")
+    return data
+
+
+def _decode_records(payload):
+    try:
+        records = json.loads(payload)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise FrameError(f"Bad frame JSON: {str(e)}")
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise FrameError("Frame payload must be a JSON array of objects")
+    return records
+
+
+def iter_frames(data):
+    """Yield (frame_type, records) for each frame in a byte string; raises FrameError on any malformed frame"""
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        if len(view) - offset < HEADER.size:
+            raise FrameError("Truncated frame header")
+        magic, version, frame_type, flags, length = HEADER.unpack_from(view, offset)
+        if magic != MAGIC:
+            raise FrameError("Bad frame magic")
+        if version != VERSION:
+            raise FrameError(f"Unsupported frame version {version}")
+        if length > MAX_PAYLOAD:
+            raise FrameError(f"Frame payload too large: {length} bytes")
+        offset += HEADER.size
+        if len(view) - offset < length:
+            raise FrameError("Truncated frame payload")
+        payload = view[offset:offset + length].tobytes()
+        offset += length
+        if flags & FLAG_ZLIB:
+            payload = _inflate(payload)
+        yield frame_type, _decode_records(payload)
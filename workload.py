@@ -0,0 +1,149 @@
+import uuid
+import random
+import logging
+from itertools import accumulate
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# (application name, category, relative popularity, mean focus seconds, typical window titles)
+DEFAULT_APP_MIX = [
+    ('Code', 'high', 8, 900, ['main.py - project', 'README.md - project', 'app.py - project']),
+    ('Terminal', 'high', 5, 240, ['bash', 'python', 'git log']),
+    ('Excel', 'high', 2, 600, ['Budget.xlsx', 'Report Q3.xlsx']),
+    ('Word', 'high', 2, 720, ['Proposal.docx', 'Notes.docx']),
+    ('Chrome', 'medium', 9, 300, ['Stack Overflow', 'GitHub', 'Documentation', 'Gmail']),
+    ('Outlook', 'medium', 3, 180, ['Inbox', 'Calendar']),
+    ('Slack', 'medium', 6, 90, ['#general', '#dev', 'Direct message']),
+    ('Teams', 'medium', 3, 1500, ['Meeting', 'Chat']),
+    ('Spotify', 'low', 1, 60, ['Playlist']),
+    ('YouTube', 'low', 1, 420, ['Video']),
+]
+
+# Relative activity level per hour of day (0-23) on a working day
+DIURNAL_PROFILE = [
+    0.02, 0.01, 0.01, 0.01, 0.01, 0.03, 0.10, 0.35,
+    0.80, 1.00, 1.00, 0.95, 0.60, 0.85, 1.00, 0.95,
+    0.85, 0.60, 0.35, 0.30, 0.30, 0.20, 0.10, 0.05
+]
+WEEKEND_FACTOR = 0.25
+
+
+class WorkloadGenerator:
+    """Seeded generator of realistic activity streams for load testing.
+
+    Each user gets a Markov chain over the app mix (sticky within categories),
+    session timing that follows a diurnal and weekly profile, and optional
+    health samples that follow the same activity profile. Everything is
+    produced lazily, so 10M events per user can be streamed in constant memory.
+    """
+
+    def __init__(self, seed=0, app_mix=None, start=None, switch_affinity=3.0, diurnal=None):
+        self.seed = seed
+        self.app_mix = app_mix or DEFAULT_APP_MIX
+        self.start = start or datetime(2024, 1, 1, 0, 0, 0)
+        self.switch_affinity = switch_affinity
+        self.diurnal = diurnal or DIURNAL_PROFILE
+
+    def user_id(self, index):
+        return f"user-{index:06d}"
+
+    def _rng(self, user_index, stream):
+        return random.Random(f"{self.seed}:{user_index}:{stream}")
+
+    def _transition_weights(self, rng):
+        """Per-user transition matrix: rows are the current app, columns the next"""
+        # Users differ in which apps they favour
+        preference = [weight * rng.uniform(0.5, 1.5) for _, _, weight, _, _ in self.app_mix]
+        matrix = []
+        for i, (_, category, _, _, _) in enumerate(self.app_mix):
+            row = []
+            for j, (_, next_category, _, _, _) in enumerate(self.app_mix):
+                if i == j:
+                    row.append(0.0)
+                    continue
+                affinity = self.switch_affinity if category == next_category else 1.0
+                row.append(preference[j] * affinity)
+            matrix.append(row)
+        return matrix
+
+    def _activity_level(self, when):
+        level = self.diurnal[when.hour]
+        if when.weekday() >= 5:
+            level *= WEEKEND_FACTOR
+        return level
+
+    def iter_activities(self, user_index, count, device_id=None):
+        """Yield `count` activity dicts for one user in timestamp order"""
+        rng = self._rng(user_index, 'activities')
+        # Cumulative weights avoid re-summing each row on every draw
+        cumulative = [list(accumulate(row)) for row in self._transition_weights(rng)]
+        indices = list(range(len(self.app_mix)))
+        user_id = self.user_id(user_index)
+        device_id = device_id or f"{user_id}-device"
+        session_id = str(uuid.UUID(int=rng.getrandbits(128)))
+
+        current = rng.choices(indices, weights=[a[2] for a in self.app_mix])[0]
+        now = self.start + timedelta(seconds=rng.randint(0, 3600))
+
+        for _ in range(count):
+            # Skip quiet hours: the lower the activity level the likelier a gap
+            while rng.random() > self._activity_level(now):
+                now += timedelta(minutes=rng.randint(5, 60))
+                if rng.random() < 0.3:
+                    session_id = str(uuid.UUID(int=rng.getrandbits(128)))
+
+            name, category, _, mean_focus, titles = self.app_mix[current]
+            duration = max(2, int(rng.expovariate(1.0 / mean_focus)))
+            idle_time = int(duration * rng.random() * 0.2) if rng.random() < 0.2 else 0
+            yield {
+                'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                'user_id': user_id,
+                'activity_type': 'app_usage',
+                'application_name': name,
+                'window_title': rng.choice(titles),
+                'duration': duration,
+                'device_id': device_id,
+                'session_id': session_id,
+                'timestamp': now.isoformat(),
+                'productivity_score': {'high': 0.8, 'medium': 0.5, 'low': 0.2}[category],
+                'activity_data': {'foreground': True},
+                'idle_time': idle_time
+            }
+
+            now += timedelta(seconds=duration + rng.randint(0, 5))
+            current = rng.choices(indices, cum_weights=cumulative[current])[0]
+
+    def iter_health_samples(self, user_index, count, interval=60, device_id=None):
+        """Yield `count` health samples spaced `interval` seconds apart"""
+        rng = self._rng(user_index, 'health')
+        device_id = device_id or f"{self.user_id(user_index)}-device"
+        now = self.start
+        cpu = 15.0
+        memory = 45.0
+        for _ in range(count):
+            level = self._activity_level(now)
+            # Mean-reverting walk towards a load proportional to activity
+            cpu += 0.3 * (5 + 50 * level - cpu) + rng.gauss(0, 5)
+            memory += 0.05 * (35 + 30 * level - memory) + rng.gauss(0, 1)
+            cpu = min(100.0, max(0.0, cpu))
+            memory = min(100.0, max(0.0, memory))
+            yield {
+                'device_id': device_id,
+                'cpu_usage': round(cpu, 1),
+                'memory_usage': round(memory, 1),
+                'disk_usage': 60.0,
+                'network_in': max(0.0, rng.gauss(50000 * level, 20000)),
+                'network_out': max(0.0, rng.gauss(10000 * level, 5000)),
+                'disk_read': max(0.0, rng.gauss(200000 * level, 50000)),
+                'disk_write': max(0.0, rng.gauss(100000 * level, 30000)),
+                'battery_level': None,
+                'processes_count': 250 + int(100 * level),
+                'timestamp': now.isoformat()
+            }
+            now += timedelta(seconds=interval)
+
+    def iter_users(self, n_users, events_per_user):
+        """Yield (user_id, activity iterator) pairs"""
+        for index in range(n_users):
+            yield self.user_id(index), self.iter_activities(index, events_per_user)